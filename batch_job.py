@@ -0,0 +1,229 @@
+# Bedrock 배치 추론 작업 (야간 재분석 등 오프라인 일괄 처리)
+# 로컬 파일에 적은 식단 사진/질문을 실시간 API와 같은 전처리·프롬프트(main.py)로 바꿔 배치 추론 작업 하나로 제출하고,
+# 끝나면 결과를 모아 JSONL로 저장합니다. 분당 호출 한도를 쓰지 않고 요금도 온디맨드보다 낮지만 결과는 보통 수 시간 걸립니다.
+# 사용법:
+#   python batch_job.py submit items.jsonl --s3 s3://버킷/caremeal-batch --role-arn arn:aws:iam::123456789012:role/BedrockBatch
+#       items.jsonl 한 줄: {"id": "m1", "user_id": "hong", "image": "photos/m1.jpg", "taken_at": "2024-05-01T12:30:00"}
+#                        {"id": "q1", "user_id": "hong", "question": "현미밥은 먹어도 되나요?"}
+#   python batch_job.py status <작업 ARN>
+#   python batch_job.py collect <작업 ARN> --out results.jsonl [--record-meals] [--wait]
+# 제출한 레코드별 정보(사용자, 사진 지문, 프롬프트 버전)는 batch_jobs/<작업 이름>.json에 남겨 collect에서 사용합니다.
+# 참고: 배치 추론은 작업당 최소 레코드 수(기본 100개) 제한이 있고, 지식베이스 검색(retrieve_and_generate)은 배치로 보낼 수 없어서
+#       질문은 RAG_BACKEND=local이면 로컬 인덱스 검색 결과를 넣은 프롬프트로, 아니면 기본 모델 폴백 프롬프트로 보냅니다.
+import argparse
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from datetime import datetime
+
+from fastapi import HTTPException
+
+import main
+
+JOB_DIR = "batch_jobs"
+MIN_RECORDS = 100
+TERMINAL_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+def control_clients():
+    # 배치 작업 관리는 bedrock(컨트롤 플레인)과 S3 클라이언트로 함
+    bedrock = main.create_aws_client(
+        "client", "bedrock", "BEDROCK_CONTROL", main.aws_client_config("BEDROCK_CONTROL", 10, 5, 60, "standard")
+    )
+    s3 = main.create_aws_client("client", "s3", "S3", main.aws_client_config("S3", 10, 5, 120, "standard"))
+    return bedrock, s3
+
+def split_s3_uri(uri):
+    if not uri.startswith("s3://"):
+        raise SystemExit(f"🚨 S3 주소가 아닙니다: {uri}")
+    bucket, _, prefix = uri[5:].partition("/")
+    return bucket, prefix.strip("/")
+
+def load_items(path):
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    for item in items:
+        if "id" not in item or "user_id" not in item or ("image" not in item and "question" not in item):
+            raise SystemExit(f"🚨 id, user_id와 image/question 중 하나가 필요합니다: {item}")
+    return items
+
+async def load_profiles(user_ids):
+    # 사용자별로 한 번만 조회
+    user_ids = sorted(set(user_ids))
+    profiles = await asyncio.gather(*(main.lookup_user_profile(user_id) for user_id in user_ids))
+    return dict(zip(user_ids, profiles))
+
+def build_record(item, profile):
+    # (배치 입력 modelInput, collect에서 쓸 레코드 정보)
+    info = {"id": item["id"], "user_id": item["user_id"], "member": profile is not None}
+    if "image" in item:
+        with open(item["image"], "rb") as f:
+            image_bytes, media_type, image_hash = main.preprocess_image(f, mimetypes.guess_type(item["image"])[0])
+        body, _, version = main.build_food_request(image_bytes, media_type, profile)
+        info.update(kind="food", filename=os.path.basename(item["image"]), image_hash=image_hash, taken_at=item.get("taken_at"))
+        return json.loads(body), {**info, "prompt_version": version}
+
+    question = item["question"]
+    prompt = main.build_chat_prompt(profile)
+    hits = main.search_local_kb(question) if main.local_index is not None else []
+    if hits:
+        model_input = main.build_local_rag_payload(prompt, question, hits)
+        sources = main.extract_citation_sources(main.local_references(hits))
+    else:
+        model_input = main.build_fallback_payload(prompt, question)
+        sources = [main.FALLBACK_SOURCE]
+    info.update(kind="chat", question=question, sources=sources)
+    return model_input, {**info, "prompt_version": prompt["version"]}
+
+def submit(args):
+    items = load_items(args.items)
+    profiles = asyncio.run(load_profiles(item["user_id"] for item in items))
+
+    lines = []
+    records = {}
+    for index, item in enumerate(items):
+        try:
+            model_input, info = build_record(item, profiles[item["user_id"]])
+        except (HTTPException, OSError) as e:
+            print(f"⚠️ 건너뜀 {item['id']}: {getattr(e, 'detail', e)}")
+            continue
+        record_id = f"REC{index:08d}"  # 배치 추론 recordId는 11자 영숫자
+        lines.append(json.dumps({"recordId": record_id, "modelInput": model_input}, ensure_ascii=False))
+        records[record_id] = info
+
+    if len(lines) < MIN_RECORDS:
+        print(f"⚠️ 레코드가 {len(lines)}개로 배치 추론 최소 개수({MIN_RECORDS})보다 적어 제출이 거절될 수 있습니다.")
+    if args.dry_run:
+        with open(args.dry_run, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        print(f"📝 배치 입력 파일만 생성: {args.dry_run} ({len(lines)}개)")
+        return
+
+    bedrock, s3 = control_clients()
+    job_name = args.job_name or f"caremeal-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    bucket, prefix = split_s3_uri(args.s3)
+    base_key = f"{prefix}/{job_name}".lstrip("/")
+    input_key = f"{base_key}/input.jsonl"
+    s3.put_object(Bucket=bucket, Key=input_key, Body=("\n".join(lines) + "\n").encode("utf-8"))
+
+    response = bedrock.create_model_invocation_job(
+        jobName=job_name,
+        roleArn=args.role_arn,
+        modelId=args.model_id,
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{bucket}/{input_key}", "s3InputFormat": "JSONL"}},
+        outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"s3://{bucket}/{base_key}/output/"}},
+    )
+    os.makedirs(JOB_DIR, exist_ok=True)
+    with open(os.path.join(JOB_DIR, f"{job_name}.json"), "w", encoding="utf-8") as f:
+        json.dump({"job_arn": response["jobArn"], "model_id": args.model_id, "records": records}, f, ensure_ascii=False, indent=2)
+    print(f"✅ 배치 작업 제출: {response['jobArn']} (레코드 {len(lines)}개)")
+
+def status(args):
+    bedrock, _ = control_clients()
+    job = bedrock.get_model_invocation_job(jobIdentifier=args.job_arn)
+    print(f"{job['jobName']}: {job['status']} {job.get('message', '')}".strip())
+    return job
+
+def read_job_output(s3, job):
+    # 결과는 <출력 S3 경로>/<작업 ID>/<입력 파일 이름>.out 에 JSONL로 저장됨
+    bucket, prefix = split_s3_uri(job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"])
+    job_id = job["jobArn"].split("/")[-1]
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/{job_id}/".lstrip("/")):
+        for entry in page.get("Contents", []):
+            if entry["Key"].endswith(".jsonl.out"):
+                body = s3.get_object(Bucket=bucket, Key=entry["Key"])["Body"].read().decode("utf-8")
+                yield from (json.loads(line) for line in body.splitlines() if line.strip())
+
+async def collect_result(line, info, model_id, record_meals):
+    result = {key: info[key] for key in ("id", "user_id", "kind", "filename", "question", "prompt_version") if key in info}
+    output = line.get("modelOutput")
+    if not output or "error" in line:
+        return {**result, "status": "error", "detail": line.get("error", {}).get("errorMessage", "결과 없음")}
+    reply = output["content"][0]["text"]
+    main.record_token_usage(model_id, output.get("usage", {}))
+    if info["kind"] == "chat":
+        return {**result, "reply": reply, "sources": info["sources"], "status": "success"}
+
+    nutrition = await main.extract_nutrition(reply)
+    meal_id = None
+    if record_meals and nutrition and info["member"]:
+        moment = datetime.fromisoformat(info["taken_at"]) if info.get("taken_at") else None
+        meal_id = await main.record_meal(info["user_id"], nutrition, info["image_hash"], moment=moment)
+    return {
+        **result,
+        "reply": reply,
+        "nutrition": nutrition.model_dump() if nutrition else None,
+        "meal_id": meal_id,
+        "status": "success"
+    }
+
+def collect(args):
+    bedrock, s3 = control_clients()
+    job = bedrock.get_model_invocation_job(jobIdentifier=args.job_arn)
+    while args.wait and job["status"] not in TERMINAL_STATUSES:
+        print(f"⏳ {job['jobName']}: {job['status']} - {args.poll_seconds}초 후 다시 확인")
+        time.sleep(args.poll_seconds)
+        job = bedrock.get_model_invocation_job(jobIdentifier=args.job_arn)
+    if job["status"] not in ("Completed", "PartiallyCompleted"):
+        raise SystemExit(f"🚨 결과를 모을 수 없는 상태입니다: {job['status']} {job.get('message', '')}")
+
+    with open(os.path.join(JOB_DIR, f"{job['jobName']}.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    records = manifest["records"]
+    lines = [line for line in read_job_output(s3, job) if line.get("recordId") in records]
+
+    async def run():
+        # 영양 정보 재추출/식단 기록도 실시간 일괄 처리와 같은 동시 실행 한도로 처리
+        results = []
+        handler = lambda line: collect_result(line, records[line["recordId"]], manifest["model_id"], args.record_meals)
+        async for _, result in main.iter_batch_results(lines, handler):
+            results.append(result)
+        return results
+
+    results = asyncio.run(run())
+    with open(args.out, "w", encoding="utf-8") as f:
+        for result in sorted(results, key=lambda r: str(r.get("id"))):
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    print(f"✅ 결과 {len(results)}개 저장: {args.out} (성공 {succeeded}, 실패 {len(results) - succeeded}, 누락 {len(records) - len(lines)})")
+    if job.get("submitTime") and job.get("endTime"):
+        minutes = (job["endTime"] - job["submitTime"]).total_seconds() / 60
+        print(f"⏱️ 작업 소요 {minutes:.1f}분, 처리량 {len(lines) / max(minutes, 1e-9):.1f}건/분 (제출~완료 기준)")
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = commands.add_parser("submit", help="배치 입력 파일을 만들어 S3에 올리고 작업 제출")
+    submit_parser.add_argument("items", help="사진/질문 목록 (JSONL)")
+    submit_parser.add_argument("--s3", help="입출력 파일을 둘 S3 경로 (예: s3://버킷/caremeal-batch)")
+    submit_parser.add_argument("--role-arn", help="Bedrock이 S3에 접근할 IAM 역할")
+    submit_parser.add_argument("--model-id", default=main.FOOD_MODEL_ID)
+    submit_parser.add_argument("--job-name", default=None)
+    submit_parser.add_argument("--dry-run", metavar="PATH", help="제출하지 않고 배치 입력 파일만 PATH에 저장")
+
+    status_parser = commands.add_parser("status", help="작업 상태 확인")
+    status_parser.add_argument("job_arn")
+
+    collect_parser = commands.add_parser("collect", help="완료된 작업 결과를 모아 저장")
+    collect_parser.add_argument("job_arn")
+    collect_parser.add_argument("--out", default="batch_results.jsonl")
+    collect_parser.add_argument("--record-meals", action="store_true", help="영양 정보를 식단 기록/롤업에 저장 (회원만)")
+    collect_parser.add_argument("--wait", action="store_true", help="작업이 끝날 때까지 기다림")
+    collect_parser.add_argument("--poll-seconds", type=int, default=60)
+
+    args = parser.parse_args()
+    if args.command == "submit":
+        if not args.dry_run and not (args.s3 and args.role_arn):
+            parser.error("submit에는 --s3와 --role-arn이 필요합니다. (--dry-run 제외)")
+        submit(args)
+    elif args.command == "status":
+        status(args)
+    else:
+        collect(args)
+
+if __name__ == "__main__":
+    main_cli()
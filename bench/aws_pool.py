@@ -0,0 +1,106 @@
+# boto3 연결 풀 크기에 따른 동시 호출 처리량 비교 (로컬 스텁 엔드포인트 사용, AWS 접근 없음)
+# 스텁은 DynamoDB GetItem에 --latency-ms 후 응답하고, 새 연결마다 --connect-ms 만큼 지연(TLS 핸드셰이크 흉내)합니다.
+# 요청은 --concurrency개씩 몰려 들어왔다가 잠시 쉬는 파도(burst) 형태로 보냅니다.
+# 파도가 끝나면 연결 풀 크기(max_pool_connections)를 넘는 연결은 닫히므로, 풀이 작으면 다음 파도마다 연결을 새로 맺습니다.
+# 사용법: python bench/aws_pool.py [--concurrency 64] [--pools 10,32,64] [--requests 2000]
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import AWSCallStats, aws_client_config  # noqa: E402
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency, connect_cost):
+        self.latency = latency
+        self.connect_cost = connect_cost
+        self.connections = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StubHandler)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.connect_cost)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        body = json.dumps({"Item": {"user_id": {"S": "u"}, "name": {"S": "홍길동"}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def run(endpoint, server, pool_size, concurrency, total, gap):
+    os.environ["DYNAMODB_MAX_POOL"] = str(pool_size)  # 셸에 설정된 값보다 비교 대상 크기를 우선
+    config = aws_client_config("DYNAMODB", pool_size, 2, 5, "standard")
+    client = boto3.client(
+        "dynamodb", region_name="us-east-1", endpoint_url=endpoint,
+        aws_access_key_id="bench", aws_secret_access_key="bench", config=config
+    )
+    stats = AWSCallStats(pool_size)
+    stats.attach(client.meta.events)
+    client.get_item(TableName="CareMeal-Users", Key={"user_id": {"S": "u"}})  # 엔드포인트/자격 증명 준비
+
+    server.connections = 0
+    elapsed = 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(total // concurrency):
+            started = time.perf_counter()
+            list(executor.map(
+                lambda _: client.get_item(TableName="CareMeal-Users", Key={"user_id": {"S": "u"}}), range(concurrency)
+            ))
+            elapsed += time.perf_counter() - started  # 파도 사이 쉬는 시간은 제외
+            time.sleep(gap)
+    total = total // concurrency * concurrency
+    return {
+        "pool": pool_size,
+        "throughput": total / elapsed,
+        "connections": server.connections,
+        "peak_in_flight": stats.peak_in_flight,
+        "over_pool": stats.over_pool,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=64, help="동시에 호출하는 스레드 수 (BEDROCK/DYNAMODB 스레드 풀 크기)")
+    parser.add_argument("--pools", default="10,32,64", help="비교할 max_pool_connections 목록 (10 = botocore 기본값)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--gap-ms", type=float, default=100, help="파도 사이 쉬는 시간")
+    parser.add_argument("--connect-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)  # "Connection pool is full" 경고 숨김
+    server = StubServer(args.latency_ms / 1000, args.connect_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"동시성 {args.concurrency}, 요청 {args.requests}개, 응답 지연 {args.latency_ms}ms, 새 연결 비용 {args.connect_ms}ms")
+    print(f"{'max_pool':>9}{'처리량(req/s)':>15}{'새 연결 수':>12}{'최대 동시 요청':>15}{'풀 초과 요청':>13}")
+    for pool_size in (int(p) for p in args.pools.split(",")):
+        row = run(endpoint, server, pool_size, args.concurrency, args.requests, args.gap_ms / 1000)
+        print(f"{row['pool']:>9}{row['throughput']:>15.1f}{row['connections']:>12}{row['peak_in_flight']:>15}{row['over_pool']:>13}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
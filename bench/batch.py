@@ -0,0 +1,110 @@
+# 일괄 처리 처리량 비교: 한 건씩 순서대로 호출 vs /analyze-food/batch, /chat/batch (로컬 AWS 대역 사용, AWS 접근 없음)
+# 사진/질문 N개를 모두 처리하는 데 걸린 시간으로 분당 처리 건수를 계산합니다.
+# 같은 사진/질문이 캐시나 요청 합치기로 빨라지지 않도록 답변/사진 캐시는 끄고, 항목은 모두 서로 다르게 만듭니다.
+# 사용법: python bench/batch.py [--items 20] [--concurrency 1,4,8] [--bedrock-latency-ms 300]
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins  # noqa: E402
+from load import BASE_ENV, QUESTION_TEMPLATES, QUESTION_TOPICS, make_food_images  # noqa: E402
+
+USER = {"user_id": "bench_batch_user", "password": "pw", "name": "홍길동", "age": 67, "diabetes_type": "제2형 당뇨"}
+
+async def sequential_food(client, images):
+    for i, image in enumerate(images):
+        response = await client.post(
+            "/analyze-food", data={"user_id": USER["user_id"]}, files={"file": (f"meal_{i}.jpg", image, "image/jpeg")}
+        )
+        response.raise_for_status()
+    return len(images)
+
+async def batch_food(client, images):
+    files = [("files", (f"meal_{i}.jpg", image, "image/jpeg")) for i, image in enumerate(images)]
+    response = await client.post("/analyze-food/batch", data={"user_id": USER["user_id"]}, files=files)
+    return count_succeeded(response)
+
+async def sequential_chat(client, questions):
+    for question in questions:
+        response = await client.post("/chat", json={"user_message": question, "user_id": USER["user_id"]})
+        response.raise_for_status()
+    return len(questions)
+
+async def batch_chat(client, questions):
+    response = await client.post("/chat/batch", json={"questions": questions, "user_id": USER["user_id"]})
+    return count_succeeded(response)
+
+def count_succeeded(response):
+    response.raise_for_status()
+    lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+    return sum(1 for line in lines if line.get("status") == "success")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=20, help="사진/질문 수 (BATCH_MAX_ITEMS 이하)")
+    parser.add_argument("--concurrency", default="1,4,8", help="비교할 BATCH_MAX_CONCURRENCY 목록")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=3)
+    parser.add_argument("--output-tokens", type=int, default=100)
+    args = parser.parse_args()
+
+    server = standins.DynamoDBStandIn().start()
+    os.environ.update(BASE_ENV)
+    os.environ.update({
+        "DYNAMODB_ENDPOINT_URL": server.endpoint,
+        "CHAT_CACHE_BACKEND": "off",
+        "IMAGE_CACHE_BACKEND": "off",
+        "BATCH_MAX_ITEMS": str(args.items),
+        "CHAT_LOG_SPILL_PATH": os.path.join(tempfile.mkdtemp(), "chat_log_spill.jsonl"),
+        "LOG_LEVEL": "ERROR",
+    })
+    import main as app_module
+    import httpx
+
+    app_module.bedrock_agent = app_module.bedrock_runtime = standins.BedrockStandIn(
+        latency_ms=args.bedrock_latency_ms, token_ms=args.token_ms, output_tokens=args.output_tokens
+    )
+    app_module.user_table.put_item(Item=USER)
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    images = make_food_images(args.items * (len(concurrency_levels) + 1), seed=1)
+    questions = [t.format(topic) + f" ({n})" for n in range(len(concurrency_levels) + 1) for t in QUESTION_TEMPLATES for topic in QUESTION_TOPICS]
+
+    async def run():
+        rows = []
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with app_module.app.router.lifespan_context(app_module.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+                for kind, sequential, batch, items in (
+                    ("사진 분석", sequential_food, batch_food, images),
+                    ("채팅", sequential_chat, batch_chat, questions),
+                ):
+                    # 실행마다 다른 항목을 써서 이전 실행 결과를 재사용하지 않게 함
+                    chunks = [items[i * args.items:(i + 1) * args.items] for i in range(len(concurrency_levels) + 1)]
+                    started = time.perf_counter()
+                    done = await sequential(client, chunks[0])
+                    baseline = time.perf_counter() - started
+                    rows.append((kind, "순차 호출 (1건씩)", done, baseline, 1.0))
+                    for level, chunk in zip(concurrency_levels, chunks[1:]):
+                        app_module.BATCH_MAX_CONCURRENCY = level
+                        started = time.perf_counter()
+                        done = await batch(client, chunk)
+                        elapsed = time.perf_counter() - started
+                        rows.append((kind, f"일괄 (동시 {level})", done, elapsed, baseline / elapsed))
+        return rows
+
+    rows = asyncio.run(run())
+    print(f"항목 {args.items}개, Bedrock 지연 {args.bedrock_latency_ms}ms + 토큰당 {args.token_ms}ms x {args.output_tokens}")
+    print(f"{'종류':<8}{'방식':<18}{'성공':>6}{'소요(초)':>10}{'건/분':>10}{'순차 대비':>10}")
+    for kind, mode, done, elapsed, speedup in rows:
+        print(f"{kind:<8}{mode:<18}{done:>6}{elapsed:>10.2f}{done / elapsed * 60:>10.1f}{speedup:>9.1f}x")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# 기동 시간(cold start)과 워커 수에 따른 처리량 측정 (로컬 AWS 대역 사용, AWS 접근 없음)
+# 실제 배포처럼 python main.py를 별도 프로세스로 띄우고 HTTP(uvicorn)로 요청합니다.
+# 1) cold start: 프로세스 시작부터 포트 열림, /ready 200, 첫 /login·/chat 응답까지 걸린 시간과 SIGTERM 후 종료까지 걸린 시간
+#    WARMUP=1/0을 비교해 워밍업이 첫 요청 지연을 얼마나 줄이는지 봅니다.
+# 2) 워커 확장: WEB_CONCURRENCY=1,2,4...로 띄워 /login + /chat 혼합 요청의 초당 처리량, 지연, 전체 메모리(RSS)
+# DynamoDB/Bedrock 대역(HTTP 서버)은 별도 프로세스에서 돌립니다.
+# 워커 확장 폭의 상한은 CPU 코어 수입니다. (부하 생성기와 대역도 같은 머신의 CPU를 씀)
+# 사용법: python bench/cold_start.py [--workers 1,2,4] [--repeat 3] [--requests 600] [--concurrency 32]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins  # noqa: E402
+from load import BASE_ENV, QUESTION_TEMPLATES, QUESTION_TOPICS, new_user, percentile  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_COUNT = 200
+
+def serve_standins(conn, bedrock_options):
+    dynamodb = standins.DynamoDBStandIn().start()
+    bedrock = standins.BedrockHTTPStandIn(**bedrock_options).start()
+    conn.send((dynamodb.endpoint, bedrock.endpoint))
+    try:
+        conn.recv()  # 부모가 닫을 때까지 대기
+    except EOFError:
+        pass
+
+def seed_users(endpoint):
+    import boto3
+
+    table = boto3.resource(
+        "dynamodb", region_name="us-east-1", aws_access_key_id="bench", aws_secret_access_key="bench", endpoint_url=endpoint
+    ).Table("CareMeal-Users")
+    rng = random.Random(0)
+    users = [new_user(rng, f"bench_user_{i:05d}") for i in range(USER_COUNT)]
+    with table.batch_writer() as writer:
+        for user in users:
+            writer.put_item(Item={**user, "details": {}, "joined_at": "2024-01-01T00:00:00"})
+    return users
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def tree_rss_mb(pid):
+    # 서버 프로세스와 그 자식(워커)들의 RSS 합계
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                continue
+    pids, frontier = {pid}, [pid]
+    while frontier:
+        current = frontier.pop()
+        children = [child for child, parent in parents.items() if parent == current]
+        pids.update(children)
+        frontier += children
+    total_kb = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            continue
+    return total_kb / 1024
+
+class Server:
+    def __init__(self, env, workers, warmup):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log = tempfile.NamedTemporaryFile(prefix="caremeal_server_", suffix=".log", delete=False)
+        self.started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, "main.py"], cwd=ROOT, stdout=self.log, stderr=subprocess.STDOUT,
+            env={**os.environ, **env, "PORT": str(self.port), "HOST": "127.0.0.1",
+                 "WEB_CONCURRENCY": str(workers), "WARMUP": "1" if warmup else "0"},
+        )
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def wait_ready(self, client, timeout=60):
+        listening = None
+        while self.elapsed() < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"서버가 종료되었습니다. 로그: {self.log.name}")
+            try:
+                response = client.get(f"{self.url}/ready")
+            except Exception:
+                time.sleep(0.005)
+                continue
+            if listening is None:
+                listening = self.elapsed()
+            if response.status_code == 200:
+                return listening, self.elapsed()
+            time.sleep(0.005)
+        raise RuntimeError(f"{timeout}초 안에 준비되지 않았습니다. 로그: {self.log.name}")
+
+    def stop(self):
+        started = time.perf_counter()
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        os.unlink(self.log.name)
+        return time.perf_counter() - started
+
+def timed(fn):
+    started = time.perf_counter()
+    response = fn()
+    response.raise_for_status()
+    return (time.perf_counter() - started) * 1000
+
+def cold_start(env, users, warmup):
+    import httpx
+
+    server = Server(env, workers=1, warmup=warmup)
+    try:
+        with httpx.Client(timeout=30) as client:
+            listening, ready = server.wait_ready(client)
+            user = users[0]
+            login_ms = timed(lambda: client.post(f"{server.url}/login", json={"user_id": user["user_id"], "password": user["password"]}))
+            first_served = server.elapsed()
+            chat_ms = timed(lambda: client.post(
+                f"{server.url}/chat", json={"user_message": "현미밥을 먹어도 혈당이 괜찮을까요?", "user_id": user["user_id"]}
+            ))
+            second_login_ms = timed(lambda: client.post(f"{server.url}/login", json={"user_id": user["user_id"], "password": user["password"]}))
+            rss = tree_rss_mb(server.process.pid)
+    finally:
+        shutdown = server.stop()
+    return {
+        "listening_s": listening, "ready_s": ready, "first_served_s": first_served,
+        "first_login_ms": login_ms, "second_login_ms": second_login_ms, "first_chat_ms": chat_ms,
+        "shutdown_s": shutdown, "rss_mb": rss,
+    }
+
+async def drive(url, users, concurrency, total, warmup):
+    import httpx
+
+    rng = random.Random(1)
+    questions = [t.format(topic) + f" ({n})" for n in range(20) for t in QUESTION_TEMPLATES for topic in QUESTION_TOPICS]
+    latencies = []
+    errors = 0
+    remaining = {"warmup": warmup, "measured": total}
+
+    async def one(client):
+        user = rng.choice(users)
+        if rng.random() < 0.5:
+            return await client.post("/login", json={"user_id": user["user_id"], "password": user["password"]})
+        return await client.post("/chat", json={"user_message": rng.choice(questions), "user_id": user["user_id"]})
+
+    async def worker(client, phase):
+        nonlocal errors
+        while remaining[phase] > 0:
+            remaining[phase] -= 1
+            started = time.perf_counter()
+            try:
+                ok = (await one(client)).status_code == 200
+            except Exception:
+                ok = False
+            if phase == "measured":
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        await asyncio.gather(*(worker(client, "warmup") for _ in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, "measured") for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+    return {
+        "throughput": total / duration,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "errors": errors,
+    }
+
+def scaling(env, users, workers, args):
+    import httpx
+
+    server = Server(env, workers=workers, warmup=True)
+    try:
+        with httpx.Client(timeout=30) as client:
+            server.wait_ready(client)
+        result = asyncio.run(drive(server.url, users, args.concurrency, args.requests, args.warmup_requests))
+        result["rss_mb"] = tree_rss_mb(server.process.pid)
+    finally:
+        server.stop()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4", help="비교할 워커 수 목록")
+    parser.add_argument("--repeat", type=int, default=3, help="cold start 반복 횟수 (중앙값 사용)")
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--warmup-requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    conn, child_conn = context.Pipe()
+    standin_process = context.Process(
+        target=serve_standins, args=(child_conn, {"latency_ms": args.bedrock_latency_ms, "token_ms": args.token_ms}), daemon=True
+    )
+    standin_process.start()
+    dynamodb_endpoint, bedrock_endpoint = conn.recv()
+    users = seed_users(dynamodb_endpoint)
+    env = {
+        **BASE_ENV,
+        "LOG_LEVEL": "WARNING",
+        "DYNAMODB_ENDPOINT_URL": dynamodb_endpoint,
+        "BEDROCK_AGENT_ENDPOINT_URL": bedrock_endpoint,
+        "BEDROCK_RUNTIME_ENDPOINT_URL": bedrock_endpoint,
+        "CHAT_CACHE_BACKEND": "off",  # 매 질문이 Bedrock 경로를 타도록
+        "CHAT_LOG_SPILL_PATH": os.path.join(tempfile.mkdtemp(), "chat_log_spill.jsonl"),
+    }
+
+    print(f"CPU {os.cpu_count()}개, Bedrock 대역 지연 {args.bedrock_latency_ms}ms")
+    print(f"\n[cold start] 워커 1개, {args.repeat}회 중앙값")
+    columns = ("listening_s", "ready_s", "first_served_s", "first_login_ms", "second_login_ms", "first_chat_ms", "shutdown_s", "rss_mb")
+    print(f"{'WARMUP':<8}" + "".join(f"{column:>16}" for column in columns))
+    for warmup in (True, False):
+        runs = [cold_start(env, users, warmup) for _ in range(args.repeat)]
+        print(f"{int(warmup):<8}" + "".join(f"{statistics.median(run[column] for run in runs):>16.3f}" for column in columns))
+
+    print(f"\n[워커 확장] /login 50% + /chat 50%, 동시 {args.concurrency}, 요청 {args.requests}건")
+    print(f"{'workers':<8}{'req/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'errors':>8}{'RSS(MB)':>10}{'1개 대비':>10}")
+    base = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        result = scaling(env, users, workers, args)
+        base = base or result["throughput"]
+        print(f"{workers:<8}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['errors']:>8}{result['rss_mb']:>10.1f}{result['throughput'] / base:>9.2f}x")
+
+    conn.close()
+    standin_process.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# 식단 사진 전처리 전/후 Bedrock 요청 크기와 처리 시간 비교
+# 사용법: python bench/image_payload.py <사진 폴더> [--bandwidth-mbps 20]
+# 전송 시간은 앱에 실제 요청을 보내 잰 값이 아니라 payload 크기를 --bandwidth-mbps로 나눈 추정치입니다.
+import argparse
+import base64
+import json
+import mimetypes
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import preprocess_image  # noqa: E402
+
+def payload_size(image_bytes, media_type):
+    # analyze_food_endpoint가 invoke_model에 보내는 body와 같은 구조
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1500,
+        "messages": [{"role": "user", "content": [{
+            "type": "image",
+            "source": {"type": "base64", "media_type": media_type, "data": base64.b64encode(image_bytes).decode("utf-8")}
+        }]}]
+    }
+    return len(json.dumps(body))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder")
+    parser.add_argument("--bandwidth-mbps", type=float, default=20.0, help="전송 시간 추정에 가정하는 업로드 대역폭")
+    args = parser.parse_args()
+
+    bytes_per_sec = args.bandwidth_mbps * 1_000_000 / 8
+    total_before = total_after = 0
+    total_upload_before = total_upload_after = total_preprocess = 0.0
+    hashes = {}
+
+    print(f"{'파일':<32}{'원본 payload':>14}{'전처리 후':>12}{'전처리(ms)':>12}{'추정 전송 절감(ms)':>14}")
+    for name in sorted(os.listdir(args.folder)):
+        media_type = mimetypes.guess_type(name)[0]
+        if not media_type or not media_type.startswith("image/"):
+            continue
+        with open(os.path.join(args.folder, name), "rb") as f:
+            image_bytes = f.read()
+
+        started = time.perf_counter()
+        processed, processed_type, image_hash = preprocess_image(image_bytes, media_type)
+        preprocess_sec = time.perf_counter() - started
+
+        before = payload_size(image_bytes, media_type)
+        after = payload_size(processed, processed_type)
+        upload_before, upload_after = before / bytes_per_sec, after / bytes_per_sec
+        hashes.setdefault(image_hash, []).append(name)
+
+        total_before += before
+        total_after += after
+        total_preprocess += preprocess_sec
+        total_upload_before += upload_before
+        total_upload_after += upload_after
+        saved_ms = (upload_before - upload_after - preprocess_sec) * 1000
+        print(f"{name[:31]:<32}{before / 1024:>12.0f}KB{after / 1024:>10.0f}KB{preprocess_sec * 1000:>12.1f}{saved_ms:>14.1f}")
+
+    if not total_before:
+        print("이미지 파일이 없습니다.")
+        return
+    print()
+    print(f"payload 합계: {total_before / 1024 / 1024:.1f}MB -> {total_after / 1024 / 1024:.1f}MB ({total_after / total_before:.1%})")
+    print(f"전처리 시간 합계: {total_preprocess * 1000:.0f}ms")
+    print(f"추정 전송 시간 ({args.bandwidth_mbps}Mbps): {total_upload_before:.2f}s -> {total_upload_after + total_preprocess:.2f}s (전처리 포함)")
+    print(f"※ 전송 시간은 실제 요청을 측정한 값이 아니라 업로드 대역폭을 {args.bandwidth_mbps}Mbps로 가정해 계산한 추정치입니다. (--bandwidth-mbps로 변경)")
+    duplicates = [names for names in hashes.values() if len(names) > 1]
+    print(f"같은 이미지 해시(결과 캐시 적중 대상) 묶음: {len(duplicates)}개 {duplicates if duplicates else ''}")
+
+if __name__ == "__main__":
+    main()
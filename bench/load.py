@@ -0,0 +1,537 @@
+# main.py 부하 테스트: 로컬 AWS 대역(bench/standins.py)을 끼우고 /chat, /analyze-food, /login, /signup에 혼합 트래픽을 보내
+# 시나리오별 처리량, p50/p95/p99 지연, 메모리(RSS)를 측정합니다. (AWS 접근 없음)
+# - DynamoDB: 로컬 HTTP 대역(또는 --dynamodb-endpoint로 DynamoDB Local)을 DYNAMODB_ENDPOINT_URL로 연결
+# - Bedrock : main.bedrock_agent / main.bedrock_runtime 자리에 지연·스트리밍·스로틀링을 흉내 내는 대역을 넣음
+# - 요청은 httpx ASGITransport로 앱에 직접 보내므로 HTTP 서버(uvicorn) 자체의 비용은 포함되지 않습니다.
+# - 내장 DynamoDB 대역과 부하 생성기가 앱과 같은 프로세스(GIL)를 쓰므로 CPU가 적은 머신에서는 처리량 상한이 낮게 나옵니다.
+# 시나리오마다 새 프로세스에서 main.py를 import하므로 캐시/서킷 브레이커 상태와 메모리가 서로 섞이지 않습니다.
+# 사용법:
+#   python bench/load.py                                         # 기본 시나리오 전체
+#   python bench/load.py --scenarios mixed,auth_burst --requests 300
+#   python bench/load.py --save bench/baselines/load.json        # 결과를 기준값으로 저장
+#   python bench/load.py --compare bench/baselines/load.json     # 기준값보다 나빠지면 종료 코드 1
+#   python bench/load.py --dynamodb-endpoint http://localhost:8000
+# 기준값과 별개로 항상 확인하는 조건 (어기면 종료 코드 1):
+#   - upload_10mb: 10MB 사진 50장을 동시에 올려도 최대 RSS가 상한(--max-rss-mb) 이하
+#   - login_during_chat: 느린 채팅이 진행 중일 때 로그인 p99가 login_only의 로그인 p99의 2배 + 20ms(--flat-tolerance, --flat-slack-ms) 이내
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIXED = {"chat": 55, "analyze_food": 10, "login": 30, "signup": 5}
+SCENARIOS = {
+    "mixed": {
+        "description": "일반 사용 패턴 (채팅 위주, 로그인, 가끔 사진 분석/회원가입)",
+        "mix": MIXED, "concurrency": 32, "requests": 600,
+    },
+    "login_during_chat": {
+        "description": "느린 채팅(Bedrock 2초)이 진행 중일 때 로그인 - 로그인 p99를 login_only와 비교",
+        "mix": {"chat": 50, "login": 50}, "concurrency": 32, "requests": 600,
+        "bedrock": {"latency_ms": 2000},
+        "env": {"CHAT_CACHE_BACKEND": "off"},
+        "ramp_s": 1.0,  # 동시 사용자가 1초에 걸쳐 들어옴 (한꺼번에 몰리는 경우는 auth_burst에서 측정)
+        "flat": {"login": "login_only"},  # 채팅이 진행 중이어도 로그인 p99가 로그인만 있을 때와 비슷해야 함
+    },
+    "login_only": {
+        "description": "로그인만 한 번에 하나씩 - login_during_chat의 로그인 지연과 비교하는 기준",
+        "mix": {"login": 100}, "concurrency": 1, "requests": 600,
+    },
+    "chat_uncached": {
+        "description": "답변 캐시 없이 채팅만 - Bedrock 경로와 스레드 풀",
+        "mix": {"chat": 100}, "concurrency": 32, "requests": 300,
+        "env": {"CHAT_CACHE_BACKEND": "off"},
+    },
+    "auth_burst": {
+        "description": "로그인/회원가입 몰림 - DynamoDB 경로와 프로필 캐시",
+        "mix": {"login": 85, "signup": 15}, "concurrency": 64, "requests": 2000,
+    },
+    "throttled": {
+        "description": "Bedrock 호출 30%가 ThrottlingException - 서킷 브레이커와 대체 응답",
+        "mix": MIXED, "concurrency": 32, "requests": 600,
+        "bedrock": {"throttle_rate": 0.3},
+    },
+    "upload_10mb": {
+        "description": "10MB 사진 50장 동시 업로드 - 최대 RSS 상한 (--max-rss-mb)",
+        "mix": {"analyze_food": 100}, "concurrency": 50, "requests": 50,
+        "image_mb": 10, "max_rss_peak_mb": 400,
+    },
+}
+
+# 시나리오 공통 앱 설정 (시나리오의 env가 덮어씀)
+BASE_ENV = {
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "KB_ID": "BENCHKB",
+    "RAG_BACKEND": "bedrock",
+    "LOG_LEVEL": "WARNING",
+    "LOG_SPANS": "0",
+    "BEDROCK_RPM": "0",  # 계정 할당량은 환경마다 달라서 기본은 제한 없이 측정
+    "BEDROCK_TPM": "0",
+}
+
+QUESTION_TOPICS = ("현미밥", "고구마", "바나나", "떡국", "라면", "삼겹살", "두부", "사과", "우유", "김치찌개")
+QUESTION_TEMPLATES = (
+    "{}을 먹어도 혈당이 괜찮을까요?",
+    "{}은 하루에 얼마나 먹어도 되나요?",
+    "당뇨가 있는데 저녁에 {}을 먹으면 안 되나요?",
+    "{} 대신 먹을 만한 음식이 있을까요?",
+    "식후 혈당이 높은데 {}이 원인일 수 있나요?",
+    "{}의 혈당지수가 궁금해요",
+)
+DIABETES_TYPES = ("제1형 당뇨", "제2형 당뇨", "임신성 당뇨", "당뇨 전단계", "일반")
+
+# --- 측정 도우미 ---
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # /proc가 없으면 최대 RSS로 대신함 (macOS는 바이트, Linux는 KB 단위)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+class MemorySampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, current_rss_mb())
+            time.sleep(self.interval)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return self.peak
+
+# --- 트래픽 생성 ---
+def make_food_images(count, seed, size_mb=None):
+    # 기본은 휴대폰 사진 크기(4032x3024)의 절반인 JPEG - 색/모양이 달라 서로 다른 사진으로 처리됨
+    # size_mb를 주면 원본 크기로 만들고 파일 끝(EOI 뒤)을 채워 정확히 그 크기로 맞춤 (디코더는 EOI 뒤를 무시)
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    scale = 2 if size_mb else 1
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", (2016 * scale, 1512 * scale), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(1800 * scale), rng.randrange(1300 * scale)
+            draw.ellipse((x, y, x + rng.randint(150, 600) * scale, y + rng.randint(150, 500) * scale), fill=tuple(rng.randrange(256) for _ in range(3)))
+        noise = Image.effect_noise(image.size, 40).convert("RGB")
+        image = Image.blend(image, noise, 0.15)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=95 if size_mb else 90)
+        data = buffer.getvalue()
+        if size_mb:
+            data += bytes(max(0, int(size_mb * 1024 * 1024) - len(data)))
+        images.append(data)
+    return images
+
+class TrafficModel:
+    # 가입 회원/비회원, 인기 질문(Zipf 분포), 같은 사진 재업로드 비율을 흉내 낸 요청 생성기
+    def __init__(self, users, mix, seed, images=None):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.endpoints = list(mix)
+        self.weights = [mix[name] for name in self.endpoints]
+        self.questions = [t.format(topic) for t in QUESTION_TEMPLATES for topic in QUESTION_TOPICS]
+        self.rng.shuffle(self.questions)
+        self.question_weights = [1 / (rank + 1) for rank in range(len(self.questions))]
+        self.images = images or make_food_images(6, seed)
+
+    def next_endpoint(self):
+        return self.rng.choices(self.endpoints, self.weights)[0]
+
+    def member_or_guest(self):
+        return self.rng.choice(self.users) if self.rng.random() < 0.8 else {"user_id": "guest"}
+
+    async def chat(self, client):
+        user = self.member_or_guest()
+        question = self.rng.choices(self.questions, self.question_weights)[0]
+        response = await client.post("/chat", json={"user_message": question, "user_id": user["user_id"]})
+        return response, {200}
+
+    async def analyze_food(self, client):
+        user = self.member_or_guest()
+        image = self.rng.choice(self.images)
+        response = await client.post(
+            "/analyze-food", data={"user_id": user["user_id"]}, files={"file": ("meal.jpg", image, "image/jpeg")}
+        )
+        return response, {200}
+
+    async def login(self, client):
+        user = self.rng.choice(self.users)
+        if self.rng.random() < 0.1:  # 비밀번호 오타
+            response = await client.post("/login", json={"user_id": user["user_id"], "password": "wrong"})
+            return response, {401}
+        response = await client.post("/login", json={"user_id": user["user_id"], "password": user["password"]})
+        return response, {200}
+
+    async def signup(self, client):
+        user = new_user(self.rng, f"bench_new_{self.rng.getrandbits(48):012x}")
+        response = await client.post("/signup", json={
+            "user_id": user["user_id"], "password": user["password"], "name": user["name"],
+            "age": user["age"], "diabetes_type": user["diabetes_type"],
+            "details": {"gender": "여성", "height": "160", "weight": "55", "bmi": 21.5},
+        })
+        return response, {200}
+
+def new_user(rng, user_id):
+    return {
+        "user_id": user_id,
+        "password": f"pw-{rng.randrange(10**6)}",
+        "name": rng.choice(("김", "이", "박", "최", "정")) + rng.choice(("민준", "서연", "지훈", "영숙", "철수")),
+        "age": rng.randint(15, 85),
+        "diabetes_type": rng.choice(DIABETES_TYPES),
+    }
+
+def seed_users(main, count, seed):
+    rng = random.Random(seed)
+    users = [new_user(rng, f"bench_user_{i:05d}") for i in range(count)]
+    with main.user_table.batch_writer() as writer:
+        for user in users:
+            writer.put_item(Item={**user, "details": {}, "joined_at": "2024-01-01T00:00:00"})
+    return users
+
+def socket_sized_body(app, chunk_size=64 * 1024):
+    # ASGITransport는 요청 본문을 한 메시지로 넘기지만 uvicorn은 소켓에서 읽은 크기(64KB)씩 나눠 넘기므로 같은 크기로 나눔
+    # (한 덩어리로 넘기면 multipart 파서가 업로드 전체를 한 번 더 복사해서 실제 서버보다 메모리를 많이 씀)
+    async def wrapped(scope, receive, send):
+        state = {"body": memoryview(b""), "more_body": False}
+
+        async def chunked_receive():
+            if not state["body"]:
+                message = await receive()
+                if message["type"] != "http.request" or len(message.get("body", b"")) <= chunk_size:
+                    return message
+                state["body"], state["more_body"] = memoryview(message["body"]), message.get("more_body", False)
+            chunk, state["body"] = state["body"][:chunk_size], state["body"][chunk_size:]
+            return {"type": "http.request", "body": bytes(chunk), "more_body": bool(state["body"]) or state["more_body"]}
+
+        await app(scope, chunked_receive, send)
+    return wrapped
+
+async def drive(app, traffic, concurrency, total, warmup, ramp_s=0):
+    import httpx
+
+    records = []
+    remaining = {"warmup": warmup, "measured": total}
+
+    async def worker(client, phase, delay=0):
+        await asyncio.sleep(delay)
+        while remaining[phase] > 0:
+            remaining[phase] -= 1
+            endpoint = traffic.next_endpoint()
+            started = time.perf_counter()
+            try:
+                response, expected = await getattr(traffic, endpoint)(client)
+                ok = response.status_code in expected
+                degraded = ok and response.status_code == 200 and response.json().get("status") == "degraded"
+            except Exception:
+                ok, degraded = False, False
+            if phase == "measured":
+                records.append((endpoint, (time.perf_counter() - started) * 1000, ok, degraded))
+
+    transport = httpx.ASGITransport(app=socket_sized_body(app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        # 웜업 요청이 모두 끝난 뒤부터 측정 (지연 생성되는 boto3 클라이언트, 첫 프롬프트 렌더링 등)
+        await asyncio.gather(*(worker(client, "warmup") for _ in range(min(concurrency, warmup))))
+        sampler = MemorySampler().start()
+        rss_start = current_rss_mb()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, "measured", index * ramp_s / concurrency) for index in range(concurrency)))
+        duration = time.perf_counter() - started
+        rss_peak = sampler.stop()
+    return records, duration, rss_start, rss_peak
+
+def summarize(records):
+    latencies = [r[1] for r in records]
+    return {
+        "count": len(records),
+        "errors": sum(1 for r in records if not r[2]),
+        "degraded": sum(1 for r in records if r[3]),
+        "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+# --- 시나리오 실행 (자식 프로세스) ---
+def run_worker(config):
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import standins
+
+    if config["dynamodb_endpoint"]:
+        standins.create_tables(config["dynamodb_endpoint"])
+        store = None
+        os.environ["DYNAMODB_ENDPOINT_URL"] = config["dynamodb_endpoint"]
+    else:
+        server = standins.DynamoDBStandIn(latency_ms=config["dynamodb_latency_ms"]).start()
+        store = server.store
+        os.environ["DYNAMODB_ENDPOINT_URL"] = server.endpoint
+
+    import main
+    bedrock = standins.BedrockStandIn(seed=config["seed"], **config["bedrock"])
+    main.bedrock_agent = bedrock
+    main.bedrock_runtime = bedrock
+
+    users = seed_users(main, config["users"], config["seed"])
+    images = None
+    if config["image_files"]:
+        images = []
+        for path in config["image_files"]:
+            with open(path, "rb") as f:
+                images.append(f.read())
+    traffic = TrafficModel(users, config["mix"], config["seed"], images)
+
+    async def run():
+        async with main.app.router.lifespan_context(main.app):
+            return await drive(main.app, traffic, config["concurrency"], config["requests"], config["warmup"], config["ramp_s"])
+
+    records, duration, rss_start, rss_peak = asyncio.run(run())
+    endpoints = {}
+    for name in config["mix"]:
+        endpoint_records = [r for r in records if r[0] == name]
+        if endpoint_records:
+            endpoints[name] = summarize(endpoint_records)
+    result = {
+        **summarize(records),
+        "duration_s": duration,
+        "throughput_rps": len(records) / duration if duration else 0.0,
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": rss_peak,
+        "rss_end_mb": current_rss_mb(),
+        "endpoints": endpoints,
+        "bedrock": bedrock.stats(),
+        "dynamodb": dict(store.calls) if store else {},
+    }
+    print(json.dumps(result, ensure_ascii=False))
+
+def run_scenario(name, args):
+    scenario = SCENARIOS[name]
+    config = {
+        "mix": scenario["mix"],
+        "image_files": [],
+        "concurrency": args.concurrency or scenario["concurrency"],
+        "requests": args.requests or scenario["requests"],
+        "warmup": args.warmup,
+        "ramp_s": scenario.get("ramp_s", 0),
+        "users": args.users,
+        "seed": args.seed,
+        "dynamodb_endpoint": args.dynamodb_endpoint,
+        "dynamodb_latency_ms": args.dynamodb_latency_ms,
+        "bedrock": {
+            "latency_ms": args.bedrock_latency_ms,
+            "token_ms": args.token_ms,
+            "output_tokens": args.output_tokens,
+            **scenario.get("bedrock", {}),
+        },
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        if scenario.get("image_mb"):
+            # 큰 사진은 여기서 만들어 파일로 넘김 (측정 프로세스에서 만들면 디코딩/인코딩에 쓴 메모리가 RSS에 남음)
+            for index, image in enumerate(make_food_images(6, args.seed, scenario["image_mb"])):
+                config["image_files"].append(os.path.join(tmp, f"upload_{index}.jpg"))
+                with open(config["image_files"][-1], "wb") as f:
+                    f.write(image)
+        env = {
+            **os.environ,
+            **BASE_ENV,
+            # 디스크 캐시/스필 파일은 임시 폴더에 (이전 실행 결과가 섞이지 않도록)
+            "CHAT_LOG_SPILL_PATH": os.path.join(tmp, "chat_log_spill.jsonl"),
+            "CHAT_CACHE_PATH": os.path.join(tmp, "chat_cache.sqlite3"),
+            "IMAGE_CACHE_PATH": os.path.join(tmp, "image_cache.sqlite3"),
+            **scenario.get("env", {}),
+        }
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config)],
+            env=env, cwd=ROOT, capture_output=True, text=True,
+        )
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"🚨 시나리오 {name} 실행 실패 (종료 코드 {completed.returncode})")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["config"] = {k: config[k] for k in ("concurrency", "requests", "bedrock", "dynamodb_latency_ms")}
+    return result
+
+# --- 기준값 비교 ---
+MIN_PERCENTILE_SAMPLES = 50
+
+def compare(baseline, results, tolerance, latency_slack_ms, memory_slack_mb):
+    # 처리량은 (1 - 허용치)배 미만, p95/p99 지연과 최대 RSS는 (1 + 허용치)배 + 여유값 초과, 오류율은 1%p 초과 증가 시 악화
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            print(f"ℹ️ {name}: 기준값 없음 (비교 생략)")
+            continue
+        if base.get("config") != current.get("config"):
+            print(f"⚠️ {name}: 기준값과 측정 설정이 다릅니다. {base.get('config')} -> {current.get('config')}")
+        checks = [(f"{name} 처리량(req/s)", base["throughput_rps"], current["throughput_rps"], base["throughput_rps"] * (1 - tolerance), False)]
+        for endpoint, stats in current["endpoints"].items():
+            base_stats = base["endpoints"].get(endpoint)
+            if not base_stats or min(base_stats["count"], stats["count"]) < MIN_PERCENTILE_SAMPLES:
+                continue  # 표본이 적은 엔드포인트의 p95/p99는 잡음이 커서 비교하지 않음
+            for key in ("p95_ms", "p99_ms"):
+                limit = base_stats[key] * (1 + tolerance) + latency_slack_ms
+                checks.append((f"{name} {endpoint} {key}", base_stats[key], stats[key], limit, True))
+        checks.append((f"{name} 최대 RSS(MB)", base["rss_peak_mb"], current["rss_peak_mb"], base["rss_peak_mb"] * (1 + tolerance) + memory_slack_mb, True))
+        error_rate = lambda r: r["errors"] / r["count"] if r["count"] else 0.0
+        checks.append((f"{name} 오류율", error_rate(base), error_rate(current), error_rate(base) + 0.01, True))
+
+        for label, before, after, limit, higher_is_worse in checks:
+            worse = after > limit if higher_is_worse else after < limit
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{'❌' if worse else '✅'} {label:<40}{before:>12.3f} -> {after:>12.3f} ({change:+.1f}%)")
+            if worse:
+                regressions.append(label)
+    return regressions
+
+def check_limits(results, args):
+    # 기준값 파일 없이도 항상 확인하는 조건: 최대 RSS 상한, 다른 부하가 섞여도 지연이 평탄한지
+    failures = []
+    for name, result in results.items():
+        scenario = SCENARIOS[name]
+        ceiling = args.max_rss_mb or scenario.get("max_rss_peak_mb")
+        if ceiling:
+            worse = result["rss_peak_mb"] > ceiling
+            print(f"{'❌' if worse else '✅'} {name + ' 최대 RSS(MB) 상한':<40}{result['rss_peak_mb']:>12.1f} / {ceiling:.1f}")
+            if worse:
+                failures.append(f"{name} 최대 RSS")
+        for endpoint, reference in scenario.get("flat", {}).items():
+            stats, base_stats = result["endpoints"].get(endpoint), results[reference]["endpoints"].get(endpoint)
+            if not stats or not base_stats:
+                continue
+            limit = base_stats["p99_ms"] * (1 + args.flat_tolerance) + args.flat_slack_ms
+            worse = stats["p99_ms"] > limit
+            label = f"{name} {endpoint} p99 (vs {reference})"
+            print(f"{'❌' if worse else '✅'} {label:<40}{base_stats['p99_ms']:>12.3f} -> {stats['p99_ms']:>12.3f} (상한 {limit:.1f})")
+            if worse:
+                failures.append(label)
+    return failures
+
+def print_results(results):
+    print(f"{'시나리오':<16}{'엔드포인트':<14}{'요청':>7}{'오류':>6}{'대체응답':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for name, result in results.items():
+        for endpoint, stats in result["endpoints"].items():
+            print(
+                f"{name:<16}{endpoint:<14}{stats['count']:>7}{stats['errors']:>6}{stats['degraded']:>9}"
+                f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+            )
+        print(
+            f"{name:<16}{'(전체)':<14}{result['count']:>7}{result['errors']:>6}{result['degraded']:>9}"
+            f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+        )
+        print(
+            f"  -> 처리량 {result['throughput_rps']:.1f} req/s ({result['duration_s']:.1f}초), "
+            f"RSS {result['rss_start_mb']:.0f} -> 최대 {result['rss_peak_mb']:.0f}MB, "
+            f"Bedrock 호출 {sum(result['bedrock']['calls'].values())}회 (스로틀링 {result['bedrock']['throttled']}회)"
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"실행할 시나리오 ({', '.join(SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=None, help="시나리오별 측정 요청 수 (기본: 시나리오 설정)")
+    parser.add_argument("--concurrency", type=int, default=None, help="동시 사용자 수 (기본: 시나리오 설정)")
+    parser.add_argument("--warmup", type=int, default=20, help="측정에서 제외하는 첫 요청 수")
+    parser.add_argument("--users", type=int, default=500, help="미리 가입시켜 둘 회원 수")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=300, help="Bedrock 첫 응답까지의 지연 (중앙값)")
+    parser.add_argument("--token-ms", type=float, default=3, help="Bedrock 출력 토큰당 생성 시간")
+    parser.add_argument("--output-tokens", type=int, default=100)
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=2)
+    parser.add_argument("--dynamodb-endpoint", default=None, help="내장 대역 대신 사용할 DynamoDB 호환 엔드포인트 (예: DynamoDB Local)")
+    parser.add_argument("--save", help="결과를 기준값 파일로 저장 (같은 시나리오 항목만 갱신)")
+    parser.add_argument("--compare", help="기준값 파일과 비교해서 악화되면 종료 코드 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="허용 변화율 (0.25 = 25%%)")
+    parser.add_argument("--latency-slack-ms", type=float, default=5, help="지연 비교 시 추가로 허용하는 절대값")
+    parser.add_argument("--memory-slack-mb", type=float, default=10, help="메모리 비교 시 추가로 허용하는 절대값")
+    parser.add_argument("--flat-tolerance", type=float, default=1.0, help="다른 부하가 섞인 지연 비교 시 허용 변화율 (1.0 = 2배)")
+    parser.add_argument("--flat-slack-ms", type=float, default=20,
+                        help="다른 부하가 섞인 지연 비교 시 추가로 허용하는 절대값 (같은 프로세스의 DynamoDB 대역과 CPU를 나눠 쓰는 몫)")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="최대 RSS 상한, 지정하면 모든 시나리오에 적용 (기본: upload_10mb만 400MB)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(json.loads(args.worker))
+        return
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"알 수 없는 시나리오: {', '.join(unknown)}")
+
+    # 지연을 비교할 기준 시나리오도 함께 실행
+    for name in list(names):
+        names += [reference for reference in SCENARIOS[name].get("flat", {}).values() if reference not in names]
+
+    results = {}
+    for name in names:
+        print(f"▶️ {name}: {SCENARIOS[name]['description']}", flush=True)
+        results[name] = run_scenario(name, args)
+    print_results(results)
+    failures = check_limits(results, args)
+
+    if args.save:
+        baseline = {"scenarios": {}}
+        if os.path.exists(args.save):
+            with open(args.save, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline["machine"] = {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+        baseline["scenarios"].update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"💾 기준값 저장: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        machine = {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+        if baseline.get("machine") != machine:
+            print(f"⚠️ 기준값을 만든 환경과 다릅니다. {baseline.get('machine')} -> {machine}")
+        regressions = compare(baseline, results, args.tolerance, args.latency_slack_ms, args.memory_slack_mb)
+        if regressions:
+            print(f"❌ 기준값 대비 악화 {len(regressions)}건: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ 기준값 대비 악화 없음")
+
+    if failures:
+        print(f"❌ 조건 미달 {len(failures)}건: {', '.join(failures)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# 로컬 지식베이스 검색 성능 측정: recall@k 와 질의 지연 (exact vs IVF ANN)
+# 사용법:
+#   python bench/retrieval.py --synthetic 5000            # 합성 문서 청크 5000개로 임시 인덱스를 만들어 측정
+#   python bench/retrieval.py --index kb_index --queries q.jsonl
+#       q.jsonl 한 줄: {"question": "...", "source": "정답 파일명"} - 상위 k개 중 정답 파일이 있으면 적중
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import local_kb  # noqa: E402
+
+def synthetic_corpus(count, words_per_chunk, seed, chunks_per_doc=20):
+    # 문서마다 주제 어휘를 정해 청크를 만들고(실제 문서처럼 같은 문서 청크끼리 비슷함),
+    # 각 청크의 일부 구간을 질문으로 쓰는 질의 세트를 함께 만듦
+    rng = random.Random(seed)
+    # 한글 음절 전체(가~힣)에서 무작위로 2~4음절 단어 생성
+    vocabulary = list({"".join(chr(0xAC00 + rng.randrange(11172)) for _ in range(rng.randint(2, 4))) for _ in range(20000)})
+    chunks = []
+    queries = []
+    for i in range(count):
+        if i % chunks_per_doc == 0:
+            topic = rng.sample(vocabulary, 50)
+        words = [rng.choice(topic) if rng.random() < 0.8 else rng.choice(vocabulary) for _ in range(words_per_chunk)]
+        source = f"doc_{i // chunks_per_doc:04d}.txt"
+        chunks.append({"source": source, "text": " ".join(words)})
+        start = rng.randint(0, words_per_chunk - 8)
+        queries.append({"question": " ".join(words[start:start + 8]), "source": source, "chunk_text": chunks[-1]["text"]})
+    return chunks, queries
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if values else 0.0
+
+def run(index, queries, mode, nprobe, k_values, exact_top):
+    max_k = max(k_values)
+    hits_at = {k: 0 for k in k_values}
+    overlap = 0
+    latencies = []
+    for query, vector, exact_ids in zip(queries, exact_top["vectors"], exact_top["ids"]):
+        started = time.perf_counter()
+        results = index.search_vector(vector, k=max_k, mode=mode, nprobe=nprobe)
+        latencies.append((time.perf_counter() - started) * 1000)
+        for k in k_values:
+            if any(match(query, r) for r in results[:k]):
+                hits_at[k] += 1
+        overlap += len({r["id"] for r in results} & exact_ids) / max(len(exact_ids), 1)
+    n = len(queries)
+    return {
+        "mode": mode if mode == "exact" else f"ann(nprobe={nprobe})",
+        **{f"recall@{k}": hits_at[k] / n for k in k_values},
+        "ann_vs_exact": overlap / n,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+def match(query, result):
+    # 합성 데이터는 청크 단위, 실제 질의 세트는 출처 파일 단위로 정답 판정
+    if "chunk_text" in query:
+        return result["text"] == query["chunk_text"]
+    return result["source"] == query["source"]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", help="ingest.py로 만든 인덱스 폴더")
+    parser.add_argument("--queries", help="질의 세트 (JSONL)")
+    parser.add_argument("--synthetic", type=int, default=5000, help="합성 청크 수 (--index가 없을 때)")
+    parser.add_argument("--words", type=int, default=60, help="합성 청크당 단어 수")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", default="1,4,8,16", help="비교할 nprobe 목록")
+    parser.add_argument("--sample", type=int, default=500, help="측정할 질의 수")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    k_values = (1, 5, 10)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.index:
+            index = local_kb.LocalIndex(args.index)
+            with open(args.queries, encoding="utf-8") as f:
+                queries = [json.loads(line) for line in f if line.strip()]
+        else:
+            chunks, queries = synthetic_corpus(args.synthetic, args.words, args.seed)
+            started = time.perf_counter()
+            meta = local_kb.build_index(chunks, tmp, local_kb.HashEmbedder(), nlist=args.nlist)
+            print(f"🧱 합성 인덱스: 청크 {meta['count']}개, 클러스터 {meta['nlist']}개 ({time.perf_counter() - started:.1f}초)")
+            index = local_kb.LocalIndex(tmp)
+
+        queries = random.Random(args.seed).sample(queries, min(args.sample, len(queries)))
+        embed_latencies = []
+        vectors = []
+        for query in queries:
+            started = time.perf_counter()
+            vectors.append(index.embedder.embed_query(query["question"]))
+            embed_latencies.append((time.perf_counter() - started) * 1000)
+        exact_ids = [{r["id"] for r in index.search_vector(v, k=max(k_values), mode="exact")} for v in vectors]
+        exact_top = {"vectors": vectors, "ids": exact_ids}
+
+        print(f"질의 {len(queries)}개, 질의 임베딩 p50 {percentile(embed_latencies, 50):.2f}ms / p95 {percentile(embed_latencies, 95):.2f}ms")
+        rows = [run(index, queries, "exact", 0, k_values, exact_top)]
+        if index.centroids is not None:
+            rows += [run(index, queries, "ann", int(n), k_values, exact_top) for n in args.nprobe.split(",")]
+        else:
+            print("ℹ️ 클러스터가 없는 인덱스라 ANN 비교는 생략합니다.")
+
+        print(f"{'모드':<18}{'recall@1':>10}{'recall@5':>10}{'recall@10':>11}{'ANN/exact':>11}{'p50(ms)':>10}{'p95(ms)':>10}")
+        for row in rows:
+            print(
+                f"{row['mode']:<18}{row['recall@1']:>10.3f}{row['recall@5']:>10.3f}{row['recall@10']:>11.3f}"
+                f"{row['ann_vs_exact']:>11.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+# 벤치마크용 로컬 AWS 대역 (AWS 접근 없음)
+# 1) DynamoDBStandIn : DynamoDB JSON 프로토콜(X-Amz-Target)을 말하는 로컬 HTTP 서버
+#    main.py가 쓰는 GetItem / PutItem / UpdateItem(ADD) / Query / BatchWriteItem / BatchGetItem / TransactWriteItems(Put, Update)만 구현합니다.
+#    DYNAMODB_ENDPOINT_URL로 가리키면 boto3 직렬화/연결 풀까지 실제와 같은 경로로 호출됩니다.
+#    DynamoDB Local(https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/DynamoDBLocal.html)을 쓰려면
+#    create_tables(endpoint)로 테이블만 만들고 그 주소를 넘기면 됩니다.
+# 2) BedrockStandIn : bedrock_agent / bedrock_runtime 자리에 넣는 가짜 클라이언트
+#    응답 지연(로그정규분포), 토큰 단위 스트리밍, 스로틀링(ThrottlingException) 비율을 설정할 수 있습니다.
+# 3) BedrockHTTPStandIn : BedrockStandIn을 REST 프로토콜로 감싼 로컬 HTTP 서버
+#    BEDROCK_AGENT_ENDPOINT_URL / BEDROCK_RUNTIME_ENDPOINT_URL로 가리키면 별도 프로세스(python main.py, 여러 워커)에서도
+#    대역을 쓸 수 있습니다. 비스트리밍 RetrieveAndGenerate / InvokeModel만 구현합니다.
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+# 테이블 이름 -> (파티션 키, 정렬 키)
+TABLE_KEYS = {
+    "CareMeal-Users": ("user_id", None),
+    "CareMeal-ChatLog": ("user_id", "timestamp"),
+    "CareMeal-MealLog": ("user_id", "timestamp"),
+    "CareMeal-MealRollup": ("user_id", "period"),
+}
+
+# --- DynamoDB ---
+class DynamoDBError(Exception):
+    def __init__(self, code, message, **details):
+        super().__init__(message)
+        self.code = code
+        self.details = details  # 오류 응답에 함께 실을 필드 (예: CancellationReasons)
+
+class DynamoDBStore:
+    # 항목은 DynamoDB 응답 형식({"S": ...}, {"N": ...}) 그대로 저장
+    def __init__(self, tables=TABLE_KEYS):
+        self.keys = dict(tables)
+        self.tables = {name: {} for name in tables}
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def handle(self, operation, request):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        handler = getattr(self, operation.lower(), None)
+        if handler is None:
+            raise DynamoDBError("UnknownOperationException", f"지원하지 않는 작업: {operation}")
+        with self.lock:
+            return handler(request)
+
+    def table(self, name):
+        if name not in self.tables:
+            raise DynamoDBError("ResourceNotFoundException", f"Requested resource not found: {name}")
+        return self.tables[name]
+
+    def key_of(self, name, item):
+        hash_key, range_key = self.keys[name]
+        return item[hash_key]["S"], item[range_key]["S"] if range_key else ""
+
+    def getitem(self, request):
+        item = self.table(request["TableName"]).get(self.key_of(request["TableName"], request["Key"]))
+        return {"Item": item} if item else {}
+
+    def putitem(self, request):
+        name = request["TableName"]
+        self.check_put_condition(request)
+        self.table(name)[self.key_of(name, request["Item"])] = request["Item"]
+        return {}
+
+    def check_put_condition(self, request):
+        name = request["TableName"]
+        condition = request.get("ConditionExpression")
+        if not condition:
+            return
+        if not re.fullmatch(r"attribute_not_exists\(\s*[#\w]+\s*\)", condition):
+            raise DynamoDBError("ValidationException", f"지원하지 않는 조건식: {condition}")
+        if self.key_of(name, request["Item"]) in self.table(name):
+            raise DynamoDBError("ConditionalCheckFailedException", "The conditional request failed")
+
+    def updateitem(self, request):
+        name = request["TableName"]
+        key = self.key_of(name, request["Key"])
+        expression = request["UpdateExpression"].strip()
+        if not expression.upper().startswith("ADD "):
+            raise DynamoDBError("ValidationException", f"지원하지 않는 갱신식: {expression}")
+        names = request.get("ExpressionAttributeNames", {})
+        values = request.get("ExpressionAttributeValues", {})
+        item = self.table(name).setdefault(key, dict(request["Key"]))
+        for part in expression[4:].split(","):
+            attribute, placeholder = part.split()
+            attribute = names.get(attribute, attribute)
+            current = float(item[attribute]["N"]) if attribute in item else 0.0
+            item[attribute] = {"N": format_number(current + float(values[placeholder]["N"]))}
+        return {}
+
+    def transactwriteitems(self, request):
+        # 저장소 잠금 안에서 실행되므로 조건을 모두 확인한 뒤 한꺼번에 적용하면 원자적
+        actions = request["TransactItems"]
+        reasons = [{"Code": "None"} for _ in actions]
+        for index, action in enumerate(actions):
+            if "Put" in action and action["Put"].get("ConditionExpression"):
+                try:
+                    self.check_put_condition(action["Put"])
+                except DynamoDBError as e:
+                    if e.code != "ConditionalCheckFailedException":
+                        raise
+                    reasons[index] = {"Code": "ConditionalCheckFailed", "Message": str(e)}
+        if any(reason["Code"] != "None" for reason in reasons):
+            raise DynamoDBError(
+                "TransactionCanceledException", "Transaction cancelled, please refer cancellation reasons for specific reasons",
+                CancellationReasons=reasons,
+            )
+        for action in actions:
+            if "Put" in action:
+                self.putitem({key: value for key, value in action["Put"].items() if key != "ConditionExpression"})
+            elif "Update" in action:
+                self.updateitem(action["Update"])
+            else:
+                raise DynamoDBError("ValidationException", f"지원하지 않는 트랜잭션 작업: {list(action)}")
+        return {}
+
+    def batchwriteitem(self, request):
+        for name, writes in request["RequestItems"].items():
+            table = self.table(name)
+            for write in writes:
+                if "PutRequest" in write:
+                    item = write["PutRequest"]["Item"]
+                    table[self.key_of(name, item)] = item
+                else:
+                    table.pop(self.key_of(name, write["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": {}}
+
+    def batchgetitem(self, request):
+        responses = {}
+        for name, spec in request["RequestItems"].items():
+            table = self.table(name)
+            found = (table.get(self.key_of(name, key)) for key in spec["Keys"])
+            responses[name] = [item for item in found if item]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def query(self, request):
+        name = request["TableName"]
+        hash_key, range_key = self.keys[name]
+        names = request.get("ExpressionAttributeNames", {})
+        values = request.get("ExpressionAttributeValues", {})
+        conditions = parse_key_condition(request["KeyConditionExpression"], names, values)
+
+        partition = conditions.pop(hash_key)[1][0]
+        items = [item for (h, _), item in self.table(name).items() if h == partition]
+        if range_key in conditions:
+            op, operands = conditions[range_key]
+            items = [item for item in items if compare(item[range_key]["S"], op, operands)]
+        items.sort(key=lambda item: item[range_key]["S"] if range_key else "", reverse=not request.get("ScanIndexForward", True))
+
+        start = request.get("ExclusiveStartKey")
+        if start:
+            position = self.key_of(name, start)
+            keys = [self.key_of(name, item) for item in items]
+            items = items[keys.index(position) + 1:] if position in keys else []
+        limit = request.get("Limit")
+        page = items[:limit] if limit else items
+        response = {"Items": [project(item, request.get("ProjectionExpression"), names) for item in page]}
+        response["Count"] = response["ScannedCount"] = len(page)
+        if limit and len(items) > limit:
+            last = page[-1]
+            response["LastEvaluatedKey"] = {k: last[k] for k in (hash_key, range_key) if k}
+        return response
+
+def format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def parse_key_condition(expression, names, values):
+    # boto3 Key() 조건식("(#n0 = :v0 AND #n1 BETWEEN :v1 AND :v2)")을 {속성: (연산자, [값])}로 변환
+    pattern = re.compile(
+        r"([#\w]+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)"
+        r"|([#\w]+)\s*(=|<=|>=|<|>)\s*(:\w+)"
+        r"|begins_with\s*\(\s*([#\w]+)\s*,\s*(:\w+)\s*\)",
+        re.I,
+    )
+    conditions = {}
+    for match in pattern.finditer(expression):
+        if match.group(1):
+            attribute, op, operands = match.group(1), "BETWEEN", match.group(2, 3)
+        elif match.group(4):
+            attribute, op, operands = match.group(4), match.group(5), (match.group(6),)
+        else:
+            attribute, op, operands = match.group(7), "begins_with", (match.group(8),)
+        conditions[names.get(attribute, attribute)] = (op, [values[p]["S"] for p in operands])
+    if re.sub(r"[()\s]|\bAND\b", "", pattern.sub("", expression), flags=re.I):
+        raise DynamoDBError("ValidationException", f"지원하지 않는 키 조건식: {expression}")
+    return conditions
+
+def compare(value, op, operands):
+    if op == "=":
+        return value == operands[0]
+    if op == "<":
+        return value < operands[0]
+    if op == "<=":
+        return value <= operands[0]
+    if op == ">":
+        return value > operands[0]
+    if op == ">=":
+        return value >= operands[0]
+    if op == "BETWEEN":
+        return operands[0] <= value <= operands[1]
+    return value.startswith(operands[0])
+
+def project(item, projection, names):
+    if not projection:
+        return item
+    attributes = [names.get(a.strip(), a.strip()) for a in projection.split(",")]
+    return {a: item[a] for a in attributes if a in item}
+
+class DynamoDBHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # 헤더/본문을 따로 쓰면 delayed ACK 때문에 응답마다 ~40ms가 붙음
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        operation = self.headers.get("X-Amz-Target", "").split(".")[-1]
+        time.sleep(self.server.latency)
+        try:
+            status, payload = 200, self.server.store.handle(operation, json.loads(body or b"{}"))
+        except DynamoDBError as e:
+            status, payload = 400, {"__type": f"com.amazonaws.dynamodb.v20120810#{e.code}", "message": str(e), **e.details}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class DynamoDBStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency_ms=2.0, tables=TABLE_KEYS):
+        self.latency = latency_ms / 1000
+        self.store = DynamoDBStore(tables)
+        super().__init__(("127.0.0.1", 0), DynamoDBHandler)
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def create_tables(endpoint, region="us-east-1", tables=TABLE_KEYS):
+    # DynamoDB Local 같은 외부 엔드포인트에 main.py가 쓰는 테이블을 만듦 (이미 있으면 건너뜀)
+    import boto3
+    client = boto3.client(
+        "dynamodb", endpoint_url=endpoint, region_name=region,
+        aws_access_key_id="bench", aws_secret_access_key="bench"
+    )
+    existing = set(client.list_tables()["TableNames"])
+    for name, (hash_key, range_key) in tables.items():
+        if name in existing:
+            continue
+        keys = [(hash_key, "HASH")] + ([(range_key, "RANGE")] if range_key else [])
+        client.create_table(
+            TableName=name,
+            KeySchema=[{"AttributeName": k, "KeyType": t} for k, t in keys],
+            AttributeDefinitions=[{"AttributeName": k, "AttributeType": "S"} for k, _ in keys],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+# --- Bedrock ---
+FOOD_ANSWER = (
+    "사진 속 음식은 현미밥, 된장찌개, 시금치나물로 보입니다. 탄수화물 양이 적당하고 채소가 충분해 혈당 관리에 좋은 구성입니다.\n"
+    "###JSON_START###{{\"menu\": \"{menu}\", \"calories\": {calories}, \"carbs\": {carbs}, \"protein\": 18, \"fat\": 9}}###JSON_END###"
+)
+MENUS = ("현미밥 정식", "닭가슴살 샐러드", "잡곡밥과 생선구이", "비빔밥", "두부 스테이크")
+
+class BedrockStandIn:
+    # bedrock_agent와 bedrock_runtime 양쪽 자리에 같은 객체를 넣어 사용
+    def __init__(self, latency_ms=300.0, token_ms=5.0, output_tokens=120, throttle_rate=0.0, citation_rate=0.7, seed=0):
+        self.latency = latency_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.output_tokens = output_tokens
+        self.throttle_rate = throttle_rate
+        self.citation_rate = citation_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.throttled = 0
+
+    def begin(self, operation):
+        # 호출 수를 세고, 설정한 비율만큼 스로틀링 오류를 냄
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            throttle = self.random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+            delay = self.random.lognormvariate(math.log(self.latency), 0.3) if self.latency > 0 else 0
+        if throttle:
+            time.sleep(min(delay, 0.05))
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, operation)
+        time.sleep(delay)
+
+    def has_citation(self, text):
+        # 같은 질문은 항상 같은 결과가 나오도록 질문 내용으로 결정
+        return (zlib.crc32(text.encode("utf-8")) % 1000) / 1000 < self.citation_rate
+
+    def tokens(self, count=None):
+        words = ("혈당", "관리를", "위해", "식사", "후", "가벼운", "산책과", "채소", "위주의", "식단을", "권장합니다.")
+        return [(" " if i else "") + words[i % len(words)] for i in range(count or self.output_tokens)]
+
+    def citations(self, question):
+        if not self.has_citation(question):
+            return []
+        return [{"retrievedReferences": [{"location": {"s3Location": {"uri": "s3://caremeal-kb/당뇨병_식사요법.pdf"}}}]}]
+
+    # bedrock-agent-runtime
+    def retrieve_and_generate(self, input, **kwargs):
+        self.begin("RetrieveAndGenerate")
+        tokens = self.tokens()
+        time.sleep(self.token_delay * len(tokens))  # 비스트리밍은 생성이 끝나야 응답
+        return {"output": {"text": "".join(tokens)}, "citations": self.citations(input["text"])}
+
+    def retrieve_and_generate_stream(self, input, **kwargs):
+        self.begin("RetrieveAndGenerateStream")
+
+        def events():
+            for token in self.tokens():
+                time.sleep(self.token_delay)
+                yield {"output": {"text": token}}
+            for citation in self.citations(input["text"]):
+                yield {"citation": citation}
+        return {"stream": events()}
+
+    # bedrock-runtime
+    def invoke_model(self, modelId, body, **kwargs):
+        self.begin("InvokeModel")
+        text = self.answer_for(body)
+        output_tokens = max(1, len(text) // 2)
+        time.sleep(self.token_delay * min(output_tokens, self.output_tokens))
+        payload = {
+            "content": [{"type": "text", "text": text}],
+            "usage": {"input_tokens": len(body) // 4, "output_tokens": output_tokens},
+        }
+        return {"body": ResponseBody(json.dumps(payload).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        self.begin("InvokeModelWithResponseStream")
+        tokens = self.tokens()
+
+        def events():
+            yield chunk({"type": "message_start", "message": {"usage": {"input_tokens": len(body) // 4}}})
+            for token in tokens:
+                time.sleep(self.token_delay)
+                yield chunk({"type": "content_block_delta", "delta": {"type": "text_delta", "text": token}})
+            yield chunk({"type": "message_delta", "usage": {"output_tokens": len(tokens)}})
+            yield chunk({"type": "message_stop"})
+        return {"body": events()}
+
+    def answer_for(self, body):
+        body = body.decode() if isinstance(body, bytes) else body
+        if '"type": "image"' in body:
+            menu = self.random.choice(MENUS)
+            return FOOD_ANSWER.format(menu=menu, calories=self.random.randint(350, 750), carbs=self.random.randint(40, 110))
+        return "".join(self.tokens())
+
+    def stats(self):
+        return {"calls": dict(self.calls), "throttled": self.throttled}
+
+class ResponseBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+def chunk(event):
+    return {"chunk": {"bytes": json.dumps(event).encode()}}
+
+class BedrockHTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        bedrock = self.server.bedrock
+        path = urllib.parse.unquote(self.path)
+        error_code = None
+        try:
+            if path == "/retrieveAndGenerate":
+                response = bedrock.retrieve_and_generate(json.loads(body)["input"])
+                status, data = 200, json.dumps({**response, "sessionId": "bench"}).encode()
+            elif path.startswith("/model/") and path.endswith("/invoke"):
+                status, data = 200, bedrock.invoke_model(path[len("/model/"):-len("/invoke")], body)["body"].read()
+            else:
+                status, data = 404, json.dumps({"message": f"지원하지 않는 경로: {path}"}).encode()
+        except ClientError as e:
+            status, data = 429, json.dumps({"message": e.response["Error"]["Message"]}).encode()
+            error_code = e.response["Error"]["Code"]
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if error_code:
+            self.send_header("x-amzn-ErrorType", error_code)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class BedrockHTTPStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, **kwargs):
+        self.bedrock = BedrockStandIn(**kwargs)
+        super().__init__(("127.0.0.1", 0), BedrockHTTPHandler)
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,30 @@
+# 로컬 지식베이스 인덱스 생성 (RAG_BACKEND=local 용)
+# data 폴더의 문서(.txt, .md, .pdf)를 청크로 나누고 CPU 임베딩 모델로 벡터화해 인덱스 폴더에 저장합니다.
+# 사용법: python ingest.py data --out kb_index [--embedder intfloat/multilingual-e5-small] [--nlist 64]
+#         --embedder hash 는 모델 다운로드 없이 동작하는 해시 임베딩 (테스트용)
+import argparse
+import time
+
+import local_kb
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", nargs="?", default="data")
+    parser.add_argument("--out", default="kb_index")
+    parser.add_argument("--embedder", default=local_kb.DEFAULT_EMBEDDER)
+    parser.add_argument("--chunk-size", type=int, default=500, help="청크 최대 글자 수")
+    parser.add_argument("--overlap", type=int, default=100, help="이웃 청크와 겹치는 최대 글자 수")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF 클러스터 수 (기본: 청크 1000개 이상이면 sqrt(청크 수), 0이면 exact 검색만)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    chunks = list(local_kb.iter_chunks(args.folder, args.chunk_size, args.overlap))
+    sources = {chunk["source"] for chunk in chunks}
+    print(f"📄 문서 {len(sources)}개 -> 청크 {len(chunks)}개")
+
+    embedder = local_kb.load_embedder(args.embedder)
+    meta = local_kb.build_index(chunks, args.out, embedder, nlist=args.nlist)
+    print(f"✅ 인덱스 생성 완료: {args.out} ({meta['embedder']}, {meta['dim']}차원, 클러스터 {meta['nlist']}개, {time.perf_counter() - started:.1f}초)")
+
+if __name__ == "__main__":
+    main()
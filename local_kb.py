@@ -0,0 +1,245 @@
+# 로컬 지식베이스: 문서 청크 임베딩 + 메모리 매핑 벡터 인덱스
+# ingest.py가 만든 인덱스 폴더를 main.py(RAG_BACKEND=local)가 열어 Bedrock 지식베이스 없이 검색합니다.
+#
+# 인덱스 폴더 구성
+#   meta.json      임베딩 모델, 차원, 청크 수, IVF 클러스터 수
+#   vectors.f32    (청크 수 x 차원) float32, L2 정규화 - np.memmap으로 열어 필요한 구간만 읽음
+#   chunks.jsonl   청크 본문과 출처 파일명 (vectors.f32와 같은 순서)
+#   centroids.npy  IVF 클러스터 중심 (ANN 검색용, 청크가 적으면 없음)
+#   offsets.npy    클러스터별 시작 행 - 벡터를 클러스터 순서로 정렬해 두어 한 클러스터가 연속 구간이 됨
+#
+# 검색 모드
+#   exact : 전체 벡터와 내적 (정확하지만 청크 수에 비례)
+#   ann   : 질문과 가까운 클러스터 nprobe개만 내적 (IVF, 근사 검색)
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+DEFAULT_EMBEDDER = "intfloat/multilingual-e5-small"  # 한국어를 지원하는 CPU용 소형 모델
+SUPPORTED_EXTENSIONS = {".txt", ".md", ".pdf"}
+SEARCH_BLOCK_ROWS = 65536  # exact 검색 시 한 번에 내적하는 행 수 (메모리 사용량 제한)
+
+# --- 문서 읽기 & 청크 분할 ---
+def read_document(path):
+    if path.lower().endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError("PDF를 읽으려면 pypdf가 필요합니다. (pip install pypdf)")
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+def split_sentences(text):
+    # 문단 경계와 문장 부호 뒤에서 자름
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = re.sub(r"\s+", " ", paragraph).strip()
+        if paragraph:
+            sentences.extend(s for s in re.split(r"(?<=[.!?。])\s+", paragraph) if s)
+    return sentences
+
+def split_text(text, chunk_size=500, overlap=100):
+    # 문장 단위로 chunk_size 글자까지 채우고, 다음 청크는 앞 청크 끝 문장(overlap 글자 이내)부터 시작
+    chunks = []
+    current = []
+    length = 0
+    for sentence in split_sentences(text):
+        if len(sentence) > chunk_size:
+            # 너무 긴 문장은 글자 수로 자름
+            pieces = [sentence[i:i + chunk_size] for i in range(0, len(sentence), chunk_size - overlap)]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            if current and length + len(piece) + 1 > chunk_size:
+                chunks.append(" ".join(current))
+                carry = []
+                carry_length = 0
+                for previous in reversed(current):
+                    if carry_length + len(previous) > overlap:
+                        break
+                    carry.insert(0, previous)
+                    carry_length += len(previous) + 1
+                current = carry
+                length = carry_length
+            current.append(piece)
+            length += len(piece) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def iter_chunks(folder, chunk_size=500, overlap=100):
+    for root, _, files in sorted(os.walk(folder)):
+        for file_name in sorted(files):
+            if os.path.splitext(file_name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            path = os.path.join(root, file_name)
+            for text in split_text(read_document(path), chunk_size, overlap):
+                yield {"source": os.path.relpath(path, folder), "text": text}
+
+# --- 임베딩 ---
+class HashEmbedder:
+    # 글자 2~3-gram을 해시해 고정 차원 벡터로 만드는 모델 없는 임베딩
+    # 의미 유사도는 약하지만 설치할 것이 없어 오프라인 테스트와 벤치마크에 사용
+    def __init__(self, dim=512):
+        self.name = f"hash-{dim}"
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = re.sub(r"\s+", " ", text.lower())
+            for n in (2, 3):
+                for i in range(len(text) - n + 1):
+                    h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                    vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return normalize(vectors)
+
+    def embed_documents(self, texts):
+        return self.embed(texts)
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
+
+class SentenceTransformerEmbedder:
+    def __init__(self, name):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("임베딩 모델을 쓰려면 sentence-transformers가 필요합니다. (pip install sentence-transformers)")
+        self.name = name
+        self.model = SentenceTransformer(name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        # e5 계열은 질문/문서 앞에 접두어를 붙여야 성능이 나옴
+        self.prefixes = ("query: ", "passage: ") if "e5" in name else ("", "")
+
+    def embed_documents(self, texts, batch_size=32):
+        texts = [self.prefixes[1] + text for text in texts]
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True).astype(np.float32)
+
+    def embed_query(self, text):
+        return self.model.encode([self.prefixes[0] + text], normalize_embeddings=True)[0].astype(np.float32)
+
+def load_embedder(name):
+    match = re.fullmatch(r"hash(?:-(\d+))?", name)
+    if match:
+        return HashEmbedder(int(match.group(1) or 512))
+    return SentenceTransformerEmbedder(name)
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# --- IVF (클러스터) 학습 ---
+def train_centroids(vectors, nlist, iterations=10, seed=0):
+    # 정규화된 벡터용 spherical k-means (표본 최대 nlist*256개로 학습)
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * 256), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                centroids[c] = sample[rng.integers(len(sample))]  # 빈 클러스터는 임의 점으로 다시 시작
+        centroids = normalize(centroids)
+    return centroids.astype(np.float32)
+
+def assign_clusters(vectors, centroids, block=SEARCH_BLOCK_ROWS):
+    return np.concatenate([
+        np.argmax(vectors[i:i + block] @ centroids.T, axis=1) for i in range(0, len(vectors), block)
+    ])
+
+def default_nlist(count):
+    # 청크가 적으면 전체 내적이 더 빠르므로 클러스터를 만들지 않음
+    return int(np.sqrt(count)) if count >= 1000 else 0
+
+# --- 인덱스 생성 ---
+def build_index(chunks, out_dir, embedder, nlist=None, batch_size=256):
+    chunks = list(chunks)
+    if not chunks:
+        raise RuntimeError("색인할 문서가 없습니다.")
+    os.makedirs(out_dir, exist_ok=True)
+
+    vectors = np.concatenate([
+        embedder.embed_documents([c["text"] for c in chunks[i:i + batch_size]])
+        for i in range(0, len(chunks), batch_size)
+    ]).astype(np.float32)
+
+    nlist = default_nlist(len(chunks)) if nlist is None else min(nlist, len(chunks))
+    if nlist:
+        centroids = train_centroids(vectors, nlist)
+        assign = assign_clusters(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        vectors = vectors[order]
+        chunks = [chunks[i] for i in order]
+        np.save(os.path.join(out_dir, "centroids.npy"), centroids)
+        np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+    else:
+        for file_name in ("centroids.npy", "offsets.npy"):
+            if os.path.exists(os.path.join(out_dir, file_name)):
+                os.remove(os.path.join(out_dir, file_name))
+
+    mapped = np.memmap(os.path.join(out_dir, "vectors.f32"), dtype=np.float32, mode="w+", shape=vectors.shape)
+    mapped[:] = vectors
+    mapped.flush()
+    del mapped
+
+    with open(os.path.join(out_dir, "chunks.jsonl"), "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+    meta = {"embedder": embedder.name, "dim": int(vectors.shape[1]), "count": len(chunks), "nlist": nlist}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+# --- 검색 ---
+class LocalIndex:
+    def __init__(self, path, embedder=None):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.size = self.meta["count"]
+        self.vectors = np.memmap(
+            os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=(self.size, self.meta["dim"])
+        )
+        with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in f]
+        self.centroids = None
+        self.offsets = None
+        if self.meta["nlist"]:
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.embedder = embedder or load_embedder(self.meta["embedder"])
+
+    def search(self, query, k=5, mode="ann", nprobe=8):
+        return self.search_vector(self.embedder.embed_query(query), k, mode, nprobe)
+
+    def search_vector(self, query_vector, k=5, mode="ann", nprobe=8):
+        if mode == "ann" and self.centroids is not None:
+            # 가까운 클러스터 nprobe개의 연속 구간만 읽어서 내적
+            probe = np.argsort(self.centroids @ query_vector)[::-1][:nprobe]
+            ranges = [(self.offsets[c], self.offsets[c + 1]) for c in probe]
+        else:
+            ranges = [(i, min(i + SEARCH_BLOCK_ROWS, self.size)) for i in range(0, self.size, SEARCH_BLOCK_ROWS)]
+
+        ranges = [(start, end) for start, end in ranges if end > start]
+        if not ranges:
+            return []
+        scores = np.concatenate([self.vectors[start:end] @ query_vector for start, end in ranges])
+        ids = np.concatenate([np.arange(start, end) for start, end in ranges])
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": int(ids[i]), "score": float(scores[i]), "source": self.chunks[ids[i]]["source"], "text": self.chunks[ids[i]]["text"]}
+            for i in top
+        ]
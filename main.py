@@ -1,21 +1,232 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.formparsers import MultiPartParser
+from pydantic import BaseModel, Field, ValidationError, field_validator
 import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+)
 import uvicorn
-from datetime import datetime
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 import uuid
 import json
 import base64
+import io
 import os
+import asyncio
+import functools
+import threading
+import time
+import re
+import sys
+import math
+import sqlite3
+import unicodedata
+import random
+import hashlib
+import bisect
+import atexit
+import contextvars
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import asynccontextmanager, contextmanager
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from decimal import Decimal
+from PIL import Image, ImageOps
+import local_kb
+
+try:
+    import redis  # 선택 의존성: 여러 워커가 캐시를 공유할 때만 필요
+except ImportError:
+    redis = None
 
 # 환경 변수 로드
 load_dotenv()
 
+# --- 로깅 & 지표 (Observability) ---
+# 로그는 QueueHandler로 큐에 넣기만 하고 별도 스레드(QueueListener)가 출력하므로 요청 경로에서 I/O를 기다리지 않습니다.
+# 모든 로그 줄에는 요청 ID(X-Request-ID 헤더 또는 자동 생성)가 붙습니다.
+# 단계별 소요 시간(stage)과 엔드포인트별 응답 시간은 히스토그램으로 모아 /metrics(Prometheus 텍스트 형식)로 내보냅니다.
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+    # 로그를 남기는 스레드에서 실행되므로 그 시점의 요청 ID가 기록됨
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(message)s"))
+log_queue = queue.SimpleQueue()
+log_queue_handler = QueueHandler(log_queue)
+log_queue_handler.addFilter(RequestIdFilter())
+logger = logging.getLogger("caremeal")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+logger.addHandler(log_queue_handler)
+logger.propagate = False
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)  # 종료 시 큐에 남은 로그 출력
+LOG_SPANS = os.getenv("LOG_SPANS", "1") == "1"  # 단계별 소요 시간도 로그로 남길지
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # 라벨 값 -> [버킷별 개수..., 합계, 개수]
+        self.lock = threading.Lock()  # 풀 스레드에서도 기록
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.setdefault(labels, [0] * (len(self.buckets) + 2))
+            index = bisect.bisect_left(self.buckets, value)  # value <= 경계값인 첫 버킷
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.series.items()]
+        for labels, series in items:
+            base = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+class CounterMetric:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.values.items())
+        lines += [f"{self.name}{{{format_labels(self.label_names, labels)}}} {value}" for labels, value in items]
+        return lines
+
+def format_labels(names, values):
+    return ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+
+http_request_seconds = Histogram(
+    "caremeal_http_request_duration_seconds", "엔드포인트별 응답 시간", ("method", "path", "status")
+)
+stage_seconds = Histogram(
+    "caremeal_stage_duration_seconds", "요청 처리 단계별 소요 시간", ("stage", "outcome")
+)
+bedrock_tokens = CounterMetric(
+    "caremeal_bedrock_tokens_total", "Bedrock 응답에 기록된 토큰 사용량", ("model", "type")
+)
+
+@contextmanager
+def stage(name):
+    # with stage("rag.retrieve_and_generate"): ... 형태로 감싼 구간의 시간을 기록
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe((name, outcome), elapsed)
+        if LOG_SPANS:
+            logger.info(f"⏱️ stage={name} outcome={outcome} ms={elapsed * 1000:.1f}")
+
+def record_token_usage(model_id, usage):
+    # Anthropic 응답의 usage(input_tokens/output_tokens)를 모델별로 누적
+    model = model_id.split("/")[-1]
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            bedrock_tokens.inc((model, kind.split("_")[0]), usage[kind])
+# -----------------------------------------------------------
+
 # 1. 앱 생성 및 설정
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    chat_log_writer.start()  # 지난번에 못 쓴 채팅 로그가 있으면 다시 저장
+    warmup_task = asyncio.create_task(run_warmup())  # 요청은 바로 받고, /ready는 워밍업이 끝나야 200
+    yield
+    server_state["status"] = "draining"
+    warmup_task.cancel()
+    await drain_in_flight()  # 진행 중인 스트리밍 응답/백그라운드 작업이 끝나기를 기다림
+    await chat_log_writer.close()  # 대기 중인 채팅 로그 저장 후 종료
+    flush_logs()
+
+app = FastAPI(lifespan=lifespan)
+
+# 워커 프로세스 수 - python main.py로 띄울 때 사용 (uvicorn CLI도 WEB_CONCURRENCY를 --workers 기본값으로 읽음)
+# 워커마다 모듈 전역 상태를 따로 가지므로 Bedrock 할당량 등 프로세스별 설정을 이 값으로 나눕니다.
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# 업로드 크기 제한: 본문을 다 받기 전에 Content-Length / 누적 수신량으로 413 응답
+# multipart 파일은 UPLOAD_SPOOL_BYTES를 넘으면 메모리 대신 임시 파일에 저장됨
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_LIMITED_PATHS = {"/analyze-food"}
+MultiPartParser.spool_max_size = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+
+class UploadSizeLimitMiddleware:
+    def __init__(self, app, paths, max_bytes):
+        self.app = app
+        self.paths = paths
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and not content_length.isdigit():
+            # 숫자가 아닌 값(음수, 공백 포함 등)은 int()에서 500이 나지 않도록 먼저 거절
+            response = JSONResponse(status_code=400, content={"detail": "잘못된 Content-Length 헤더입니다."})
+            return await response(scope, receive, send)
+        if content_length and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": "업로드 파일이 너무 큽니다."})
+            return await response(scope, receive, send)
+
+        received = 0
+        async def limited_receive():
+            # Content-Length가 없는(chunked) 요청도 누적 수신량으로 차단
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="업로드 파일이 너무 큽니다.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware, paths=UPLOAD_LIMITED_PATHS, max_bytes=UPLOAD_MAX_BYTES)
+# 일괄 분석은 사진 여러 장을 한 번에 받으므로 요청 전체 한도를 따로 둠
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+app.add_middleware(UploadSizeLimitMiddleware, paths={"/analyze-food/batch"}, max_bytes=BATCH_UPLOAD_MAX_BYTES)
 
 # CORS 설정 (프론트엔드 접속 허용)
 app.add_middleware(
@@ -26,11 +237,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 요청 ID 부여 + 엔드포인트별 응답 시간 기록 (가장 바깥 미들웨어)
+# 스트리밍 응답은 마지막 청크를 보낼 때까지를 응답 시간으로 봅니다.
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            # 경로 템플릿(예: /meals/daily)으로 묶고, 라우트가 없으면 하나로 모아 라벨 수가 늘지 않게 함
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            http_request_seconds.observe((scope["method"], path, str(status)), time.perf_counter() - started)
+            request_id_var.reset(token)
+
+app.add_middleware(RequestContextMiddleware)
+
 # 2. 데이터 구조 정의 (Pydantic Models)
 class ChatRequest(BaseModel):
     user_message: str
     user_id: str = "guest"
 
+class ChatBatchRequest(BaseModel):
+    questions: list[str]
+    user_id: str = "guest"
+
 class SignUpRequest(BaseModel):
     user_id: str
     password: str
@@ -52,257 +300,1762 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
 
-# --- AWS 클라이언트 연결 (이 부분이 없어서 에러가 났던 겁니다!) ---
-# 1) Bedrock 연결
-bedrock_agent = boto3.client(
-    service_name='bedrock-agent-runtime',
-    region_name=AWS_DEFAULT_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
-bedrock_runtime = boto3.client(
-    service_name='bedrock-runtime',
-    region_name=AWS_DEFAULT_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
+# --- AWS 클라이언트 설정 ---
+# botocore 기본값(연결 풀 10개, legacy 재시도, 읽기 타임아웃 60초)은 아래 스레드 풀(기본 64/16)보다 작아서
+# 동시 호출이 10개를 넘으면 연결을 재사용하지 못하고 매번 새로 맺습니다.
+# 클라이언트별 접두어(BEDROCK_AGENT / BEDROCK_RUNTIME / DYNAMODB)로 환경 변수를 두어 조정합니다.
+#   <접두어>_MAX_POOL, _CONNECT_TIMEOUT, _READ_TIMEOUT, _RETRY_MODE(legacy|standard|adaptive),
+#   _MAX_ATTEMPTS, _TCP_KEEPALIVE(1|0), _ENDPOINT_URL(로컬 스텁/DynamoDB Local 등)
+def aws_client_config(prefix, max_pool, connect_timeout, read_timeout, retry_mode):
+    return Config(
+        max_pool_connections=int(os.getenv(f"{prefix}_MAX_POOL", str(max_pool))),
+        connect_timeout=float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", str(connect_timeout))),
+        read_timeout=float(os.getenv(f"{prefix}_READ_TIMEOUT", str(read_timeout))),
+        retries={
+            "mode": os.getenv(f"{prefix}_RETRY_MODE", retry_mode),
+            "total_max_attempts": int(os.getenv(f"{prefix}_MAX_ATTEMPTS", "3")),  # 첫 시도 포함
+        },
+        tcp_keepalive=os.getenv(f"{prefix}_TCP_KEEPALIVE", "1") == "1",
+    )
 
-# 2) DynamoDB 연결
-dynamodb = boto3.resource(
-    'dynamodb',
-    region_name=AWS_DEFAULT_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
+class AWSCallStats:
+    # botocore 이벤트로 클라이언트별 동시 HTTP 요청 수를 세어 연결 풀 포화 여부를 보여줌
+    # (스트리밍 응답은 본문을 다 읽을 때까지 연결을 쥐고 있지만 여기서는 응답 헤더 수신까지만 셈)
+    def __init__(self, max_pool):
+        self.max_pool = max_pool
+        self.lock = threading.Lock()  # 이벤트는 풀 스레드에서 동시에 발생
+        self.created = False
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.attempts = 0
+        self.over_pool = 0  # 연결 풀 크기를 넘어 보낸 요청 수 (새 연결을 맺고 버림)
+
+    def attach(self, events):
+        self.created = True
+        events.register("before-call", self._on_call)
+        events.register("before-send", self._on_send)
+        events.register("response-received", self._on_response)
+
+    def _on_call(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+
+    def _on_send(self, **kwargs):
+        with self.lock:
+            self.attempts += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.in_flight > self.max_pool:
+                self.over_pool += 1
+
+    def _on_response(self, **kwargs):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "created": self.created,
+            "max_pool": self.max_pool,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "peak_utilization": round(self.peak_in_flight / self.max_pool, 3),
+            "calls": self.calls,
+            "retries": self.attempts - self.calls,
+            "over_pool": self.over_pool,
+        }
+
+# boto3 기본 세션은 여러 스레드에서 동시에 클라이언트를 만들면 안전하지 않으므로 생성은 한 번에 하나씩
+aws_client_lock = threading.RLock()  # 테이블 생성이 리소스 생성을 부르므로 재진입 허용
+aws_call_stats = {}
+
+class LazyAWSClient:
+    # 처음 속성에 접근할 때 실제 클라이언트를 만들고 이후에는 그대로 위임
+    # import(테스트 포함) 시점에는 AWS 자격 증명 확인이나 엔드포인트 조회를 하지 않습니다.
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+
+    def _get(self):
+        if self._client is None:
+            with aws_client_lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+def create_aws_client(kind, service_name, prefix, config):
+    aws_call_stats[prefix.lower()] = stats = AWSCallStats(config.max_pool_connections)
+    client = getattr(boto3, kind)(
+        service_name,
+        region_name=AWS_DEFAULT_REGION,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=os.getenv(f"{prefix}_ENDPOINT_URL") or None,
+        config=config
+    )
+    stats.attach((client.meta.client if kind == "resource" else client).meta.events)
+    return client
+
+# 1) Bedrock 연결 - 생성 응답은 수십 초 걸릴 수 있어 읽기 타임아웃을 넉넉히, 스로틀링에 맞춰 adaptive 재시도
+BEDROCK_POOL_DEFAULT = int(os.getenv("BEDROCK_POOL_SIZE", "64"))
+DYNAMODB_POOL_DEFAULT = int(os.getenv("DYNAMODB_POOL_SIZE", "16"))
+bedrock_agent = LazyAWSClient(lambda: create_aws_client(
+    "client", "bedrock-agent-runtime", "BEDROCK_AGENT",
+    aws_client_config("BEDROCK_AGENT", BEDROCK_POOL_DEFAULT, 5, 120, "adaptive")
+))
+bedrock_runtime = LazyAWSClient(lambda: create_aws_client(
+    "client", "bedrock-runtime", "BEDROCK_RUNTIME",
+    aws_client_config("BEDROCK_RUNTIME", BEDROCK_POOL_DEFAULT, 5, 120, "adaptive")
+))
+
+# 2) DynamoDB 연결 - 응답이 빠르므로 타임아웃을 짧게 해서 느린 연결은 빨리 재시도
+dynamodb = LazyAWSClient(lambda: create_aws_client(
+    "resource", "dynamodb", "DYNAMODB",
+    aws_client_config("DYNAMODB", DYNAMODB_POOL_DEFAULT, 2, 5, "standard")
+))
 
 # 3) 테이블 연결
-chat_table = dynamodb.Table('CareMeal-ChatLog') # 채팅 로그용 테이블
-user_table = dynamodb.Table('CareMeal-Users')   # 회원가입용 테이블
+chat_table = LazyAWSClient(lambda: dynamodb.Table('CareMeal-ChatLog')) # 채팅 로그용 테이블
+user_table = LazyAWSClient(lambda: dynamodb.Table('CareMeal-Users'))   # 회원가입용 테이블
+
+def get_aws_client_stats():
+    return {name: stats.stats() for name, stats in aws_call_stats.items()}
 # -----------------------------------------------------------
 
-# 4. 헬퍼 함수: 채팅 로그 저장
-def save_to_dynamodb(user_id, role, message):
+# --- 비동기 I/O 풀 (boto3 동기 호출을 이벤트 루프 밖에서 실행) ---
+# boto3는 동기 라이브러리라서 async 엔드포인트에서 그대로 호출하면
+# Bedrock 응답(수 초)을 기다리는 동안 워커 전체가 멈춥니다.
+# 백엔드별로 전용 스레드 풀을 두어 느린 Bedrock 호출이 로그인(DynamoDB)을 막지 않게 합니다.
+class IOPool:
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue  # 실행 대기열 상한 (초과 시 503)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-io")
+        # 카운터는 이벤트 루프 스레드에서만 변경되므로 락이 필요 없음
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def queued(self):
+        return max(0, self.in_flight - self.max_workers)
+
+    async def run(self, fn, *args, **kwargs):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail=f"{self.name} 요청이 밀려 있습니다. 잠시 후 다시 시도해주세요.")
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            # 풀 스레드에서 남기는 로그에도 요청 ID가 붙도록 contextvars를 복사해서 실행
+            context = contextvars.copy_context()
+            result = await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+async def stream_in_pool(pool, fn, *args, **kwargs):
+    # fn(*args, **kwargs)가 돌려주는 동기 이터러블(Bedrock EventStream 등)을
+    # 풀 스레드에서 소비하면서 이벤트가 도착하는 즉시 비동기로 흘려보냅니다.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()  # 클라이언트가 끊기면 생산 스레드도 멈춤
+    end = object()
+
+    def produce():
+        try:
+            for item in fn(*args, **kwargs):
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (end, e))
+            return
+        loop.call_soon_threadsafe(queue.put_nowait, (end, None))
+
+    producer = asyncio.ensure_future(pool.run(produce))
+    # 풀이 요청을 거절(503)해서 produce가 아예 실행되지 못한 경우도 소비자에게 전달
+    producer.add_done_callback(
+        lambda f: queue.put_nowait((end, f.exception())) if not f.cancelled() and f.exception() else None
+    )
     try:
-        chat_table.put_item(
-            Item={
-                'user_id': user_id,
-                'timestamp': datetime.now().isoformat(),
-                'message_id': str(uuid.uuid4()),
-                'role': role,
-                'content': message
-            }
+        while True:
+            item, error = await queue.get()
+            if item is end:
+                if error:
+                    raise error
+                break
+            yield item
+        await producer
+    finally:
+        stopped.set()
+
+bedrock_pool = IOPool(
+    "bedrock",
+    max_workers=BEDROCK_POOL_DEFAULT,
+    max_queue=int(os.getenv("BEDROCK_POOL_MAX_QUEUE", "256")),
+)
+dynamodb_pool = IOPool(
+    "dynamodb",
+    max_workers=DYNAMODB_POOL_DEFAULT,
+    max_queue=int(os.getenv("DYNAMODB_POOL_MAX_QUEUE", "512")),
+)
+# -----------------------------------------------------------
+
+# --- 모델 호출 게이트웨이 (속도 제한 / 요청 합치기 / 서킷 브레이커) ---
+# 모든 Bedrock 모델 호출은 모델별 게이트웨이를 거칩니다.
+# 1) 분당 요청 수/토큰 수 토큰 버킷: 할당량을 넘기 전에 서버에서 먼저 줄을 세움 (FIFO)
+#    대기가 BEDROCK_QUEUE_MAX_WAIT_MS를 넘길 것 같으면 기다리지 않고 바로 ModelQueueTimeout
+# 2) single-flight: 같은 요청 본문이 이미 처리 중이면 새로 호출하지 않고 그 결과를 함께 받음
+# 3) 서킷 브레이커: 스로틀링/서버 오류/타임아웃이 연속 BEDROCK_BREAKER_THRESHOLD번이면 열림(open)
+#    열린 동안에는 바로 ModelUnavailable -> 엔드포인트는 캐시된 답변이나 안내 문구로 응답(degraded)
+#    BEDROCK_BREAKER_COOLDOWN초 뒤 요청 하나만 시험(half_open)해서 성공하면 닫힘(closed)
+# 속도 제한은 기본으로 꺼져 있습니다. (0이면 제한 없음)
+# 켜려면 계정의 Bedrock 할당량(Service Quotas의 모델별 분당 요청/토큰 수)보다 조금 낮게 설정하세요.
+# RAG, 폴백, 사진 분석이 같은 모델을 쓰면 한 게이트웨이(한도)를 나눠 씁니다.
+# 계정 전체 한도이므로 워커가 여러 개면 워커마다 1/WORKER_COUNT씩 나눠 가집니다.
+BEDROCK_RPM = int(os.getenv("BEDROCK_RPM", "0"))
+BEDROCK_TPM = int(os.getenv("BEDROCK_TPM", "0"))
+BEDROCK_QUEUE_MAX_WAIT = int(os.getenv("BEDROCK_QUEUE_MAX_WAIT_MS", "10000")) / 1000
+BEDROCK_BREAKER_THRESHOLD = int(os.getenv("BEDROCK_BREAKER_THRESHOLD", "5"))
+BEDROCK_BREAKER_COOLDOWN = float(os.getenv("BEDROCK_BREAKER_COOLDOWN", "30"))
+BEDROCK_EXPECTED_OUTPUT_TOKENS = int(os.getenv("BEDROCK_EXPECTED_OUTPUT_TOKENS", "600"))  # 토큰 버킷 예약용 어림값
+BEDROCK_OUTAGE_ERROR_CODES = {
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "InternalServerException", "ModelNotReadyException", "ModelTimeoutException",
+}
+
+class ModelUnavailable(Exception):
+    pass
+
+class ModelQueueTimeout(ModelUnavailable):
+    pass
+
+# 연결/타임아웃 오류만 장애로 봄 (ParamValidationError 같은 클라이언트 쪽 BotoCoreError는 요청 하나의 문제)
+BEDROCK_TRANSPORT_ERRORS = (
+    EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError, ConnectionClosedError, TimeoutError, ConnectionError,
+)
+
+def is_outage_error(error):
+    # 입력 오류(ValidationException 등)는 Bedrock 상태와 무관하므로 브레이커에 세지 않음
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in BEDROCK_OUTAGE_ERROR_CODES
+    return isinstance(error, BEDROCK_TRANSPORT_ERRORS)
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount):
+        if not self.capacity:
+            return 0
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)  # 한도보다 큰 요청은 버킷이 가득 찼을 때 보냄
+        return 0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+class ModelGateway:
+    def __init__(self, name, rpm, tpm, max_wait, threshold, cooldown):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_wait = max_wait
+        self.queue_lock = asyncio.Lock()  # 대기 순서 보장 (asyncio.Lock은 먼저 온 순서대로 깨움)
+        self.pending = {}  # 요청 키 -> 진행 중인 Task
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.transitions = deque(maxlen=20)
+        self.counters = Counter()
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.queued = 0
+
+    def _transition(self, state):
+        logger.info(f"🔌 Bedrock 서킷 브레이커 ({self.name}): {self.state} -> {state}")
+        self.counters[f"{self.state}->{state}"] += 1
+        self.transitions.append({"from": self.state, "to": state, "at": datetime.now().isoformat()})
+        self.state = state
+
+    def _check_breaker(self):
+        # half_open에서 시험 호출 자리를 얻었으면 True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.counters["rejected_open"] += 1
+                raise ModelUnavailable(f"{self.name} 호출이 일시 중단되었습니다. (서킷 브레이커 열림)")
+            self._transition("half_open")
+        if self.state == "half_open":
+            if self.probing:
+                self.counters["rejected_open"] += 1
+                raise ModelUnavailable(f"{self.name} 상태를 확인하는 중입니다.")
+            self.probing = True
+            return True
+        return False
+
+    async def admit(self, tokens, deadline=None):
+        # 브레이커 확인 후 토큰 버킷에 자리가 날 때까지 대기 (스트리밍 호출은 이것만 사용)
+        # 시험 호출 자리를 얻었는지 돌려주므로, 호출 결과를 record()하지 않고 끝낼 때는 release_probe()로 반납
+        probe = self._check_breaker()
+        started = time.monotonic()
+        deadline = deadline or started + self.max_wait
+        self.queued += 1
+        try:
+            async with self.queue_lock:
+                while True:
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait <= 0:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        self.counters["queue_timeouts"] += 1
+                        raise ModelQueueTimeout(f"{self.name} 요청이 밀려 있습니다. 잠시 후 다시 시도해주세요.")
+                    await asyncio.sleep(wait)
+                self.requests.take(1)
+                self.tokens.take(tokens)
+        except BaseException:
+            # 대기 시간 초과나 취소(클라이언트 끊김)로 호출하지 못하면 시험 자리를 반납해야 다음 요청이 시험할 수 있음
+            self.release_probe(probe)
+            raise
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - started
+        self.counters["admitted"] += 1
+        self.counters["waited"] += 1 if waited > 0.001 else 0
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+        return probe
+
+    def release_probe(self, probe):
+        if probe:
+            self.probing = False
+
+    def record(self, error=None):
+        self.probing = False
+        if error is not None and is_outage_error(error):
+            self.counters["outage_errors"] += 1
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self._transition("open")
+        else:
+            self.failures = 0
+            if self.state != "closed":
+                self._transition("closed")
+
+    async def call(self, fn, *args, tokens=0, key=None, **kwargs):
+        # fn은 bedrock_pool에서 실행되는 동기 함수이며, 결과를 여러 요청이 나눠 받으므로
+        # StreamingBody 같은 한 번만 읽을 수 있는 값 대신 다 읽은 값을 돌려줘야 함
+        if key is not None and key in self.pending:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(self.pending[key])
+
+        task = asyncio.ensure_future(self._call(fn, args, kwargs, tokens))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # 기다리던 요청이 모두 끊겨도 경고 없음
+        if key is not None:
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _call(self, fn, args, kwargs, tokens):
+        probe = await self.admit(tokens)
+        try:
+            result = await bedrock_pool.run(fn, *args, **kwargs)
+        except HTTPException:
+            # 풀 대기열이 가득 차 Bedrock을 부르지도 못한 경우(503)는 브레이커 판단에 넣지 않음
+            self.release_probe(probe)
+            raise
+        except Exception as e:
+            self.record(e)
+            if is_outage_error(e):
+                # 재시도까지 실패한 스로틀링/장애는 엔드포인트에서 대체 답변으로 처리
+                raise ModelUnavailable(f"{self.name} 호출 실패: {e}") from e
+            raise
+        except BaseException:
+            self.release_probe(probe)
+            raise
+        self.record()
+        return result
+
+    def stats(self):
+        admitted = self.counters["admitted"]
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "queued": self.queued,
+            "in_flight_keys": len(self.pending),
+            "admitted": admitted,
+            "waited": self.counters["waited"],
+            "avg_queue_wait_ms": round(self.queue_wait_total / admitted * 1000, 1) if admitted else None,
+            "max_queue_wait_ms": round(self.queue_wait_max * 1000, 1),
+            "queue_timeouts": self.counters["queue_timeouts"],
+            "coalesced": self.counters["coalesced"],
+            "rejected_open": self.counters["rejected_open"],
+            "outage_errors": self.counters["outage_errors"],
+            "transitions": {k: v for k, v in self.counters.items() if "->" in k},
+            "recent_transitions": list(self.transitions),
+        }
+
+model_gateways = {}
+
+def get_model_gateway(model_id):
+    # 할당량은 모델별이므로 게이트웨이도 모델별 (ARN이면 모델 ID 부분만 사용)
+    name = model_id.split("/")[-1]
+    if name not in model_gateways:
+        model_gateways[name] = ModelGateway(
+            name, BEDROCK_RPM / WORKER_COUNT, BEDROCK_TPM / WORKER_COUNT, BEDROCK_QUEUE_MAX_WAIT, BEDROCK_BREAKER_THRESHOLD, BEDROCK_BREAKER_COOLDOWN
         )
+    return model_gateways[name]
+
+def request_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def invoke_model_json(model_id, body):
+    response = bedrock_runtime.invoke_model(modelId=model_id, body=body)
+    response_body = json.loads(response["body"].read())
+    record_token_usage(model_id, response_body.get("usage", {}))
+    return response_body
+
+async def invoke_model_via_gateway(model_id, body, tokens):
+    return await get_model_gateway(model_id).call(
+        invoke_model_json, model_id, body, tokens=tokens, key=request_key(model_id, body)
+    )
+
+async def stream_via_gateway(model_id, tokens, fn, *args):
+    # 스트리밍은 결과를 나눠 가질 수 없으므로 합치기 없이 속도 제한과 브레이커만 적용
+    gateway = get_model_gateway(model_id)
+    probe = await gateway.admit(tokens)
+    name = f"bedrock.{fn.__name__}"
+    started = time.perf_counter()
+    first = True
+    try:
+        with stage(name):
+            async for item in stream_in_pool(bedrock_pool, fn, *args):
+                if first:
+                    stage_seconds.observe((f"{name}.first_item", "ok"), time.perf_counter() - started)
+                    first = False
+                yield item
+    except HTTPException:
+        gateway.release_probe(probe)  # 풀 거절(503)은 브레이커에 세지 않음
+        raise
     except Exception as e:
-        print(f"⚠️ 채팅 로그 저장 실패: {e}")
+        gateway.record(e)
+        if is_outage_error(e):
+            raise ModelUnavailable(f"{gateway.name} 호출 실패: {e}") from e
+        raise
+    except BaseException:
+        # 클라이언트가 끊겨 스트림이 닫힘(CancelledError/GeneratorExit) - 성공도 실패도 아니므로 시험 자리만 반납
+        gateway.release_probe(probe)
+        raise
+    else:
+        gateway.record()
+
+def get_model_gateway_stats():
+    return {name: gateway.stats() for name, gateway in model_gateways.items()}
+# -----------------------------------------------------------
+
+# --- 캐시 백엔드 (메모리 / 디스크 / Redis) ---
+# 값은 JSON으로 직렬화 가능한 dict만 저장합니다. (백엔드를 바꿔도 동작이 같도록)
+# DynamoDB 항목의 Decimal은 int/float로 바꿔 저장합니다.
+# 캐시별 <이름>_CACHE_BACKEND를 주지 않으면 CACHE_BACKEND를 따릅니다.
+# memory 캐시는 워커 프로세스마다 따로라서, 여러 워커가 캐시를 나눠 쓰려면
+#   disk: 같은 호스트의 워커끼리 SQLite 파일 공유 (CACHE_DIR=/dev/shm/caremeal 이면 디스크 대신 공유 메모리에 둠)
+#   redis: 여러 호스트까지 공유 (CACHE_REDIS_URL)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory | disk | redis
+CACHE_DIR = os.getenv("CACHE_DIR", "")
+
+def cache_path(file_name):
+    return os.path.join(CACHE_DIR, file_name)
+
+def cache_dumps(value):
+    def default(obj):
+        if isinstance(obj, Decimal):
+            return int(obj) if obj == obj.to_integral_value() else float(obj)
+        raise TypeError(f"{type(obj).__name__} 값은 캐시에 저장할 수 없습니다.")
+    return json.dumps(value, ensure_ascii=False, default=default)
+
+class MemoryCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (만료 시각, 값), 오래 안 쓴 순서
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.time() + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def scan(self, prefix):
+        now = time.time()
+        with self.lock:
+            return [(key, value) for key, (expires_at, value) in self.entries.items()
+                    if key.startswith(prefix) and expires_at >= now]
+
+    def __len__(self):
+        return len(self.entries)
+
+class DiskCache:
+    def __init__(self, path, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.evictions = 0
+        # 여러 워커가 같은 파일을 쓰므로 WAL(읽기와 쓰기가 서로 막지 않음) + 잠금 대기 시간
+        self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, last_access REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self.db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, cache_dumps(value), now + (ttl or self.ttl), now)
+            )
+            overflow = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.db.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+            self.db.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.db.commit()
+
+    def scan(self, prefix):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT key, value FROM cache WHERE substr(key, 1, ?) = ? AND expires_at >= ?",
+                (len(prefix), prefix, time.time())
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+class RedisCache:
+    # 크기 제한/퇴출은 Redis 서버의 maxmemory 정책에 맡김
+    def __init__(self, url, namespace, ttl):
+        if redis is None:
+            raise RuntimeError("Redis 캐시를 쓰려면 redis 패키지가 필요합니다. (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl
+        self.evictions = 0
+
+    def get(self, key):
+        raw = self.client.get(self.namespace + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.namespace + key, cache_dumps(value), ex=int(ttl or self.ttl))
+
+    def delete(self, key):
+        self.client.delete(self.namespace + key)
+
+    def scan(self, prefix):
+        keys = list(self.client.scan_iter(match=self.namespace + prefix.replace("*", "\\*") + "*"))
+        values = self.client.mget(keys) if keys else []
+        return [(key.decode()[len(self.namespace):], json.loads(value))
+                for key, value in zip(keys, values) if value is not None]
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.namespace + "*"))
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+def create_cache(backend, path, max_entries, ttl, namespace=""):
+    if backend == "disk":
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return DiskCache(path, max_entries, ttl)
+    if backend == "redis":
+        return RedisCache(CACHE_REDIS_URL, f"caremeal:{namespace}:", ttl)
+    return MemoryCache(max_entries, ttl)
+# -----------------------------------------------------------
+
+# 4. 헬퍼 함수: 채팅 로그 저장
+# 요청 경로에서는 큐에 넣기만 하고, 백그라운드 작성기가 최대 25개씩 batch_write_item으로 저장합니다.
+# 처리되지 않은 항목은 백오프 후 재시도하고, 끝내 실패하면 로컬 파일(JSONL)에 남겼다가 다음 기동 때 다시 넣습니다.
+# DynamoDB 장애로 큐가 CHAT_LOG_QUEUE_MAX개까지 차면 새 항목은 메모리에 쌓지 않고 바로 파일에 남깁니다.
+CHAT_LOG_BATCH_SIZE = 25  # batch_write_item 한 번의 최대 개수
+CHAT_LOG_LINGER = int(os.getenv("CHAT_LOG_LINGER_MS", "50")) / 1000  # 배치를 채우려고 기다리는 시간
+CHAT_LOG_MAX_RETRIES = int(os.getenv("CHAT_LOG_MAX_RETRIES", "5"))
+CHAT_LOG_RETRY_BASE = int(os.getenv("CHAT_LOG_RETRY_BASE_MS", "100")) / 1000
+CHAT_LOG_SPILL_PATH = os.getenv("CHAT_LOG_SPILL_PATH", "chat_log_spill.jsonl")
+CHAT_LOG_SHUTDOWN_TIMEOUT = float(os.getenv("CHAT_LOG_SHUTDOWN_TIMEOUT", "10"))
+CHAT_LOG_QUEUE_MAX = int(os.getenv("CHAT_LOG_QUEUE_MAX", "10000"))
+
+class ChatLogWriter:
+    def __init__(self):
+        self.queue = None
+        self.task = None
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "retries": 0, "spilled": 0, "replayed": 0, "dropped": 0}
+
+    def start(self):
+        if self.task is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=CHAT_LOG_QUEUE_MAX)
+        self.task = asyncio.create_task(self._run())
+        self._replay_spill()
+
+    def enqueue(self, item):
+        # lifespan 없이 앱을 띄운 경우(테스트 등)에도 첫 로그에서 작성기를 시작
+        self.start()
+        self.stats["enqueued"] += 1
+        if not self.queue.full():
+            self.queue.put_nowait(item)
+            return
+        try:
+            self._spill([item])
+        except Exception as e:
+            self.stats["dropped"] += 1
+            logger.error(f"🚨 채팅 로그를 저장하지 못하고 버렸습니다: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                batch.append(await self.queue.get())
+                deadline = loop.time() + CHAT_LOG_LINGER
+                while len(batch) < CHAT_LOG_BATCH_SIZE:
+                    if not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                        continue
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                await self._write(batch)
+            except asyncio.CancelledError:
+                # 종료 대기 시간이 지나 취소됨 - 모으거나 쓰던 배치는 이미 큐에서 꺼냈으므로 파일로 남김
+                # (일부가 이미 저장됐어도 같은 키로 다시 PutItem하므로 중복되지 않음)
+                self._spill(batch)
+                raise
+            except Exception as e:
+                # 파일 보관까지 실패해도 작성기는 계속 돌아야 다음 배치를 저장할 수 있음
+                self.stats["dropped"] += len(batch)
+                logger.error(f"🚨 채팅 로그 {len(batch)}건을 저장하지 못하고 버렸습니다: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write(self, items):
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        for attempt in range(CHAT_LOG_MAX_RETRIES):
+            try:
+                with stage("dynamodb.batch_write_item"):
+                    response = await dynamodb_pool.run(
+                        dynamodb.batch_write_item,
+                        RequestItems={chat_table.name: requests}
+                    )
+                self.stats["batches"] += 1
+                unprocessed = response.get('UnprocessedItems', {}).get(chat_table.name, [])
+                self.stats["written"] += len(requests) - len(unprocessed)
+                requests = unprocessed
+                if not requests:
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ 채팅 로그 배치 저장 실패 ({attempt + 1}/{CHAT_LOG_MAX_RETRIES}): {e}")
+            if attempt == CHAT_LOG_MAX_RETRIES - 1:
+                break  # 마지막 시도 뒤에는 기다리지 않고 바로 디스크에 보관
+            self.stats["retries"] += 1
+            await asyncio.sleep(CHAT_LOG_RETRY_BASE * (2 ** attempt) * (0.5 + random.random()))
+        self._spill([request['PutRequest']['Item'] for request in requests])
+
+    def _spill(self, items):
+        if not items:
+            return
+        with open(CHAT_LOG_SPILL_PATH, "a", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self.stats["spilled"] += len(items)
+        logger.error(f"🚨 채팅 로그 {len(items)}건을 {CHAT_LOG_SPILL_PATH}에 임시 보관했습니다.")
+
+    def _replay_spill(self):
+        # 여러 워커가 동시에 기동하면 먼저 파일을 옮긴 워커 하나만 다시 저장
+        replay_path = f"{CHAT_LOG_SPILL_PATH}.replay.{os.getpid()}"
+        try:
+            os.replace(CHAT_LOG_SPILL_PATH, replay_path)
+        except FileNotFoundError:
+            return
+        overflow = []
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if self.queue.full():
+                    overflow.append(json.loads(line))  # 큐에 다 못 넣은 나머지는 다시 파일로
+                else:
+                    self.queue.put_nowait(json.loads(line))
+                    self.stats["replayed"] += 1
+        self._spill(overflow)
+        os.remove(replay_path)
+        logger.info(f"♻️ 임시 보관된 채팅 로그 {self.stats['replayed']}건을 다시 저장합니다.")
+
+    async def close(self):
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), CHAT_LOG_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ 종료 전 채팅 로그를 모두 저장하지 못했습니다.")
+        self.task.cancel()
+        try:
+            await self.task  # 쓰던 배치를 파일에 남길 때까지 기다림
+        except asyncio.CancelledError:
+            pass
+        # 아직 못 쓴 항목은 파일로 남겨 다음 기동 때 재시도
+        leftover = []
+        while not self.queue.empty():
+            leftover.append(self.queue.get_nowait())
+        if leftover:
+            self._spill(leftover)
+        self.task = None
+
+    def get_stats(self):
+        return {**self.stats, "queue_depth": self.queue.qsize() if self.queue else 0}
+
+chat_log_writer = ChatLogWriter()
+
+async def save_to_dynamodb(user_id, role, message, prompt_version=None):
+    item = {
+        'user_id': user_id,
+        'timestamp': datetime.now().isoformat(),
+        'message_id': str(uuid.uuid4()),
+        'role': role,
+        'content': message
+    }
+    if prompt_version:
+        item['prompt_version'] = prompt_version  # 프롬프트 A/B 비교용
+    with stage("dynamodb.save_chat_log"):  # 큐에 넣는 시간 (실제 저장은 dynamodb.batch_write_item)
+        chat_log_writer.enqueue(item)
+        if recent_turns_cache is not None:
+            recent_turns_cache.append(item)
 
 # 5. 헬퍼 함수: 유저 정보(Row) 조회
-def get_user_profile(user_id):
+# 채팅 한 번마다 프로필을 다시 읽지 않도록 TTL 캐시를 둡니다.
+# 없는 아이디(비회원 등)도 짧은 TTL로 캐시하고, 회원가입 시 캐시에 바로 기록(write-through)합니다.
+PROFILE_CACHE_BACKEND = os.getenv("PROFILE_CACHE_BACKEND", CACHE_BACKEND)  # memory | disk | redis | off
+PROFILE_CACHE_NEGATIVE_TTL = int(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", "60"))
+PROFILE_READ_RCU = 0.5  # 4KB 이하 항목의 eventually consistent GetItem 1회 비용
+
+profile_cache = None
+if PROFILE_CACHE_BACKEND != "off":
+    profile_cache = create_cache(
+        PROFILE_CACHE_BACKEND,
+        path=os.getenv("PROFILE_CACHE_PATH", cache_path("profile_cache.sqlite3")),
+        max_entries=int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000")),
+        ttl=int(os.getenv("PROFILE_CACHE_TTL", "300")),
+        namespace="profile",
+    )
+profile_cache_stats = {"hits": 0, "negative_hits": 0, "misses": 0}
+profile_cache_hit_times = deque()  # 최근 1분 적중 시각 (RCU 절감량 계산용)
+
+# 캐시가 디스크/Redis에 있을 수 있으므로 비밀번호는 캐시에 넣지 않음 (로그인은 DynamoDB에서 직접 확인)
+PROFILE_CACHE_EXCLUDED_FIELDS = ("password",)
+
+async def fetch_user_profile(user_id):
+    # DynamoDB 오류는 그대로 올려보냄
+    if profile_cache is not None:
+        cached = profile_cache.get(user_id)
+        if cached is not None:
+            profile_cache_hit_times.append(time.time())
+            if cached.get("__missing__"):
+                profile_cache_stats["negative_hits"] += 1
+                return None
+            profile_cache_stats["hits"] += 1
+            return cached
+        profile_cache_stats["misses"] += 1
+
+    response = await dynamodb_pool.run(user_table.get_item, Key={'user_id': user_id})
+    item = response.get('Item')
+    if profile_cache is not None:
+        if item:
+            cache_user_profile(item)
+        else:
+            profile_cache.set(user_id, {"__missing__": True}, ttl=PROFILE_CACHE_NEGATIVE_TTL)
+    return item
+
+def cache_user_profile(item):
+    if profile_cache is not None:
+        profile_cache.set(item['user_id'], {k: v for k, v in item.items() if k not in PROFILE_CACHE_EXCLUDED_FIELDS})
+
+async def fetch_user_credentials(user_id):
+    # 로그인용: 비밀번호가 든 항목을 캐시 없이 읽고, 읽은 김에 프로필 캐시(비밀번호 제외)를 갱신
+    # 캐시를 거치지 않으므로 다른 워커에서 방금 가입한 아이디도 바로 로그인됨
+    response = await dynamodb_pool.run(user_table.get_item, Key={'user_id': user_id})
+    item = response.get('Item')
+    if item:
+        cache_user_profile(item)
+    return item
+
+async def get_user_profile(user_id):
+    with stage("dynamodb.get_user_profile"):
+        return await lookup_user_profile(user_id)
+
+async def lookup_user_profile(user_id):
     try:
-        response = user_table.get_item(Key={'user_id': user_id})
-        if 'Item' in response:
-            return response['Item']
+        return await fetch_user_profile(user_id)
     except Exception as e:
-        print(f"⚠️ 유저 정보 조회 실패: {e}")
+        logger.warning(f"⚠️ 유저 정보 조회 실패: {e}")
     return None
 
-# 6. 헬퍼 함수: 나이별 페르소나 선택
-# 6. 헬퍼 함수: 나이 및 질환별 페르소나 선택
-def get_persona_by_age(age, diabetes_type="일반"):
-    disease_context = f"환자는 현재 '{diabetes_type}' 진단을 받은 상태입니다. 이에 맞춰 혈당 관리와 합병증 예방에 중점을 둔 조언을 해야 합니다."
-    
-    base_persona = ""
+def get_profile_cache_stats():
+    if profile_cache is None:
+        return {"backend": "off"}
+    while profile_cache_hit_times and profile_cache_hit_times[0] < time.time() - 60:
+        profile_cache_hit_times.popleft()
+    hits = profile_cache_stats["hits"] + profile_cache_stats["negative_hits"]
+    lookups = hits + profile_cache_stats["misses"]
+    return {
+        "backend": PROFILE_CACHE_BACKEND,
+        **profile_cache_stats,
+        "hit_ratio": round(hits / lookups, 3) if lookups else None,
+        "rcu_saved_per_minute": len(profile_cache_hit_times) * PROFILE_READ_RCU,
+        "size": len(profile_cache),
+    }
+
+# 6. 헬퍼 함수: 프롬프트 템플릿 (Prompt Registry)
+# prompts/ 폴더의 <이름>.v<버전>.txt 파일을 기동 시 한 번만 읽고, 이름별로 가장 높은 버전을 사용합니다.
+# PROMPT_VERSIONS="persona_adult=v1,chat_rag=v2" 처럼 버전을 고정해 A/B 비교할 수 있고,
+# 답변마다 사용한 템플릿 버전(prompt_version)을 채팅 로그에 함께 남깁니다.
+# 템플릿의 {{이름}}만 치환하고 Bedrock 지식베이스 자리표시자($search_results$ 등)는 그대로 둡니다.
+PROMPT_DIR = os.getenv("PROMPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts"))
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "0") == "1"  # 모델이 Bedrock 프롬프트 캐싱을 지원할 때만 켜기
+
+class PromptRegistry:
+    def __init__(self, directory, pinned):
+        candidates = defaultdict(dict)  # 이름 -> {버전: 내용}
+        for file_name in os.listdir(directory):
+            match = re.fullmatch(r"(.+)\.(v\d+)\.txt", file_name)
+            if match:
+                with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+                    candidates[match.group(1)][match.group(2)] = f.read().strip()
+
+        self.templates = {}  # 이름 -> (버전, 내용)
+        for name, versions in candidates.items():
+            version = pinned.get(name) or max(versions, key=lambda v: int(v[1:]))
+            if version not in versions:
+                raise RuntimeError(f"프롬프트 템플릿 {name}.{version}.txt 파일이 없습니다.")
+            self.templates[name] = (version, versions[version])
+
+    def render(self, name, **values):
+        return re.sub(r"\{\{(\w+)\}\}", lambda m: str(values[m.group(1)]), self.templates[name][1])
+
+    def tag(self, *names):
+        return ",".join(f"{name}@{self.templates[name][0]}" for name in names)
+
+prompt_registry = PromptRegistry(
+    PROMPT_DIR,
+    pinned=dict(item.split("=", 1) for item in os.getenv("PROMPT_VERSIONS", "").split(",") if item)
+)
+
+PERSONA_BY_BRACKET = {
+    "10-29": "persona_youth",
+    "30-49": "persona_adult",
+    "50-69": "persona_midlife",
+    "기타": "persona_senior",
+}
+
+def get_age_bracket(age):
     if 10 <= age <= 29:
-        base_persona = """
-        [비조: 활기차고 동기부여를 주는 30년 경력의 건강 트레이너]
-        너는 사용자의 첫 문장에서 말투를 파악해 비슷하게 맞추는 미러링 기법을 사용해.
-        젊은 층임을 고려해 너무 딱딱한 의학 용어보다는 실천 가능한 꿀팁 위주로 설명해줘.
-        단, 의학적 사실에 기반해야 하며, 인스턴트나 배달 음식 섭취를 줄이는 방향으로 유도해.
-        상태나 주의사항을 강조할 때는 색깔(Markdown Bold 등)을 사용해줘.
-        아이콘(이모지)을 적절히 사용
-
-        ★중요: 사용자가 레시피, 식단, 조리법 등을 요구하면:
-        1. 간단하게 필요한 재료와 핵심 조리법만 채팅으로 나열해줘.
-        2. 답변의 맨 마지막 줄에 반드시 "[[CUSTOM_DIET_LINK]]" 라는 텍스트를 있는 그대로 추가해줘.
-           (이 텍스트는 화면에서 '맞춤 식단 보러가기' 버튼으로 자동 변환됩니다.)
-        """
+        return "10-29"
     elif 30 <= age <= 49:
-        base_persona = """
-        [어조: 전문적이고 신뢰감 있는 30년 경력의 전문의 '김닥터']
-        사회생활로 바쁜 3040세대임을 고려해, 현실적인 식단 조절법과 스트레스 관리법을 포함해줘.
-        단호하지만 따뜻한 어조로, 만성질환 예방과 관리를 위한 구체적인 수치를 제시하며 설명해.
-        상태나 주의사항을 강조할 때는 색깔(Markdown Bold 등)을 사용해줘.
-        아이콘(이모지)을 적절히 사용
-
-        ★중요: 사용자가 레시피, 식단, 조리법 등을 요구하면:
-        1. 간단하게 필요한 재료와 핵심 조리법만 채팅으로 나열해줘.
-        2. 답변의 맨 마지막 줄에 반드시 "[[CUSTOM_DIET_LINK]]" 라는 텍스트를 있는 그대로 추가해줘.
-           (이 텍스트는 화면에서 '맞춤 식단 보러가기' 버튼으로 자동 변환됩니다.)
-        """
+        return "30-49"
     elif 50 <= age <= 69:
-        base_persona = """
-        [어조: 꼼꼼하고 다정다감한 30년 경력의 임상 영양사]
-        갱년기 및 노화가 시작되는 시기임을 고려해, 영양 균형과 소화가 잘 되는 식단을 추천해줘.
-        이미 만성질환이 있다면, 약물 복용 시 주의할 점이나 식사 순서(채소->단백질->탄수화물) 등을 
-        구체적으로 가이드해줘.
-        상태나 주의사항을 강조할 때는 색깔(Markdown Bold 등)을 사용해줘.
-        아이콘(이모지)을 적절히 사용
-        
-        ★중요: 사용자가 레시피, 식단, 조리법 등을 요구하면:
-        1. 간단하게 필요한 재료와 핵심 조리법만 채팅으로 나열해줘.
-        2. 답변의 맨 마지막 줄에 반드시 "[[CUSTOM_DIET_LINK]]" 라는 텍스트를 있는 그대로 추가해줘.
-           (이 텍스트는 화면에서 '맞춤 식단 보러가기' 버튼으로 자동 변환됩니다.)
-        """
+        return "50-69"
+    return "기타"
+
+# (연령대, 진단명) 조합별로 한 번만 렌더링 - 비회원은 bracket=None
+@functools.lru_cache(maxsize=256)
+def render_persona(bracket, diabetes_type=None):
+    if bracket is None:
+        return prompt_registry.render("persona_default")
+    base_persona = prompt_registry.render(PERSONA_BY_BRACKET[bracket])
+    return f"{base_persona}\n\n{prompt_registry.render('disease_context', diabetes_type=diabetes_type)}"
+
+# 6. 헬퍼 함수: 나이 및 질환별 페르소나 선택
+def get_persona_by_age(age, diabetes_type="일반"):
+    return render_persona(get_age_bracket(age), diabetes_type)
+
+def persona_template_names(profile):
+    if not profile:
+        return ("persona_default",)
+    return (PERSONA_BY_BRACKET[get_age_bracket(int(profile['age']))], "disease_context")
+
+@functools.lru_cache(maxsize=64)
+def prompt_version_tag(*names):
+    return prompt_registry.tag(*names)
+
+def system_blocks(text):
+    # 고정 지시문은 system에 두고, 프롬프트 캐싱을 켜면 캐시 지점으로 표시
+    block = {"type": "text", "text": text}
+    if PROMPT_CACHING:
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+# 7. 헬퍼 함수: 채팅 프롬프트 구성
+# 연령대/진단명으로 정해지는 고정 페르소나와 사용자별 정보(이름, 이전 대화)를 나눠 두고
+# RAG는 검색 질의(input)에 질문만 넣고 페르소나는 생성 프롬프트 템플릿으로,
+# 폴백은 페르소나를 system으로 보내 질문이 바뀌어도 같은 앞부분을 재사용하게 합니다.
+FALLBACK_MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+FALLBACK_SOURCE = "AI 일반 상식 (검색 결과 없음)"
+
+def build_user_info(profile):
+    if not profile:
+        return "정보 없음 (비회원)"
+    return f"이름: {profile['name']}, 나이: {int(profile['age'])}세, 진단명: {profile.get('diabetes_type', '일반')}"
+
+def build_chat_prompt(profile, context=""):
+    user_info = build_user_info(profile)
+    if profile:
+        persona = get_persona_by_age(int(profile['age']), profile.get('diabetes_type', '일반'))
+        logger.info(f"🕵️‍♂️ 유저 정보 확인됨: {user_info} (페르소나 적용)")
     else:
-        base_persona = """
-        [어조: 짧고 간결하게 설명하는 친절하고 인내심 많은 베테랑 간호사]
-        어르신임을 고려해 아주 쉽고 천천히 설명하듯 말해줘.
-        복잡한 설명보다는 '이건 드셔도 좋아요', '이건 조금만 드세요' 처럼 명확한 지침을 줘.
-        중요한 수치나 주의사항은 1. 2. 3. 번호를 매겨서 보기 편하게 정리해드려.
-        상태나 주의사항을 강조할 때는 색깔(Markdown Bold 등)을 사용해줘.
-        아이콘(이모지)을 적절히 사용하여 친근감을 줘.
-        
-        답변이 너무 길면 읽기 힘드니 한눈에 보기 편하게 요약해줘.
-        
-        ★중요: 사용자가 레시피, 식단, 조리법 등을 요구하면:
-        1. 간단하게 필요한 재료와 핵심 조리법만 채팅으로 나열해줘.
-        2. 답변의 맨 마지막 줄에 반드시 "[[CUSTOM_DIET_LINK]]" 라는 텍스트를 있는 그대로 추가해줘.
-           (이 텍스트는 화면에서 '맞춤 식단 보러가기' 버튼으로 자동 변환됩니다.)
-        """
-    
-    return f"{base_persona}\n\n[환자 질환 정보]\n{disease_context}"
+        persona = render_persona(None) # 기본값
 
-# 5. API 엔드포인트: 채팅 (Chat)
-# main.py 의 chat_endpoint 부분을 이걸로 교체하세요
+    return {
+        "persona": persona,
+        "user_info": user_info,
+        # 이전 대화가 있으면 질문 앞에 붙여 후속 질문도 맥락을 이어가도록 함
+        "context": f"\n{context}\n" if context else "",
+        "version": prompt_version_tag(
+            "chat_rag", "chat_fallback_system", "chat_fallback_user", *persona_template_names(profile)
+        ),
+    }
 
-@app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    print(f"📩 채팅 요청: {request.user_message} ({request.user_id})")
-    
-    try:
-        # 1. 사용자 질문 DB 저장 (로그)
-        save_to_dynamodb(request.user_id, 'user', request.user_message)
+# Bedrock은 textPromptTemplate을 4000자까지만 받으므로(넘으면 ValidationException) 대화 맥락을 잘라 맞춤
+# estimate_tokens로 맞춘 토큰 예산은 영문이 많으면 글자 수를 넘길 수 있어서 글자 수로 한 번 더 제한합니다.
+RAG_PROMPT_TEMPLATE_MAX_CHARS = int(os.getenv("RAG_PROMPT_TEMPLATE_MAX_CHARS", "4000"))
+TURN_START = re.compile(r"\n(?:환자|AI): ")
 
-        # ---------------------------------------------------------
-        # ★ [NEW] 2. DynamoDB에서 유저 정보(프로필) 가져오기 & 페르소나 선정
-        # ---------------------------------------------------------
-        profile = get_user_profile(request.user_id)
-        
-        user_info_str = "정보 없음 (비회원)"
-        persona_style = "너는 30년 경력의 당뇨 전문의 '김닥터'야. 환자에게 따뜻하게 대하고 의학적 사실에 기반해 답변해줘." # 기본값
-
-        if profile:
-            age = int(profile['age'])
-            diabetes_type = profile.get('diabetes_type', '일반')
-            user_info_str = f"이름: {profile['name']}, 나이: {age}세, 진단명: {diabetes_type}"
-            persona_style = get_persona_by_age(age, diabetes_type)
-            print(f"🕵️‍♂️ 유저 정보 확인됨: {user_info_str} (페르소나 적용)")
-
-        # ---------------------------------------------------------
-        # ★ [NEW] 3. 페르소나에 유저 정보 섞기 (Context Injection)
-        # ---------------------------------------------------------
-        persona = f"""
-        [페르소나 지침]
-        {persona_style}
-        
-        [현재 대화 중인 환자 정보]
-        {user_info_str}
-        
-        [지시사항]
-        위 페르소나와 환자 정보를 바탕으로 맞춤형 조언을 해주세요.
-        
-        환자 질문: {request.user_message}
-        """
-        
-        # 4. AI 답변 생성 (RAG)
-        response = bedrock_agent.retrieve_and_generate(
-            input={'text': persona},
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': KB_ID,
-                    'modelArn': MODEL_ARN
+def render_rag_template(prompt):
+    render = lambda context: prompt_registry.render(
+        "chat_rag", persona=prompt["persona"], user_info=prompt["user_info"], context=context
+    )
+    template = render(prompt["context"])
+    overflow = len(template) - RAG_PROMPT_TEMPLATE_MAX_CHARS
+    if overflow <= 0:
+        return template
+
+    # 오래된 내용(요약 -> 오래된 턴)이 앞에 있으므로 앞에서부터 잘라내고 턴 경계에 맞춤
+    header = "[최근 대화]\n"
+    body = prompt["context"].strip("\n")
+    keep = len(body) - overflow - len(header)
+    match = TURN_START.search(body, len(body) - keep) if keep > 0 else None
+    logger.info(f"✂️ 프롬프트 템플릿 길이 초과로 대화 맥락을 줄임 ({len(template)}자)")
+    return render(f"\n{header}{body[match.start() + 1:]}\n" if match else "")
+
+def rag_configuration(prompt):
+    return {
+        'type': 'KNOWLEDGE_BASE',
+        'knowledgeBaseConfiguration': {
+            'knowledgeBaseId': KB_ID,
+            'modelArn': MODEL_ARN,
+            'generationConfiguration': {
+                'promptTemplate': {
+                    'textPromptTemplate': render_rag_template(prompt)
                 }
             }
-        )
-        answer = response['output']['text']
-        
-        # 5. AI 답변 DB 저장
-        save_to_dynamodb(request.user_id, 'ai', answer)
-        
-        # 6. 출처 추출 (파일 이름만)
-        citations = []
-        if 'citations' in response and response['citations']:
-             for ref in response['citations'][0]['retrievedReferences']:
-                 # S3 URI에서 파일명만 추출 (예: s3://bucket/path/to/diet.pdf -> diet.pdf)
-                 if 'location' in ref and 's3Location' in ref['location']:
-                     uri = ref['location']['s3Location']['uri']
-                     file_name = uri.split('/')[-1] # URL의 마지막 부분이 파일명
-                     citations.append(file_name)
-                 else:
-                     # S3가 아닌 경우 (데이터 소스 타입에 따라 다를 수 있음)
-                     citations.append("관련 문서")
-
-        # ---------------------------------------------------------
-        # ★ [NEW] 7. RAG 검색 결과가 없을(Citations 공란) 경우 기본 모델로 폴백
-        # ---------------------------------------------------------
-        if not citations:
-            print("⚠️ RAG 검색 결과 없음 (Citations Empty). 기본 모델(Claude 3.5 Sonnet)로 전환합니다.")
-            
-            fallback_prompt = f"""
-            {persona}
-            
-            [상황 설명]
-            RAG(지식 검색) 시스템이 관련 문서를 찾지 못했습니다. (검색된 자료 없음)
-            따라서 당신의 일반적인 의학 지식과 상식을 활용해 답변해야 합니다.
-            
-            [지시사항]
-            1. 사용자 질문에 친절하고 전문적으로 답변하세요.
-            2. 답변의 시작 부분에 다음 문구를 반드시 포함하세요:
-               "📢 **내부 데이터베이스에서 관련 자료를 찾지 못해, AI 모델의 일반 지식으로 답변드립니다.**"
-            3. 답변은 설정된 페르소나의 말투를 유지하세요.
-            
-            사용자 질문: {request.user_message}
-            """
-            
-            # Base Model 호출 (Claude 3.5 Sonnet)
-            model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-            payload = {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 1500,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": fallback_prompt
-                    }
-                ]
+        }
+    }
+
+def extract_citation_sources(references):
+    # S3 URI에서 파일명만 추출 (예: s3://bucket/path/to/diet.pdf -> diet.pdf)
+    sources = []
+    for ref in references:
+        if 'location' in ref and 's3Location' in ref['location']:
+            uri = ref['location']['s3Location']['uri']
+            sources.append(uri.split('/')[-1]) # URL의 마지막 부분이 파일명
+        elif 'location' in ref and 'customDocumentLocation' in ref['location']:
+            sources.append(ref['location']['customDocumentLocation']['id']) # 로컬 지식베이스 (파일명)
+        else:
+            # S3가 아닌 경우 (데이터 소스 타입에 따라 다를 수 있음)
+            sources.append("관련 문서")
+    return sources
+
+def build_fallback_payload(prompt, user_message):
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1500,
+        "system": system_blocks(prompt_registry.render("chat_fallback_system", persona=prompt["persona"])),
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt_registry.render(
+                    "chat_fallback_user",
+                    user_info=prompt["user_info"],
+                    context=prompt["context"],
+                    question=user_message
+                )
             }
-            
+        ]
+    }
+
+def chat_prompt_tokens(prompt, user_message):
+    text = prompt["persona"] + prompt["user_info"] + prompt["context"] + user_message
+    return estimate_tokens(text) + BEDROCK_EXPECTED_OUTPUT_TOKENS
+
+async def invoke_fallback(prompt, user_message):
+    with stage("bedrock.fallback_invoke_model"):
+        fb_response_body = await invoke_model_via_gateway(
+            FALLBACK_MODEL_ID,
+            json.dumps(build_fallback_payload(prompt, user_message)),
+            tokens=chat_prompt_tokens(prompt, user_message)
+        )
+    return fb_response_body["content"][0]["text"]
+
+# 19. 헬퍼 함수: 검색 백엔드 선택 (RAG_BACKEND)
+# bedrock : 지식베이스(KB_ID)의 retrieve_and_generate 사용
+# local   : ingest.py로 만든 로컬 인덱스에서 검색한 뒤, 검색된 청크와 파일명을 프롬프트에 넣어 invoke_model로 생성
+#           (지식베이스 왕복/요금 없이 동작하고 오프라인 테스트에도 사용)
+# 로컬 결과도 Bedrock 응답과 같은 모양(output/citations)으로 돌려주므로 엔드포인트 코드는 백엔드와 무관합니다.
+RAG_BACKEND = os.getenv("RAG_BACKEND", "bedrock")  # bedrock | local
+LOCAL_KB_PATH = os.getenv("LOCAL_KB_PATH", "kb_index")
+LOCAL_KB_TOP_K = int(os.getenv("LOCAL_KB_TOP_K", "5"))
+LOCAL_KB_MODE = os.getenv("LOCAL_KB_MODE", "ann")  # ann | exact
+LOCAL_KB_NPROBE = int(os.getenv("LOCAL_KB_NPROBE", "8"))
+LOCAL_KB_MIN_SCORE = float(os.getenv("LOCAL_KB_MIN_SCORE", "0.3"))  # 이보다 낮은 청크만 있으면 검색 결과 없음 -> 폴백
+LOCAL_RAG_MODEL_ID = os.getenv("LOCAL_RAG_MODEL_ID", FALLBACK_MODEL_ID)
+RAG_RETRIEVED_TOKENS = int(os.getenv("RAG_RETRIEVED_TOKENS", "2000"))  # 검색 결과가 프롬프트에 더하는 토큰 어림값
+
+local_index = local_kb.LocalIndex(LOCAL_KB_PATH) if RAG_BACKEND == "local" else None
+if local_index:
+    logger.info(f"📚 로컬 지식베이스 로드: {LOCAL_KB_PATH} (청크 {local_index.size}개, {local_index.meta['embedder']})")
+
+rag_stats = {"local_searches": 0, "local_empty": 0, "local_search_ms": 0.0}
+
+def search_local_kb(user_message):
+    started = time.perf_counter()
+    with stage("local_kb.search"):
+        hits = local_index.search(user_message, k=LOCAL_KB_TOP_K, mode=LOCAL_KB_MODE, nprobe=LOCAL_KB_NPROBE)
+    rag_stats["local_searches"] += 1
+    rag_stats["local_search_ms"] += (time.perf_counter() - started) * 1000
+    hits = [hit for hit in hits if hit["score"] >= LOCAL_KB_MIN_SCORE]
+    if not hits:
+        rag_stats["local_empty"] += 1
+    return hits
+
+def local_references(hits):
+    return [
+        {
+            'content': {'text': hit['text']},
+            'location': {'type': 'CUSTOM', 'customDocumentLocation': {'id': hit['source']}},
+            'metadata': {'score': hit['score']}
+        }
+        for hit in hits
+    ]
+
+def build_local_rag_payload(prompt, user_message, hits):
+    search_results = "\n\n".join(
+        f"<source id=\"{i}\" file=\"{hit['source']}\">\n{hit['text']}\n</source>" for i, hit in enumerate(hits, 1)
+    )
+    system = prompt_registry.render(
+        "chat_rag", persona=prompt["persona"], user_info=prompt["user_info"], context=prompt["context"]
+    )
+    system = system.replace("$search_results$", search_results).replace("$output_format_instructions$", "").strip()
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1500,
+        "system": system,
+        "messages": [{"role": "user", "content": user_message}]
+    }
+
+def rag_retrieve_and_generate(prompt, user_message):
+    # bedrock_pool 안에서 실행되는 동기 함수
+    if local_index is None:
+        return bedrock_agent.retrieve_and_generate(
+            input={'text': user_message},
+            retrieveAndGenerateConfiguration=rag_configuration(prompt)
+        )
+
+    hits = search_local_kb(user_message)
+    if not hits:
+        return {'output': {'text': ''}, 'citations': []}
+    response = bedrock_runtime.invoke_model(
+        modelId=LOCAL_RAG_MODEL_ID,
+        body=json.dumps(build_local_rag_payload(prompt, user_message, hits))
+    )
+    response_body = json.loads(response['body'].read())
+    record_token_usage(LOCAL_RAG_MODEL_ID, response_body.get("usage", {}))
+    return {
+        'output': {'text': response_body["content"][0]["text"]},
+        'citations': [{'retrievedReferences': local_references(hits)}]
+    }
+
+def rag_model_id():
+    return LOCAL_RAG_MODEL_ID if local_index is not None else MODEL_ARN
+
+async def rag_via_gateway(prompt, user_message):
+    # 같은 프롬프트(페르소나/환자 정보/맥락)로 같은 질문이 동시에 들어오면 호출 한 번으로 합침
+    with stage("bedrock.retrieve_and_generate"):
+        return await get_model_gateway(rag_model_id()).call(
+            rag_retrieve_and_generate, prompt, user_message,
+            tokens=chat_prompt_tokens(prompt, user_message) + RAG_RETRIEVED_TOKENS,
+            key=request_key(RAG_BACKEND, prompt["persona"], prompt["user_info"], prompt["context"], user_message)
+        )
+
+def get_rag_stats():
+    stats = {"backend": RAG_BACKEND}
+    if local_index:
+        searches = rag_stats["local_searches"]
+        stats.update({
+            "chunks": local_index.size,
+            "mode": LOCAL_KB_MODE,
+            "searches": searches,
+            "empty": rag_stats["local_empty"],
+            "avg_search_ms": round(rag_stats["local_search_ms"] / searches, 2) if searches else None,
+        })
+    return stats
+
+# 8. 헬퍼 함수: 폴백 선행 실행 (Hedging)
+# 지식베이스가 다루지 않는 질문은 RAG -> 폴백을 순서대로 기다리느라 지연이 두 배가 됩니다.
+# off   : 기존처럼 RAG 결과를 본 뒤에 폴백 호출
+# race  : RAG와 폴백을 동시에 시작하고, RAG에 출처가 있으면 폴백 결과는 버림
+# hedge : RAG 시작 후 CHAT_HEDGE_DELAY_MS 만큼 기다렸다가 폴백 시작 (그 전에 RAG가 끝나면 호출 안 함)
+# auto  : 주제별 최근 출처 적중 기록으로 폴백이 필요할 확률을 추정해 높을 때만 hedge
+CHAT_HEDGE_MODE = os.getenv("CHAT_HEDGE_MODE", "off")
+CHAT_HEDGE_DELAY = int(os.getenv("CHAT_HEDGE_DELAY_MS", "1500")) / 1000
+CHAT_HEDGE_MISS_THRESHOLD = float(os.getenv("CHAT_HEDGE_MISS_THRESHOLD", "0.5"))
+CHAT_HEDGE_HISTORY = int(os.getenv("CHAT_HEDGE_HISTORY", "50"))
+
+TOPIC_KEYWORDS = {
+    "식단": ["식단", "레시피", "메뉴", "요리", "조리", "아침", "점심", "저녁", "간식", "반찬"],
+    "혈당": ["혈당", "당화혈색소", "인슐린", "저혈당", "고혈당", "공복"],
+    "운동": ["운동", "걷기", "산책", "근력", "헬스"],
+    "약물": ["약", "복용", "메트포르민", "처방"],
+    "합병증": ["합병증", "신장", "망막", "발", "혈관", "혈압"],
+}
+
+def classify_topic(user_message):
+    for topic, keywords in TOPIC_KEYWORDS.items():
+        if any(keyword in user_message for keyword in keywords):
+            return topic
+    return "기타"
+
+class HedgePredictor:
+    def __init__(self, window, threshold):
+        self.threshold = threshold
+        self.history = defaultdict(lambda: deque(maxlen=window))  # 주제별 출처 적중(True)/미적중(False)
+
+    def miss_probability(self, topic):
+        # 기록이 없을 때 0.5에서 시작하는 라플라스 보정 추정치
+        history = self.history[topic]
+        misses = sum(1 for hit in history if not hit)
+        return (misses + 1) / (len(history) + 2)
+
+    def should_hedge(self, topic):
+        return self.miss_probability(topic) >= self.threshold
+
+    def record(self, topic, hit):
+        self.history[topic].append(hit)
+
+    def stats(self):
+        return {topic: round(self.miss_probability(topic), 3) for topic in self.history}
+
+hedge_predictor = HedgePredictor(CHAT_HEDGE_HISTORY, CHAT_HEDGE_MISS_THRESHOLD)
+hedge_stats = {
+    "launched": 0,              # 폴백 선행 태스크 생성
+    "cancelled_before_start": 0, # 지연 시간 안에 RAG가 끝나 호출 자체를 안 함 (비용 0)
+    "started": 0,               # 실제 Bedrock 호출까지 간 경우
+    "used": 0,                  # RAG 미적중이라 선행 결과를 사용
+    "wasted": 0,                # RAG 적중이라 버림 (추가 비용)
+    "latency_saved_ms": 0.0,    # 사용된 경우 RAG와 겹쳐 실행된 시간의 합
+}
+
+class FallbackHedge:
+    def __init__(self, prompt, user_message, delay):
+        self.started_at = None
+        self.start_now = asyncio.Event()  # 지연 시간 전에 RAG가 출처 없이 끝나면 바로 시작
+        self.task = asyncio.ensure_future(self._run(prompt, user_message, delay))
+        hedge_stats["launched"] += 1
+
+    async def _run(self, prompt, user_message, delay):
+        if delay:
             try:
-                fb_response = bedrock_runtime.invoke_model(
-                    modelId=model_id,
-                    body=json.dumps(payload)
-                )
-                fb_response_body = json.loads(fb_response.get("body").read())
-                answer = fb_response_body["content"][0]["text"]
-                citations = ["AI 일반 상식 (검색 결과 없음)"]
-                print("✅ 기본 모델 폴백 답변 생성 완료")
-                
-            except Exception as fb_error:
-                print(f"🚨 기본 모델 폴백 실패: {fb_error}")
-                # 폴백도 실패하면 원래의(아마도 '모르겠다'는) RAG 답변을 그대로 둠
-                if not answer:
-                    answer = "죄송합니다. 관련 정보를 찾을 수 없으며, 일반적인 답변 생성 중에도 오류가 발생했습니다."
+                await asyncio.wait_for(self.start_now.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self.started_at = time.perf_counter()
+        hedge_stats["started"] += 1
+        return await invoke_fallback(prompt, user_message)
+
+    async def use(self, rag_finished_at):
+        hedge_stats["used"] += 1
+        if self.started_at is None:
+            # 아직 지연 시간 대기 중이면 남은 시간을 기다리지 않고 지금 시작 (순서대로 호출한 것과 같음, 절감 0)
+            self.start_now.set()
+        else:
+            hedge_stats["latency_saved_ms"] += (rag_finished_at - self.started_at) * 1000
+        return await self.task
 
+    def discard(self):
+        if self.started_at is None:
+            self.task.cancel()
+            hedge_stats["cancelled_before_start"] += 1
+        else:
+            # 이미 나간 Bedrock 호출은 취소할 수 없으니 결과만 버림
+            hedge_stats["wasted"] += 1
+            self.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+def start_fallback_hedge(prompt, user_message):
+    if CHAT_HEDGE_MODE == "race":
+        return FallbackHedge(prompt, user_message, 0)
+    if CHAT_HEDGE_MODE == "hedge":
+        return FallbackHedge(prompt, user_message, CHAT_HEDGE_DELAY)
+    if CHAT_HEDGE_MODE == "auto" and hedge_predictor.should_hedge(classify_topic(user_message)):
+        return FallbackHedge(prompt, user_message, CHAT_HEDGE_DELAY)
+    return None
+
+def get_hedge_stats():
+    started = hedge_stats["started"]
+    return {
+        "mode": CHAT_HEDGE_MODE,
+        **hedge_stats,
+        "latency_saved_ms": round(hedge_stats["latency_saved_ms"], 1),
+        "hit_rate": round(hedge_stats["used"] / started, 3) if started else None,
+        "extra_bedrock_calls": hedge_stats["wasted"],
+        "topic_miss_probability": hedge_predictor.stats(),
+    }
+
+# 9. 헬퍼 함수: 답변 캐시
+# 채팅 프롬프트는 질문, 연령대 페르소나, 진단명에만 의존하므로 같은 조합의 답변은 재사용할 수 있습니다.
+# 이름/나이처럼 사람마다 다른 값은 자리표시자로 바꿔 저장하고, 꺼낼 때 현재 사용자 값으로 채웁니다.
+CHAT_CACHE_BACKEND = os.getenv("CHAT_CACHE_BACKEND", CACHE_BACKEND)  # memory | disk | redis | off
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0"))  # 0이면 유사 질문 조회 안 함
+
+answer_cache = None
+if CHAT_CACHE_BACKEND != "off":
+    answer_cache = create_cache(
+        CHAT_CACHE_BACKEND,
+        path=os.getenv("CHAT_CACHE_PATH", cache_path("chat_cache.sqlite3")),
+        max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "1000")),
+        ttl=int(os.getenv("CHAT_CACHE_TTL", "86400")),
+        namespace="answer",
+    )
+answer_cache_stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0}
+
+def normalize_question(user_message):
+    text = unicodedata.normalize("NFKC", user_message).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def answer_cache_prefix(profile):
+    if not profile:
+        return "guest|-|"
+    return f"{get_age_bracket(int(profile['age']))}|{profile.get('diabetes_type', '일반')}|"
+
+def char_bigrams(text):
+    text = text.replace(" ", "")
+    return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+def bigram_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[gram] for gram, count in a.items())
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+def personalize_answer(answer, profile, to_template):
+    if not profile:
+        return answer
+    pairs = [(str(profile['name']), "{{name}}"), (f"{int(profile['age'])}세", "{{age}}세")]
+    for value, placeholder in pairs:
+        answer = answer.replace(value, placeholder) if to_template else answer.replace(placeholder, value)
+    return answer
+
+def lookup_cached_answer(user_message, profile, min_similarity=CHAT_CACHE_SIMILARITY):
+    if answer_cache is None:
+        return None
+    prefix = answer_cache_prefix(profile)
+    question = normalize_question(user_message)
+    entry = answer_cache.get(prefix + question)
+
+    if entry is None and min_similarity > 0:
+        # 같은 페르소나 버킷 안에서 글자 bigram 코사인 유사도가 가장 높은 질문을 찾음
+        target = char_bigrams(question)
+        best_score = min_similarity
+        for key, value in answer_cache.scan(prefix):
+            score = bigram_similarity(target, char_bigrams(key[len(prefix):]))
+            if score >= best_score:
+                best_score, entry = score, value
+        if entry is not None:
+            answer_cache_stats["similar_hits"] += 1
+
+    if entry is None:
+        answer_cache_stats["misses"] += 1
+        return None
+    answer_cache_stats["hits"] += 1
+    return {"reply": personalize_answer(entry["reply"], profile, to_template=False), "sources": entry["sources"]}
+
+def store_cached_answer(user_message, profile, answer, sources):
+    if answer_cache is None or not answer:
+        return
+    answer_cache.set(
+        answer_cache_prefix(profile) + normalize_question(user_message),
+        {"reply": personalize_answer(answer, profile, to_template=True), "sources": sources}
+    )
+    answer_cache_stats["stores"] += 1
+
+# Bedrock을 쓸 수 없을 때(서킷 브레이커 열림, 대기 시간 초과)는 평소보다 느슨한 기준으로 캐시를 찾아보고
+# 그래도 없으면 안내 문구로 응답합니다.
+CHAT_DEGRADED_SIMILARITY = float(os.getenv("CHAT_DEGRADED_SIMILARITY", "0.5"))
+DEGRADED_CHAT_REPLY = "지금은 AI 상담 요청이 많아 답변을 드리기 어렵습니다. 잠시 후 다시 질문해주세요. 급한 증상이 있다면 담당 의료진과 상의하세요."
+
+def degraded_chat_answer(user_message, profile):
+    cached = lookup_cached_answer(user_message, profile, min_similarity=CHAT_DEGRADED_SIMILARITY)
+    if cached:
+        return cached['reply'], cached['sources']
+    return DEGRADED_CHAT_REPLY, []
+
+def get_answer_cache_stats():
+    if answer_cache is None:
+        return {"backend": "off"}
+    lookups = answer_cache_stats["hits"] + answer_cache_stats["misses"]
+    return {
+        "backend": CHAT_CACHE_BACKEND,
+        **answer_cache_stats,
+        "hit_ratio": round(answer_cache_stats["hits"] / lookups, 3) if lookups else None,
+        "size": len(answer_cache),
+        "evictions": answer_cache.evictions,
+    }
+
+# 10. API 엔드포인트: 채팅 (Chat)
+# 프로필/대화 맥락을 읽은 뒤의 답변 생성(캐시 -> RAG -> 폴백)은 /chat/batch와 함께 씁니다.
+async def answer_chat(user_id, user_message, profile, context):
+    # 2. 사용자 질문 DB 저장 (로그)
+    await save_to_dynamodb(user_id, 'user', user_message)
+
+    # 3. 캐시된 답변이 있으면 Bedrock을 거치지 않고 바로 응답 (이전 대화에 이어지는 질문은 제외)
+    cached = None if context else lookup_cached_answer(user_message, profile)
+    if cached:
+        logger.info("⚡ 캐시된 답변 사용")
+        await save_to_dynamodb(user_id, 'ai', cached['reply'])
         return {
-            "reply": answer,
-            "sources": citations,
+            "reply": cached['reply'],
+            "sources": cached['sources'],
             "status": "success"
         }
 
+    prompt = build_chat_prompt(profile, context)
+
+    # 4. AI 답변 생성 (RAG) - 설정에 따라 폴백을 미리 시작
+    hedge = start_fallback_hedge(prompt, user_message)
+    try:
+        response = await rag_via_gateway(prompt, user_message)
+    except ModelUnavailable as e:
+        # Bedrock 스로틀링/장애: 500 대신 캐시된 답변이나 안내 문구로 응답
+        if hedge:
+            hedge.discard()
+        logger.warning(f"⚠️ 모델 호출 불가, 대체 답변으로 응답: {e}")
+        reply, sources = degraded_chat_answer(user_message, profile)
+        await save_to_dynamodb(user_id, 'ai', reply)
+        return {
+            "reply": reply,
+            "sources": sources,
+            "status": "degraded"
+        }
+    except Exception:
+        if hedge:
+            hedge.discard()
+        raise
+    rag_finished_at = time.perf_counter()
+    answer = response['output']['text']
+
+    # 5. 출처 추출 (파일 이름만)
+    citations = []
+    if 'citations' in response and response['citations']:
+        citations = extract_citation_sources(response['citations'][0]['retrievedReferences'])
+    hedge_predictor.record(classify_topic(user_message), bool(citations))
+
+    # 6. RAG 검색 결과가 없을(Citations 공란) 경우 기본 모델로 폴백
+    if citations:
+        if hedge:
+            hedge.discard()
+    else:
+        logger.warning("⚠️ RAG 검색 결과 없음 (Citations Empty). 기본 모델(Claude 3.5 Sonnet)로 전환합니다.")
+
+        try:
+            # Base Model 호출 (Claude 3.5 Sonnet) - 미리 시작한 호출이 있으면 그 결과 사용
+            answer = await hedge.use(rag_finished_at) if hedge else await invoke_fallback(prompt, user_message)
+            citations = [FALLBACK_SOURCE]
+            logger.info("✅ 기본 모델 폴백 답변 생성 완료")
+
+        except Exception as fb_error:
+            logger.error(f"🚨 기본 모델 폴백 실패: {fb_error}")
+            # 폴백도 실패하면 원래의(아마도 '모르겠다'는) RAG 답변을 그대로 둠
+            if not answer:
+                answer = "죄송합니다. 관련 정보를 찾을 수 없으며, 일반적인 답변 생성 중에도 오류가 발생했습니다."
+
+    # 7. AI 답변 DB 저장 (폴백까지 실패한 답변은 캐시하지 않음)
+    logger.info(f"🏷️ 프롬프트 버전: {prompt['version']}")
+    await save_to_dynamodb(user_id, 'ai', answer, prompt_version=prompt['version'])
+    if citations and not context:
+        store_cached_answer(user_message, profile, answer, citations)
+
+    return {
+        "reply": answer,
+        "sources": citations,
+        "status": "success"
+    }
+
+@app.post("/chat")
+async def chat_endpoint(request: ChatRequest):
+    logger.info(f"📩 채팅 요청: {request.user_message} ({request.user_id})")
+    
+    try:
+        # 1. DynamoDB에서 유저 정보(프로필) & 이전 대화 맥락 가져오기
+        profile = await get_user_profile(request.user_id)
+        context = await build_conversation_context(request.user_id, profile)
+        return await answer_chat(request.user_id, request.user_message, profile, context)
+
+    except HTTPException as he:
+        raise he
     except Exception as e:
-        print(f"🚨 채팅 에러: {str(e)}")
+        logger.error(f"🚨 채팅 에러: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 11. 헬퍼 함수: 스트리밍 (Server-Sent Events)
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def iter_rag_stream(prompt, user_message):
+    if local_index is not None:
+        return iter_local_rag_stream(prompt, user_message)
+    response = bedrock_agent.retrieve_and_generate_stream(
+        input={'text': user_message},
+        retrieveAndGenerateConfiguration=rag_configuration(prompt)
+    )
+    return response['stream']
+
+def iter_text_deltas(response, model_id):
+    for event in response['body']:
+        chunk = json.loads(event['chunk']['bytes'])
+        if chunk.get('type') == 'content_block_delta':
+            yield chunk['delta'].get('text', '')
+        elif chunk.get('type') == 'message_start':
+            record_token_usage(model_id, chunk['message'].get('usage', {}))
+        elif chunk.get('type') == 'message_delta':
+            record_token_usage(model_id, chunk.get('usage', {}))
+
+def iter_local_rag_stream(prompt, user_message):
+    # retrieve_and_generate_stream과 같은 이벤트 모양(output -> citation)으로 보냄
+    hits = search_local_kb(user_message)
+    if not hits:
+        return
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=LOCAL_RAG_MODEL_ID,
+        body=json.dumps(build_local_rag_payload(prompt, user_message, hits))
+    )
+    for text in iter_text_deltas(response, LOCAL_RAG_MODEL_ID):
+        yield {'output': {'text': text}}
+    yield {'citation': {'retrievedReferences': local_references(hits)}}
+
+def iter_fallback_stream(prompt, user_message):
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=FALLBACK_MODEL_ID,
+        body=json.dumps(build_fallback_payload(prompt, user_message))
+    )
+    yield from iter_text_deltas(response, FALLBACK_MODEL_ID)
+
+# 12. API 엔드포인트: 채팅 스트리밍 (Chat Stream)
+# 토큰이 생성되는 대로 token 이벤트로 보내고, 끝나면 citations -> done 순서로 보냅니다.
+# RAG 결과에 출처가 없으면 reset 이벤트 후 기본 모델 답변을 다시 스트리밍합니다.
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    logger.info(f"📩 채팅 스트리밍 요청: {request.user_message} ({request.user_id})")
+
+    profile = await get_user_profile(request.user_id)
+    context = await build_conversation_context(request.user_id, profile)
+    await save_to_dynamodb(request.user_id, 'user', request.user_message)
+    cached = None if context else lookup_cached_answer(request.user_message, profile)
+    prompt = None if cached else build_chat_prompt(profile, context)
+
+    async def event_stream():
+        if cached:
+            # 캐시 적중 시 전체 답변을 한 번에 보냄
+            yield sse_event("token", {"text": cached['reply']})
+            yield sse_event("citations", {"sources": cached['sources']})
+            await save_to_dynamodb(request.user_id, 'ai', cached['reply'])
+            yield sse_event("done", {"status": "success"})
+            return
+
+        parts = []
+        citations = []
+        try:
+            stream = stream_via_gateway(
+                rag_model_id(), chat_prompt_tokens(prompt, request.user_message) + RAG_RETRIEVED_TOKENS,
+                iter_rag_stream, prompt, request.user_message
+            )
+            async for event in stream:
+                if 'output' in event:
+                    text = event['output'].get('text', '')
+                    parts.append(text)
+                    yield sse_event("token", {"text": text})
+                elif 'citation' in event:
+                    citation = event['citation']
+                    references = citation.get('retrievedReferences') or citation.get('citation', {}).get('retrievedReferences', [])
+                    for source in extract_citation_sources(references):
+                        if source not in citations:
+                            citations.append(source)
+
+            if not citations:
+                logger.warning("⚠️ RAG 검색 결과 없음 (Citations Empty). 기본 모델 스트리밍으로 전환합니다.")
+                rag_parts = parts
+                parts = []
+                yield sse_event("reset", {})
+                try:
+                    fallback_stream = stream_via_gateway(
+                        FALLBACK_MODEL_ID, chat_prompt_tokens(prompt, request.user_message),
+                        iter_fallback_stream, prompt, request.user_message
+                    )
+                    async for text in fallback_stream:
+                        parts.append(text)
+                        yield sse_event("token", {"text": text})
+                    citations = [FALLBACK_SOURCE]
+                except Exception as fb_error:
+                    logger.error(f"🚨 기본 모델 폴백 실패: {fb_error}")
+                    # 폴백 도중 실패하면 RAG 답변으로 되돌림
+                    parts = rag_parts
+                    yield sse_event("reset", {})
+                    yield sse_event("token", {"text": "".join(parts)})
+
+            answer = "".join(parts)
+            yield sse_event("citations", {"sources": citations})
+            await save_to_dynamodb(request.user_id, 'ai', answer, prompt_version=prompt['version'])
+            if citations and not context:
+                store_cached_answer(request.user_message, profile, answer, citations)
+            yield sse_event("done", {"status": "success"})
+
+        except ModelUnavailable as e:
+            logger.warning(f"⚠️ 모델 호출 불가, 대체 답변으로 응답: {e}")
+            reply, sources = degraded_chat_answer(request.user_message, profile)
+            yield sse_event("reset", {})
+            yield sse_event("token", {"text": reply})
+            yield sse_event("citations", {"sources": sources})
+            await save_to_dynamodb(request.user_id, 'ai', reply)
+            yield sse_event("done", {"status": "degraded"})
+
+        except Exception as e:
+            logger.error(f"🚨 채팅 스트리밍 에러: {str(e)}")
+            yield sse_event("error", {"status": "error", "detail": str(e)})
+
+    return StreamingResponse(
+        in_flight.track(event_stream()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 13. 헬퍼 함수: 채팅 기록 조회
+# user_id(파티션 키) + timestamp(정렬 키)로 최신순 Query 한 번에 한 페이지를 가져옵니다. (Scan 없음)
+# 사용자별 최근 N턴은 메모리에 두어 첫 페이지 요청은 DynamoDB 없이 응답합니다.
+# 다른 워커가 저장한 대화는 이 캐시에 반영되지 않으므로 워커가 여러 개면 기본으로 끕니다.
+CHAT_HISTORY_MAX_LIMIT = int(os.getenv("CHAT_HISTORY_MAX_LIMIT", "100"))
+CHAT_HISTORY_CACHE_TURNS = int(os.getenv("CHAT_HISTORY_CACHE_TURNS", "50" if WORKER_COUNT == 1 else "0"))  # 0이면 캐시 안 함
+CHAT_HISTORY_CACHE_USERS = int(os.getenv("CHAT_HISTORY_CACHE_USERS", "1000"))
+CHAT_HISTORY_PROJECTION = "#ts, message_id, #role, content"  # 화면 표시에 필요한 필드만
+
+class RecentTurnsCache:
+    def __init__(self, max_turns, max_users):
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.users = OrderedDict()  # user_id -> {"turns": 오래된 순 deque, "has_more": 더 오래된 기록 존재 여부}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, user_id):
+        entry = self.users.get(user_id)
+        if entry is not None:
+            self.users.move_to_end(user_id)
+        return entry
+
+    def load(self, user_id, newest_first, has_more):
+        self.users[user_id] = {
+            "turns": deque(reversed(newest_first), maxlen=self.max_turns),
+            "has_more": has_more,
+        }
+        self.users.move_to_end(user_id)
+        while len(self.users) > self.max_users:
+            self.users.popitem(last=False)
+
+    def append(self, item):
+        # 이미 DB에서 불러온 사용자만 갱신 (안 불러온 사용자는 다음 조회 때 DB에서 읽음)
+        entry = self.users.get(item['user_id'])
+        if entry is None:
+            return
+        if len(entry["turns"]) == self.max_turns:
+            entry["has_more"] = True
+        entry["turns"].append({key: item[key] for key in ('timestamp', 'message_id', 'role', 'content')})
+
+recent_turns_cache = RecentTurnsCache(CHAT_HISTORY_CACHE_TURNS, CHAT_HISTORY_CACHE_USERS) if CHAT_HISTORY_CACHE_TURNS > 0 else None
+
+def encode_history_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+def decode_history_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="잘못된 cursor 값입니다.")
+
+async def query_chat_history(user_id, limit, cursor=None, start=None, end=None):
+    key_condition = Key('user_id').eq(user_id)
+    if start and end:
+        key_condition = key_condition & Key('timestamp').between(start, end)
+    elif start:
+        key_condition = key_condition & Key('timestamp').gte(start)
+    elif end:
+        key_condition = key_condition & Key('timestamp').lte(end)
+
+    params = {
+        'KeyConditionExpression': key_condition,
+        'ScanIndexForward': False,  # 최신순
+        'Limit': limit,
+        'ProjectionExpression': CHAT_HISTORY_PROJECTION,
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#role': 'role'},
+    }
+    if cursor:
+        params['ExclusiveStartKey'] = decode_history_cursor(cursor)
+    response = await dynamodb_pool.run(chat_table.query, **params)
+    return response.get('Items', []), response.get('LastEvaluatedKey')
+
+async def load_recent_turns_entry(user_id):
+    entry = recent_turns_cache.get(user_id)
+    if entry is None:
+        recent_turns_cache.stats["misses"] += 1
+        items, last_key = await query_chat_history(user_id, CHAT_HISTORY_CACHE_TURNS)
+        recent_turns_cache.load(user_id, items, has_more=last_key is not None)
+        entry = recent_turns_cache.get(user_id)
+    else:
+        recent_turns_cache.stats["hits"] += 1
+    return entry
+
+async def load_recent_turns(user_id):
+    # 오래된 순 최근 턴 목록 (캐시를 끈 경우 DynamoDB에서 직접 조회)
+    if recent_turns_cache is not None:
+        return list((await load_recent_turns_entry(user_id))["turns"])
+    items, _ = await query_chat_history(user_id, CHAT_CONTEXT_MAX_TURNS)
+    return list(reversed(items))
+
+# 14. API 엔드포인트: 채팅 기록 조회 (Chat History)
+# messages는 한 페이지 안에서 오래된 순으로 정렬되고, next_cursor로 더 오래된 페이지를 요청합니다.
+@app.get("/chat/history")
+async def chat_history_endpoint(
+    user_id: str,
+    limit: int = 20,
+    cursor: str | None = None,
+    start: str | None = None,
+    end: str | None = None
+):
+    limit = max(1, min(limit, CHAT_HISTORY_MAX_LIMIT))
+    try:
+        cacheable = recent_turns_cache is not None and not (cursor or start or end) and limit <= CHAT_HISTORY_CACHE_TURNS
+        if cacheable:
+            entry = await load_recent_turns_entry(user_id)
+            turns = list(entry["turns"])
+            page = turns[-limit:]
+            has_more = len(turns) > limit or entry["has_more"]
+            next_key = {'user_id': user_id, 'timestamp': page[0]['timestamp']} if page and has_more else None
+        else:
+            items, next_key = await query_chat_history(user_id, limit, cursor, start, end)
+            page = list(reversed(items))
+
+        return {
+            "status": "success",
+            "messages": page,
+            "next_cursor": encode_history_cursor(next_key) if next_key else None
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"🚨 채팅 기록 조회 에러: {e}")
+        raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
+
 # Helper for DynamoDB Float issue
 def convert_floats_to_decimals(obj):
     if isinstance(obj, list):
@@ -313,156 +2066,586 @@ def convert_floats_to_decimals(obj):
         return Decimal(str(obj))
     return obj
 
+# 15. 헬퍼 함수: 대화 맥락 (Multi-turn Context)
+# 최근 대화 중 토큰 예산에 들어가는 턴은 그대로 넣고, 예산 밖으로 밀려난 턴은 사용자별 누적 요약으로 압축합니다.
+# 요약은 밀려난 턴이 CHAT_SUMMARY_BATCH_TURNS개 쌓일 때마다 백그라운드에서 갱신하므로 응답 지연에 영향이 없습니다.
+# 비회원(guest)은 여러 사람이 같은 아이디를 쓰므로 맥락을 붙이지 않습니다.
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "1500"))  # 0이면 맥락 사용 안 함
+CHAT_CONTEXT_MAX_TURNS = int(os.getenv("CHAT_CONTEXT_MAX_TURNS", "20"))
+CHAT_CONTEXT_SESSION_MINUTES = int(os.getenv("CHAT_CONTEXT_SESSION_MINUTES", "30"))  # 이보다 오래된 대화는 새 대화로 봄
+CHAT_SUMMARY_BATCH_TURNS = int(os.getenv("CHAT_SUMMARY_BATCH_TURNS", "4"))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "400"))
+CHAT_SUMMARY_MODEL_ID = os.getenv("CHAT_SUMMARY_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+
+summary_cache = create_cache(
+    os.getenv("CHAT_SUMMARY_CACHE_BACKEND", CACHE_BACKEND),
+    path=os.getenv("CHAT_SUMMARY_CACHE_PATH", cache_path("summary_cache.sqlite3")),
+    max_entries=int(os.getenv("CHAT_SUMMARY_CACHE_USERS", "10000")),
+    ttl=CHAT_CONTEXT_SESSION_MINUTES * 60,
+    namespace="summary",
+)
+summarizing_users = set()
+conversation_stats = {"requests_with_context": 0, "context_tokens": 0, "turns_included": 0, "summaries": 0, "summary_failures": 0}
+
+def estimate_tokens(text):
+    # 한글은 글자당 약 1토큰, 그 외(영문/숫자/공백)는 4글자당 약 1토큰으로 어림
+    hangul = sum(1 for ch in text if '가' <= ch <= '힣')
+    return hangul + (len(text) - hangul) // 4 + 1
+
+def format_turns(turns):
+    return "\n".join(f"{'환자' if turn['role'] == 'user' else 'AI'}: {turn['content']}" for turn in turns)
+
+async def update_conversation_summary(user_id, previous, turns):
+    prompt = prompt_registry.render(
+        "conversation_summary",
+        max_chars=CHAT_SUMMARY_MAX_CHARS,
+        previous=previous or "없음",
+        turns=format_turns(turns)
+    )
+    payload = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 600,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    try:
+        with stage("bedrock.summary_invoke_model"):
+            response_body = await invoke_model_via_gateway(
+                CHAT_SUMMARY_MODEL_ID, json.dumps(payload), tokens=estimate_tokens(prompt) + payload["max_tokens"]
+            )
+        summary_cache.set(user_id, {"summary": response_body["content"][0]["text"], "until": turns[-1]['timestamp']})
+        conversation_stats["summaries"] += 1
+    except Exception as e:
+        conversation_stats["summary_failures"] += 1
+        logger.warning(f"⚠️ 대화 요약 실패: {e}")
+    finally:
+        summarizing_users.discard(user_id)
+
+async def build_conversation_context(user_id, profile):
+    if CHAT_CONTEXT_TOKEN_BUDGET <= 0 or not profile:
+        return ""
+
+    session_start = (datetime.now() - timedelta(minutes=CHAT_CONTEXT_SESSION_MINUTES)).isoformat()
+    try:
+        recent = await load_recent_turns(user_id)
+    except Exception as e:
+        # 채팅 기록을 못 읽어도 채팅은 맥락 없이 계속 (스로틀링, 풀 대기열 초과 등)
+        logger.warning(f"⚠️ 대화 맥락 조회 실패 (맥락 없이 진행): {e}")
+        return ""
+    turns = [turn for turn in recent[-CHAT_CONTEXT_MAX_TURNS:] if turn['timestamp'] >= session_start]
+    state = summary_cache.get(user_id) or {}
+    summary = state.get("summary", "")
+    summarized_until = state.get("until", "")
+
+    # 최신 턴부터 예산이 허락하는 만큼 그대로 포함
+    budget = CHAT_CONTEXT_TOKEN_BUDGET - (estimate_tokens(summary) if summary else 0)
+    window = []
+    for turn in reversed(turns):
+        cost = estimate_tokens(turn['content'])
+        if cost > budget:
+            break
+        budget -= cost
+        window.append(turn)
+    window.reverse()
+
+    # 예산 밖으로 밀려났지만 아직 요약에 반영되지 않은 턴이 충분히 쌓이면 요약 갱신
+    pending = [turn for turn in turns[:len(turns) - len(window)] if turn['timestamp'] > summarized_until]
+    if len(pending) >= CHAT_SUMMARY_BATCH_TURNS and user_id not in summarizing_users:
+        summarizing_users.add(user_id)
+        in_flight.spawn(update_conversation_summary(user_id, summary, pending))
+
+    if not window and not summary:
+        return ""
+
+    conversation_stats["requests_with_context"] += 1
+    conversation_stats["context_tokens"] += CHAT_CONTEXT_TOKEN_BUDGET - budget
+    conversation_stats["turns_included"] += len(window)
+
+    sections = []
+    if summary:
+        sections.append(f"[이전 대화 요약]\n{summary}")
+    if window:
+        sections.append(f"[최근 대화]\n{format_turns(window)}")
+    return "\n\n".join(sections)
+
+def get_conversation_stats():
+    requests = conversation_stats["requests_with_context"]
+    return {
+        **conversation_stats,
+        "avg_context_tokens": round(conversation_stats["context_tokens"] / requests, 1) if requests else None,
+        "summarizing_now": len(summarizing_users),
+    }
+
 # 7. API 엔드포인트: 회원가입 (Sign Up)
 @app.post("/signup")
 async def signup_endpoint(request: SignUpRequest):
-    print(f"📝 회원가입 요청: {request.user_id}, {request.name}")
+    logger.info(f"📝 회원가입 요청: {request.user_id}, {request.name}")
     try:
-        # 중복 ID 체크
-        response = user_table.get_item(Key={'user_id': request.user_id})
-        if 'Item' in response:
-            raise HTTPException(status_code=400, detail="이미 존재하는 아이디입니다.")
-        
         # DynamoDB does not support float, convert to Decimal
         safe_details = convert_floats_to_decimals(request.details or {})
+        item = {
+            'user_id': request.user_id,
+            'password': request.password,
+            'name': request.name,
+            'age': request.age,
+            'diabetes_type': request.diabetes_type,
+            'details': safe_details, # 상세 정보 저장 (Decimal 변환 됨)
+            'joined_at': datetime.now().isoformat()
+        }
 
-        # DB 저장
-        user_table.put_item(
-            Item={
-                'user_id': request.user_id,
-                'password': request.password,
-                'name': request.name,
-                'age': request.age,
-                'diabetes_type': request.diabetes_type,
-                'details': safe_details, # 상세 정보 저장 (Decimal 변환 됨)
-                'joined_at': datetime.now().isoformat()
+        # DB 저장 - 중복 ID 체크는 조건부 쓰기로 처리 (캐시가 오래됐어도 덮어쓰지 않도록 별도 조회 없이)
+        try:
+            await dynamodb_pool.run(
+                user_table.put_item,
+                Item=item,
+                ConditionExpression='attribute_not_exists(user_id)'
+            )
+        except user_table.meta.client.exceptions.ConditionalCheckFailedException:
+            raise HTTPException(status_code=400, detail="이미 존재하는 아이디입니다.")
+
+        cache_user_profile(item)
+        return {"status": "success", "message": "회원가입이 완료되었습니다!"}
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"🚨 회원가입 에러: {e}")
+        raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
+
+# 16. 헬퍼 함수: 식단 사진 전처리
+# 휴대폰 원본 사진(수 MB)을 그대로 base64로 보내지 않고, 모델 권장 크기로 줄이고 EXIF를 제거한 JPEG로 다시 압축합니다.
+# 같은 사진을 다시 올리면 전처리 결과(JPEG)의 sha256이 같으므로 분석 결과 캐시에서 바로 응답합니다.
+# (흑백 축소 지문(dHash)은 같은 접시/식탁의 다른 음식도 같은 값이 나와 다른 식사의 분석 결과를 돌려주므로 쓰지 않음)
+IMAGE_ALLOWED_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}  # Claude 지원 형식
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1568"))  # Claude 권장 긴 변 최대 길이
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_TOKENS = 1600  # 긴 변 1568px 이미지의 입력 토큰 어림값 (가로x세로/750)
+DEGRADED_FOOD_REPLY = "지금은 사진 분석 요청이 많아 결과를 드리기 어렵습니다. 잠시 후 다시 올려주세요."
+
+image_pool = IOPool(
+    "image",
+    max_workers=int(os.getenv("IMAGE_POOL_SIZE", str(os.cpu_count() or 2))),
+    max_queue=int(os.getenv("IMAGE_POOL_MAX_QUEUE", "64")),
+)
+image_cache = None
+if os.getenv("IMAGE_CACHE_BACKEND", CACHE_BACKEND) != "off":
+    image_cache = create_cache(
+        os.getenv("IMAGE_CACHE_BACKEND", CACHE_BACKEND),
+        path=os.getenv("IMAGE_CACHE_PATH", cache_path("image_cache.sqlite3")),
+        max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "1000")),
+        ttl=int(os.getenv("IMAGE_CACHE_TTL", str(7 * 86400))),
+        namespace="image",
+    )
+image_stats = {"processed": 0, "bytes_in": 0, "bytes_out": 0, "cache_hits": 0, "cache_misses": 0}
+
+def preprocess_image(source, content_type):
+    # source: bytes 또는 파일 객체 (업로드 임시 파일을 통째로 메모리에 올리지 않고 바로 디코딩)
+    if content_type not in IMAGE_ALLOWED_TYPES:
+        raise HTTPException(status_code=415, detail="지원하지 않는 이미지 형식입니다. (JPEG, PNG, WEBP, GIF)")
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        # JPEG는 디코딩 단계에서 1/2~1/8 축소해서 읽어 전체 해상도 디코딩 비용을 줄임
+        scale = min(1.0, IMAGE_MAX_DIMENSION / max(image.size))
+        image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+        image.load()
+    except Exception:
+        raise HTTPException(status_code=400, detail="이미지를 읽을 수 없습니다.")
+
+    ImageOps.exif_transpose(image, in_place=True)  # 회전 정보 반영 후 EXIF는 버림
+    if image.mode == "P":
+        image = image.convert("RGBA")
+    # 색 변환은 줄인 뒤에 해서 픽셀 수만큼 드는 비용을 줄임
+    image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.BICUBIC, reducing_gap=2.0)
+    if image.mode in ("RGBA", "LA"):
+        # 투명 배경은 흰색으로 채움
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image.convert("RGBA"), mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    data = output.getvalue()
+    return data, "image/jpeg", hashlib.sha256(data).hexdigest()
+
+def build_image_request_body(system_prompt, image_bytes, media_type, text):
+    # 이미지를 base64 str로 dict에 넣고 json.dumps 하면 사본이 여러 벌 생기므로
+    # 자리표시자로 JSON 골격만 만든 뒤 base64 바이트를 그 자리에 한 번에 끼워 넣음
+    placeholder = "__IMAGE_DATA__"
+    payload = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1500,
+        "system": system_prompt, # System Prompt 사용
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": media_type,
+                            "data": placeholder
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": text
+                    }
+                ]
             }
+        ]
+    }
+    head, tail = json.dumps(payload).encode("utf-8").split(f'"{placeholder}"'.encode("utf-8"), 1)
+    return b"".join((head, b'"', base64.b64encode(image_bytes), b'"', tail))
+
+FOOD_MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+def build_food_request(image_bytes, media_type, profile):
+    # (요청 본문, 예상 토큰 수, 프롬프트 버전) - 페르소나가 든 지시문은 system, 환자별 정보는 사용자 메시지로 보냄
+    # batch_job.py(Bedrock 배치 추론)도 같은 본문을 씁니다.
+    if profile:
+        persona = get_persona_by_age(int(profile['age']), profile.get('diabetes_type', '일반'))
+    else:
+        persona = render_persona(None)
+
+    system_prompt = prompt_registry.render("food_system", persona=persona)
+    user_text = prompt_registry.render("food_user", user_info=build_user_info(profile))
+    with stage("image.encode_request"):
+        body = build_image_request_body(system_blocks(system_prompt), image_bytes, media_type, user_text)
+    tokens = estimate_tokens(system_prompt + user_text) + IMAGE_TOKENS + BEDROCK_EXPECTED_OUTPUT_TOKENS
+    version = prompt_version_tag("food_system", "food_user", *persona_template_names(profile))
+    return body, tokens, version
+
+async def generate_food_analysis(image_bytes, media_type, profile):
+    # (답변, 프롬프트 버전)
+    body, tokens, version = build_food_request(image_bytes, media_type, profile)
+    # Bedrock Claude 3.5 호출 (Single Call) - 같은 사진을 같은 페르소나로 동시에 올리면 호출 한 번으로 합침
+    with stage("bedrock.food_invoke_model"):
+        response_body = await invoke_model_via_gateway(FOOD_MODEL_ID, body, tokens=tokens)
+    return response_body["content"][0]["text"], version
+
+def image_cache_key(image_hash, profile):
+    if not profile:
+        return f"{image_hash}|guest|-"
+    return f"{image_hash}|{get_age_bracket(int(profile['age']))}|{profile.get('diabetes_type', '일반')}"
+
+def get_image_stats():
+    lookups = image_stats["cache_hits"] + image_stats["cache_misses"]
+    return {
+        **image_stats,
+        "compression_ratio": round(image_stats["bytes_out"] / image_stats["bytes_in"], 3) if image_stats["bytes_in"] else None,
+        "cache_hit_ratio": round(image_stats["cache_hits"] / lookups, 3) if lookups else None,
+        "pool": image_pool.stats(),
+    }
+
+# 17. 헬퍼 함수: 영양 정보 추출 & 식단 기록
+# 식단 분석 답변 끝의 ###JSON_START###...###JSON_END### 블록을 서버에서 파싱/검증해 식단 기록으로 저장합니다.
+# 깨진 JSON은 먼저 규칙 기반으로 고쳐 보고, 그래도 안 되면 작은 모델에 JSON만 다시 뽑게 합니다.
+# 일/주 합계는 기록할 때마다 롤업 항목에 ADD로 누적하므로 조회는 기록 수와 상관없이 항목 몇 개만 읽습니다.
+MEAL_EXTRACT_MODEL_ID = os.getenv("MEAL_EXTRACT_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+NUTRITION_FIELDS = ("calories", "carbs", "protein", "fat")
+
+meal_table = LazyAWSClient(lambda: dynamodb.Table(os.getenv("MEAL_TABLE", "CareMeal-MealLog")))                 # 식단 기록 (user_id, timestamp)
+meal_rollup_table = LazyAWSClient(lambda: dynamodb.Table(os.getenv("MEAL_ROLLUP_TABLE", "CareMeal-MealRollup")))  # 일/주 합계 (user_id, period)
+# 일/주 합계를 나누는 기준 시간대 (서버 시간대가 UTC여도 한국 자정 기준으로 나눔)
+MEAL_TIMEZONE = ZoneInfo(os.getenv("MEAL_TIMEZONE", "Asia/Seoul"))
+nutrition_stats = {"parsed": 0, "repaired": 0, "retried": 0, "failed": 0, "meals_recorded": 0, "duplicates_skipped": 0}
+
+class MealNutrition(BaseModel):
+    menu: str
+    calories: float = Field(ge=0)
+    carbs: float = Field(ge=0)
+    protein: float = Field(ge=0)
+    fat: float = Field(ge=0)
+
+    @field_validator(*NUTRITION_FIELDS, mode="before")
+    @classmethod
+    def extract_number(cls, value):
+        # "약 450kcal", "30g" 처럼 단위가 붙은 값에서 숫자만 사용
+        if isinstance(value, str):
+            match = re.search(r"\d+(?:\.\d+)?", value.replace(",", ""))
+            return float(match.group()) if match else value
+        return value
+
+def repair_json(text):
+    text = text.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    text = re.sub(r"//[^\n]*", "", text)                 # 주석
+    text = re.sub(r"'([^'\n]*)'", r'"\1"', text)           # 작은따옴표 -> 큰따옴표
+    text = re.sub(r"([{,]\s*)([A-Za-z_]+)\s*:", r'\1"\2":', text)  # 따옴표 없는 키
+    return re.sub(r",\s*([}\]])", r"\1", text)           # 끝에 남은 쉼표
+
+def parse_nutrition_json(raw):
+    # (결과, 수리 여부) - 실패하면 (None, False)
+    start, end = raw.find("{"), raw.rfind("}")
+    if start == -1 or end <= start:
+        return None, False
+    candidate = raw[start:end + 1]
+    for repaired, text in ((False, candidate), (True, repair_json(candidate))):
+        try:
+            return MealNutrition.model_validate(json.loads(text)), repaired
+        except (ValueError, ValidationError):
+            continue
+    return None, False
+
+async def extract_nutrition(answer):
+    match = re.search(r"###JSON_START###(.*?)###JSON_END###", answer, re.S)
+    nutrition, repaired = parse_nutrition_json(match.group(1)) if match else (None, False)
+    if nutrition:
+        nutrition_stats["repaired" if repaired else "parsed"] += 1
+        return nutrition
+
+    # 블록이 없거나 고칠 수 없으면 답변 본문에서 JSON만 다시 뽑음
+    nutrition_stats["retried"] += 1
+    prompt = prompt_registry.render("meal_extract", answer=answer)
+    payload = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 200,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    try:
+        with stage("bedrock.meal_extract_invoke_model"):
+            response_body = await invoke_model_via_gateway(
+                MEAL_EXTRACT_MODEL_ID, json.dumps(payload), tokens=estimate_tokens(prompt) + payload["max_tokens"]
+            )
+        nutrition, _ = parse_nutrition_json(response_body["content"][0]["text"])
+    except Exception as e:
+        logger.warning(f"⚠️ 영양 정보 재추출 실패: {e}")
+        nutrition = None
+    if nutrition is None:
+        nutrition_stats["failed"] += 1
+    return nutrition
+
+def meal_periods(moment):
+    # 시간대가 없는 시각(날짜 파라미터 등)은 이미 MEAL_TIMEZONE 기준으로 봄
+    if moment.tzinfo:
+        moment = moment.astimezone(MEAL_TIMEZONE)
+    year, week, _ = moment.isocalendar()
+    return f"D#{moment.date().isoformat()}", f"W#{year}-W{week:02d}"
+
+async def record_meal(user_id, nutrition, image_hash=None, moment=None):
+    # moment: 식사 시각 (배치 재분석처럼 나중에 기록할 때), 없으면 지금
+    now = moment or datetime.now(MEAL_TIMEZONE)
+    values = {field: Decimal(str(round(getattr(nutrition, field), 1))) for field in NUTRITION_FIELDS}
+    meal = {
+        'user_id': user_id,
+        'timestamp': now.isoformat(),
+        'meal_id': str(uuid.uuid4()),
+        'menu': nutrition.menu,
+        **values,
+    }
+    if image_hash:
+        meal['image_hash'] = image_hash
+    day_period, week_period = meal_periods(now)
+
+    # 식단 기록 1건 + 일/주 롤업 누적을 한 트랜잭션으로 (일부만 저장돼서 기록과 합계가 어긋나지 않도록)
+    rollup_values = {**{f':{field}': value for field, value in values.items()}, ':one': 1}
+    # (리소스의 meta.client는 파이썬 값을 DynamoDB 형식으로 자동 변환)
+    transaction = [{'Put': {'TableName': meal_table.name, 'Item': meal}}]
+    if image_hash:
+        # 같은 날 같은 사진(캐시 적중, 재업로드)은 한 번만 기록 - 사진별 표시 항목이 이미 있으면 트랜잭션 전체가 취소됨
+        transaction.append({'Put': {
+            'TableName': meal_rollup_table.name,
+            'Item': {'user_id': user_id, 'period': f"{day_period}#IMG#{image_hash}", 'meal_id': meal['meal_id']},
+            'ConditionExpression': 'attribute_not_exists(period)',
+        }})
+    transaction += [
+        {'Update': {
+            'TableName': meal_rollup_table.name,
+            'Key': {'user_id': user_id, 'period': period},
+            'UpdateExpression': 'ADD calories :calories, carbs :carbs, protein :protein, fat :fat, meal_count :one',
+            'ExpressionAttributeValues': rollup_values,
+        }}
+        for period in (day_period, week_period)
+    ]
+    try:
+        await dynamodb_pool.run(dynamodb.meta.client.transact_write_items, TransactItems=transaction)
+    except ClientError as e:
+        reasons = e.response.get('CancellationReasons', [])
+        if not any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons):
+            raise
+        nutrition_stats["duplicates_skipped"] += 1
+        response = await dynamodb_pool.run(
+            meal_rollup_table.get_item, Key={'user_id': user_id, 'period': f"{day_period}#IMG#{image_hash}"}
         )
-        return {"status": "success", "message": "회원가입이 완료되었습니다!"}
+        logger.info(f"🔁 같은 날 이미 기록된 사진이라 식단 기록을 건너뜀 ({image_hash[:12]})")
+        return response.get('Item', {}).get('meal_id')
+    nutrition_stats["meals_recorded"] += 1
+    return meal['meal_id']
 
+def convert_decimals_to_numbers(obj):
+    if isinstance(obj, list):
+        return [convert_decimals_to_numbers(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: convert_decimals_to_numbers(v) for k, v in obj.items()}
+    elif isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    return obj
+
+def rollup_totals(item):
+    item = convert_decimals_to_numbers(item or {})
+    return {field: item.get(field, 0) for field in (*NUTRITION_FIELDS, "meal_count")}
+
+MEAL_ROLLUP_MAX_RETRIES = int(os.getenv("MEAL_ROLLUP_MAX_RETRIES", "5"))
+
+async def batch_get_rollups(keys):
+    # 스로틀링 등으로 처리되지 않은 키(UnprocessedKeys)는 백오프 후 다시 요청 - 못 읽은 날을 0으로 보여주지 않도록
+    request = {meal_rollup_table.name: {'Keys': keys}}
+    items = []
+    for attempt in range(MEAL_ROLLUP_MAX_RETRIES):
+        response = await dynamodb_pool.run(dynamodb.batch_get_item, RequestItems=request)
+        items += response.get('Responses', {}).get(meal_rollup_table.name, [])
+        request = response.get('UnprocessedKeys') or {}
+        if not request:
+            return items
+        await asyncio.sleep(0.05 * (2 ** attempt) * (0.5 + random.random()))
+    raise HTTPException(status_code=503, detail="식단 통계를 불러오지 못했습니다. 잠시 후 다시 시도해주세요.")
+
+# 18. API 엔드포인트: 식단 통계 (Meal Summary)
+@app.get("/meals/daily")
+async def meals_daily_endpoint(user_id: str, date: str | None = None):
+    try:
+        day = datetime.fromisoformat(date) if date else datetime.now(MEAL_TIMEZONE)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date는 YYYY-MM-DD 형식이어야 합니다.")
+    try:
+        period, _ = meal_periods(day)
+        response = await dynamodb_pool.run(meal_rollup_table.get_item, Key={'user_id': user_id, 'period': period})
+        return {
+            "status": "success",
+            "date": day.date().isoformat(),
+            "totals": rollup_totals(response.get('Item'))
+        }
     except Exception as e:
-        print(f"🚨 회원가입 에러: {e}")
+        logger.error(f"🚨 일간 식단 통계 에러: {e}")
+        raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
+
+@app.get("/meals/weekly")
+async def meals_weekly_endpoint(user_id: str, date: str | None = None):
+    # date가 속한 ISO 주(월~일)의 합계와 요일별 합계
+    try:
+        day = datetime.fromisoformat(date) if date else datetime.now(MEAL_TIMEZONE)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date는 YYYY-MM-DD 형식이어야 합니다.")
+    try:
+        day = day.astimezone(MEAL_TIMEZONE) if day.tzinfo else day
+        monday = day - timedelta(days=day.weekday())
+        days = [monday + timedelta(days=i) for i in range(7)]
+        _, week_period = meal_periods(day)
+        keys = [{'user_id': user_id, 'period': period} for period in [week_period] + [meal_periods(d)[0] for d in days]]
+
+        items = {item['period']: item for item in await batch_get_rollups(keys)}
+        return {
+            "status": "success",
+            "week": week_period[2:],
+            "totals": rollup_totals(items.get(week_period)),
+            "days": [
+                {"date": d.date().isoformat(), **rollup_totals(items.get(meal_periods(d)[0]))}
+                for d in days
+            ]
+        }
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"🚨 주간 식단 통계 에러: {e}")
         raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
 
 # 7. API 엔드포인트: 식단 사진 분석 (Analyze Food)
+# 프로필을 읽은 뒤의 사진 한 장 처리(전처리 -> 분석 -> 영양 정보 기록)는 /analyze-food/batch와 함께 씁니다.
+async def analyze_meal_photo(user_id, file, profile):
+    # 1. 이미지 전처리 (축소 + EXIF 제거 + 재압축 + 해시 계산)
+    # 업로드 임시 파일에서 바로 디코딩하므로 원본 전체를 메모리에 올리지 않음
+    with stage("image.preprocess"):
+        image_bytes, media_type, image_hash = await image_pool.run(preprocess_image, file.file, file.content_type)
+    await file.close()
+    image_stats["processed"] += 1
+    image_stats["bytes_in"] += file.size or 0
+    image_stats["bytes_out"] += len(image_bytes)
+
+    await save_to_dynamodb(user_id, 'user', f"📸 [사진 업로드] {file.filename} 분석 요청")
+
+    # 2. 같은 사진을 같은 페르소나로 분석한 결과가 있으면 재사용, 없으면 Bedrock 호출
+    cache_key = image_cache_key(image_hash, profile)
+    cached = image_cache.get(cache_key) if image_cache is not None else None
+    if cached:
+        image_stats["cache_hits"] += 1
+        logger.info(f"⚡ 같은 사진 분석 결과 재사용 ({image_hash})")
+        final_answer = personalize_answer(cached["reply"], profile, to_template=False)
+        prompt_version = cached.get("prompt_version")
+    else:
+        image_stats["cache_misses"] += 1
+        try:
+            final_answer, prompt_version = await generate_food_analysis(image_bytes, media_type, profile)
+        except ModelUnavailable as e:
+            logger.warning(f"⚠️ 모델 호출 불가, 안내 문구로 응답: {e}")
+            await save_to_dynamodb(user_id, 'ai', DEGRADED_FOOD_REPLY)
+            return {
+                "reply": DEGRADED_FOOD_REPLY,
+                "nutrition": None,
+                "meal_id": None,
+                "status": "degraded"
+            }
+        logger.info(f"🤖 AI 답변 생성 완료 (길이: {len(final_answer)}, 프롬프트 버전: {prompt_version})")
+        if image_cache is not None:
+            image_cache.set(cache_key, {
+                "reply": personalize_answer(final_answer, profile, to_template=True),
+                "prompt_version": prompt_version
+            })
+
+    # 3. 저장
+    await save_to_dynamodb(user_id, 'ai', final_answer, prompt_version=prompt_version)
+
+    # 4. 영양 정보 추출 및 식단 기록 (비회원은 기록하지 않음)
+    nutrition = await extract_nutrition(final_answer)
+    meal_id = None
+    if nutrition and profile:
+        try:
+            meal_id = await record_meal(user_id, nutrition, image_hash)
+        except Exception as e:
+            logger.warning(f"⚠️ 식단 기록 저장 실패: {e}")
+
+    return {
+        "reply": final_answer,
+        "nutrition": nutrition.model_dump() if nutrition else None,
+        "meal_id": meal_id,
+        "status": "success"
+    }
+
 @app.post("/analyze-food")
 async def analyze_food_endpoint(
     file: UploadFile = File(...),
     user_id: str = Form(...)
 ):
-    print(f"📸 식단 분석 요청: {file.filename} ({user_id})")
+    logger.info(f"📸 식단 분석 요청: {file.filename} ({user_id})")
     
     try:
-        # 1. 이미지 읽기 및 인코딩
-        image_bytes = await file.read()
-        encoded_image = base64.b64encode(image_bytes).decode("utf-8")
-        
-        save_to_dynamodb(user_id, 'user', f"📸 [사진 업로드] {file.filename} 분석 요청")
-
-        # 2. 유저 정보 및 페르소나 준비
-        profile = get_user_profile(user_id)
-        user_info_str = "정보 없음 (비회원)"
-        persona_style = "너는 30년 경력의 전문의 '김닥터'야. 환자에게 따뜻하게 대하고 의학적 사실에 기반해 답변해줘."
-
-        if profile:
-            age = int(profile['age'])
-            diabetes_type = profile.get('diabetes_type', '일반')
-            user_info_str = f"이름: {profile['name']}, 나이: {age}세, 진단명: {diabetes_type}"
-            persona_style = get_persona_by_age(age, diabetes_type)
-
-        # 3. System Prompt 구성 (페르소나 + 지시사항 + JSON 포맷)
-        system_prompt = f"""
-        당신은 당뇨 환자를 돕는 전문 의료 AI입니다.
-        아래 페르소나와 환자 정보를 바탕으로, 사용자가 업로드한 음식 사진을 분석하고 영양학적 조언을 해주세요.
-        
-        [페르소나 지침]
-        {persona_style}
-        
-        [환자 정보]
-        {user_info_str}
-        
-        [필수 지시사항]
-        1. 사진의 음식이 무엇인지 파악하고 메뉴 이름을 알려주세요.
-        2. 대략적인 칼로리와 탄수화물, 단백질, 지방을 추정하세요.
-        3. 당뇨 환자 관점에서 섭취 시 주의할 점(혈당 스파이크 등)을 친절하게 설명하세요.
-        4. ★필수: 답변의 맨 마지막에 반드시 아래 JSON 데이터만 정확히 추가하세요. 다른 설명 없이 JSON 블록만 있어야 합니다.
-        ###JSON_START###
-        {{
-            "menu": "메뉴 이름",
-            "calories": 0,
-            "carbs": 0,
-            "protein": 0,
-            "fat": 0
-        }}
-        ###JSON_END###
-        """
-
-        # 4. Bedrock Claude 3.5 호출 (Single Call)
-        model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-        payload = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1500,
-            "system": system_prompt, # System Prompt 사용
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": file.content_type,
-                                "data": encoded_image
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": "이 음식 사진을 분석해서 내 상태에 맞는 조언을 해줘."
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps(payload)
-        )
-        
-        response_body = json.loads(response.get("body").read())
-        final_answer = response_body["content"][0]["text"]
-        print(f"🤖 AI 답변 생성 완료 (길이: {len(final_answer)})")
-        
-        # 5. 저장 및 리턴
-        save_to_dynamodb(user_id, 'ai', final_answer)
-        
-        return {
-            "reply": final_answer,
-            "status": "success"
-        }
+        # 유저 정보 조회 후 분석
+        profile = await get_user_profile(user_id)
+        return await analyze_meal_photo(user_id, file, profile)
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
-        print(f"🚨 식단 분석 에러: {str(e)}")
+        logger.error(f"🚨 식단 분석 에러: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
     except Exception as e:
-        print(f"🚨 회원가입 에러: {e}")
+        logger.error(f"🚨 회원가입 에러: {e}")
         raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
 
 # 8. API 엔드포인트: 로그인 (Login)
 @app.post("/login")
 async def login_endpoint(request: LoginRequest):
-    print(f"🔑 로그인 요청: {request.user_id}")
+    logger.info(f"🔑 로그인 요청: {request.user_id}")
     try:
-        response = user_table.get_item(Key={'user_id': request.user_id})
-        if 'Item' not in response:
+        item = await fetch_user_credentials(request.user_id)
+        if not item:
              raise HTTPException(status_code=401, detail="존재하지 않는 아이디입니다.")
         
-        item = response['Item']
         if item['password'] != request.password:
             raise HTTPException(status_code=401, detail="비밀번호가 일치하지 않습니다.")
             
-        print(f"✅ 로그인 성공: {item['name']}")
+        logger.info(f"✅ 로그인 성공: {item['name']}")
         
         # 상세 정보 가져오기
         details = item.get('details', {})
@@ -488,5 +2671,287 @@ async def login_endpoint(request: LoginRequest):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"🚨 로그인 에러: {e}")
-        raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
\ No newline at end of file
+        logger.error(f"🚨 로그인 에러: {e}")
+        raise HTTPException(status_code=500, detail="서버 오류가 발생했습니다.")
+
+# 9. API 엔드포인트: 서버 상태 (Stats)
+@app.get("/stats")
+async def stats_endpoint():
+    return {
+        "pools": {
+            "bedrock": bedrock_pool.stats(),
+            "dynamodb": dynamodb_pool.stats(),
+        },
+        "aws_clients": get_aws_client_stats(),
+        "hedge": get_hedge_stats(),
+        "answer_cache": get_answer_cache_stats(),
+        "profile_cache": get_profile_cache_stats(),
+        "chat_log": chat_log_writer.get_stats(),
+        "chat_history_cache": recent_turns_cache.stats if recent_turns_cache else {"enabled": False},
+        "conversation": get_conversation_stats(),
+        "image": get_image_stats(),
+        "nutrition": nutrition_stats,
+        "rag": get_rag_stats(),
+        "model_gateway": get_model_gateway_stats(),
+        "batch": batch_stats,
+        "server": {"status": server_state["status"], "pid": server_state["pid"], "workers": WORKER_COUNT, **in_flight.get_stats()},
+    }
+
+# 20. API 엔드포인트: 지표 (Prometheus Metrics)
+# 히스토그램/카운터에 더해 풀 대기열과 서킷 브레이커 상태를 스크레이프 시점 값(gauge)으로 내보냅니다.
+def render_gauges():
+    lines = ["# TYPE caremeal_pool_in_flight gauge", "# TYPE caremeal_pool_queued gauge"]
+    for pool in (bedrock_pool, dynamodb_pool, image_pool):
+        lines.append(f'caremeal_pool_in_flight{{pool="{pool.name}"}} {pool.in_flight}')
+        lines.append(f'caremeal_pool_queued{{pool="{pool.name}"}} {pool.queued}')
+    lines += ["# TYPE caremeal_model_breaker_open gauge", "# TYPE caremeal_model_gateway_queued gauge"]
+    for name, gateway in model_gateways.items():
+        lines.append(f'caremeal_model_breaker_open{{model="{name}"}} {int(gateway.state != "closed")}')
+        lines.append(f'caremeal_model_gateway_queued{{model="{name}"}} {gateway.queued}')
+    lines.append("# TYPE caremeal_model_coalesced_total counter")
+    for name, gateway in model_gateways.items():
+        lines.append(f'caremeal_model_coalesced_total{{model="{name}"}} {gateway.counters["coalesced"]}')
+    return lines
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    lines = []
+    for metric in (http_request_seconds, stage_seconds, bedrock_tokens):
+        lines += metric.render()
+    lines += render_gauges()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# 21. API 엔드포인트: 일괄 처리 (Batch)
+# 하루치 식단 사진이나 여러 질문을 요청 한 번으로 받아 프로필(과 대화 맥락)은 한 번만 읽고,
+# 항목별 처리는 BATCH_MAX_CONCURRENCY개까지 동시에 실행해 끝나는 순서대로 NDJSON 한 줄씩 보냅니다.
+# 각 줄의 index는 요청 안의 순서이고, 마지막 줄은 {"done": true, ...} 요약입니다.
+# 항목 하나가 실패해도 나머지는 계속 처리합니다. (실패 항목은 status: error)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+batch_stats = {"requests": 0, "items": 0, "errors": 0}
+
+def ndjson_line(data):
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+async def iter_batch_results(items, handler):
+    # (index, 결과)를 끝나는 순서대로 - 동시에 실행되는 항목 수는 세마포어로 제한
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run_item(index, item):
+        async with semaphore:
+            try:
+                return index, await handler(item)
+            except HTTPException as he:
+                return index, {"status": "error", "detail": he.detail}
+            except Exception as e:
+                logger.error(f"🚨 일괄 처리 항목 에러 ({index}): {e}")
+                return index, {"status": "error", "detail": str(e)}
+
+    tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(items)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # 클라이언트가 연결을 끊으면 아직 시작하지 않은 항목은 취소
+        for task in tasks:
+            task.cancel()
+
+async def batch_stream(items, handler, describe):
+    started = time.perf_counter()
+    statuses = Counter()
+    batch_stats["requests"] += 1
+    async for index, result in iter_batch_results(items, handler):
+        statuses[result.get("status", "error")] += 1
+        batch_stats["items"] += 1
+        if result.get("status") == "error":
+            batch_stats["errors"] += 1
+        yield ndjson_line({"index": index, **describe(index), **result})
+    yield ndjson_line({
+        "done": True,
+        "count": len(items),
+        **statuses,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+def check_batch_size(count):
+    if count == 0:
+        raise HTTPException(status_code=400, detail="처리할 항목이 없습니다.")
+    if count > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"한 번에 최대 {BATCH_MAX_ITEMS}개까지 보낼 수 있습니다.")
+
+@app.post("/analyze-food/batch")
+async def analyze_food_batch_endpoint(
+    files: list[UploadFile] = File(...),
+    user_id: str = Form(...)
+):
+    logger.info(f"📸 식단 일괄 분석 요청: {len(files)}장 ({user_id})")
+    check_batch_size(len(files))
+    profile = await get_user_profile(user_id)
+
+    # 업로드 파일은 응답을 다 보낼 때까지 열려 있으므로 스트리밍하면서 한 장씩 읽어도 됨
+    return StreamingResponse(
+        in_flight.track(batch_stream(
+            files,
+            lambda file: analyze_meal_photo(user_id, file, profile),
+            lambda index: {"filename": files[index].filename}
+        )),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: ChatBatchRequest):
+    logger.info(f"📩 채팅 일괄 요청: {len(request.questions)}개 ({request.user_id})")
+    check_batch_size(len(request.questions))
+    profile = await get_user_profile(request.user_id)
+    context = await build_conversation_context(request.user_id, profile)
+
+    # 질문끼리는 서로의 답변을 맥락으로 쓰지 않음 (요청 전의 대화 맥락만 공유)
+    return StreamingResponse(
+        in_flight.track(batch_stream(
+            request.questions,
+            lambda question: answer_chat(request.user_id, question, profile, context),
+            lambda index: {"question": request.questions[index]}
+        )),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 22. 서버 수명 주기 (Warm-up / Readiness / Drain)
+# 기동: 요청은 바로 받되, 백그라운드에서 AWS 클라이언트 생성(botocore 서비스 모델 로딩), DynamoDB 연결 맺기,
+#       페르소나 프롬프트 렌더링을 미리 끝낸 뒤 /ready를 200으로 바꿉니다. (로드밸런서는 /ready를 보고 트래픽을 보냄)
+#       워밍업이 일부 실패해도 준비 완료로 봅니다. (첫 요청이 느릴 뿐 처리는 가능하므로)
+# 종료: /ready를 503으로 바꾸고, 진행 중인 스트리밍 응답과 백그라운드 작업(대화 요약)이 끝나기를
+#       SHUTDOWN_DRAIN_SECONDS까지 기다린 뒤 채팅 로그와 애플리케이션 로그를 비웁니다.
+#       (uvicorn은 lifespan 종료 전에 열린 연결을 같은 시간만큼 기다려 주므로 여기서는 남은 작업을 마저 기다림)
+WARMUP_ENABLED = os.getenv("WARMUP", "1") == "1"
+WARMUP_DIABETES_TYPES = [t for t in os.getenv("WARMUP_DIABETES_TYPES", "일반,당뇨병,고혈압,고지혈증,비만,신부전,일반건강").split(",") if t]
+WARMUP_PROBE_USER_ID = "__warmup__"  # 없는 아이디 GetItem 1회 (0.5 RCU)로 연결만 맺음
+SHUTDOWN_DRAIN_SECONDS = int(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+server_state = {"status": "starting", "pid": os.getpid(), "started_at": time.time(), "warmup_ms": None, "warmup_errors": []}
+
+class InFlightTracker:
+    # 종료 시 기다려야 할 작업: 스트리밍 응답(본문을 다 보낼 때까지)과 응답 후에 도는 백그라운드 작업
+    def __init__(self):
+        self.streams = 0
+        self.tasks = set()
+        self.stats = {"streams": 0, "background_tasks": 0, "abandoned_at_shutdown": 0}
+
+    async def track(self, stream):
+        self.streams += 1
+        self.stats["streams"] += 1
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self.streams -= 1
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        self.stats["background_tasks"] += 1
+        return task
+
+    async def drain(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self.streams or self.tasks) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.streams + len(self.tasks)
+
+    def get_stats(self):
+        return {**self.stats, "active_streams": self.streams, "active_background_tasks": len(self.tasks)}
+
+in_flight = InFlightTracker()
+
+def warm_up():
+    errors = []
+    # 1) 클라이언트 생성 - 첫 요청에서 하던 서비스 모델 JSON 로딩/엔드포인트 해석을 미리
+    #    (벤치마크처럼 대역 객체로 바꿔 끼운 경우는 건너뜀)
+    for name, client in (
+        ("bedrock_agent", bedrock_agent), ("bedrock_runtime", bedrock_runtime), ("dynamodb", dynamodb),
+        ("user_table", user_table), ("chat_table", chat_table),
+        ("meal_table", meal_table), ("meal_rollup_table", meal_rollup_table),
+    ):
+        if isinstance(client, LazyAWSClient):
+            try:
+                client._get()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+
+    # 2) DynamoDB 연결(TCP/TLS)을 미리 맺어 첫 로그인이 핸드셰이크를 기다리지 않게 함
+    #    Bedrock은 호출 비용이 드는 API만 있어 연결은 첫 요청 때 맺음
+    try:
+        with stage("warmup.dynamodb"):
+            user_table.get_item(Key={'user_id': WARMUP_PROBE_USER_ID})
+    except Exception as e:
+        errors.append(f"dynamodb: {e}")
+
+    # 3) 페르소나 프롬프트 - 비회원 + 연령대 x 진단명 조합을 미리 렌더링 (render_persona의 lru_cache에 남음)
+    render_persona(None)
+    for bracket in PERSONA_BY_BRACKET:
+        for diabetes_type in WARMUP_DIABETES_TYPES:
+            render_persona(bracket, diabetes_type)
+    return errors
+
+async def run_warmup():
+    server_state["status"] = "warming_up"
+    started = time.perf_counter()
+    errors = await asyncio.to_thread(warm_up) if WARMUP_ENABLED else []
+    server_state["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    server_state["warmup_errors"] = errors
+    server_state["status"] = "ready"
+    for error in errors:
+        logger.warning(f"⚠️ 워밍업 실패 (첫 요청 때 다시 시도): {error}")
+    logger.info(f"🔥 워밍업 완료: {server_state['warmup_ms']}ms (pid {server_state['pid']})")
+
+async def drain_in_flight():
+    remaining = await in_flight.drain(SHUTDOWN_DRAIN_SECONDS)
+    if remaining:
+        in_flight.stats["abandoned_at_shutdown"] += remaining
+        logger.warning(f"⚠️ 종료 대기 시간({SHUTDOWN_DRAIN_SECONDS}초) 안에 끝나지 않은 작업 {remaining}건을 중단합니다.")
+
+def flush_logs(timeout=2.0):
+    # QueueListener 스레드가 큐에 남은 로그를 다 출력할 때까지 잠깐 기다림 (프로세스 종료 시에는 atexit에서도 비움)
+    deadline = time.monotonic() + timeout
+    while not log_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    log_handler.flush()
+
+@app.get("/ready")
+async def ready_endpoint():
+    body = {
+        "status": server_state["status"],
+        "pid": server_state["pid"],
+        "workers": WORKER_COUNT,
+        "uptime_s": round(time.time() - server_state["started_at"], 1),
+        "warmup_ms": server_state["warmup_ms"],
+        "warmup_errors": server_state["warmup_errors"],
+        "in_flight": in_flight.get_stats(),
+    }
+    if server_state["status"] != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+# 23. 서버 실행 (python main.py)
+# WEB_CONCURRENCY개의 워커 프로세스로 띄웁니다. HOST/PORT로 주소를 바꿀 수 있습니다.
+# 워커끼리 캐시를 나눠 쓰려면 CACHE_BACKEND=disk(같은 호스트) 또는 redis를 함께 설정하세요.
+if __name__ == "__mp_main__":
+    # spawn으로 뜬 워커는 부모의 main.py를 __mp_main__으로 먼저 실행하므로,
+    # 이어지는 "main:app" import가 모듈을 한 번 더 읽지 않고(로그 핸들러/캐시/메모리 중복) 이 모듈을 쓰게 함
+    sys.modules.setdefault("main", sys.modules[__name__])
+
+if __name__ == "__main__":
+    uvicorn.run(
+        # 워커가 여러 개면 각 워커가 모듈을 새로 import해야 하므로 경로 문자열로 넘김
+        app if WORKER_COUNT == 1 else "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=WORKER_COUNT,
+        timeout_graceful_shutdown=SHUTDOWN_DRAIN_SECONDS,
+        log_level=os.getenv("LOG_LEVEL", "INFO").lower(),
+        access_log=os.getenv("ACCESS_LOG", "0") == "1",
+    )